@@ -1,7 +1,7 @@
 # Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
 # Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
 
-from flask import Flask, render_template, request, redirect, url_for, session, g, flash, jsonify, make_response
+from flask import Flask, render_template, stream_template, stream_with_context, send_file, request, redirect, url_for, session, g, flash, jsonify, make_response, Response
 import sqlite3
 import os
 import logging
@@ -9,7 +9,43 @@ from datetime import datetime, timedelta
 import pytz
 from flask_bcrypt import Bcrypt
 import json
+import queue
 import re
+import threading
+import time
+from app.database import ConnectionPool
+from app.migrations import run_migrations, get_schema_version, has_column
+from app.services.attendance_service import (
+    parse_timestamp, normalize_timestamp, to_epoch, from_epoch, today_local,
+    day_bounds, month_bounds, period_bounds,
+    refresh_daily_summary, refresh_daily_summaries, forget_daily_summaries,
+    day_attendance_json, breaks_by_attendance, breaks_batch_json, history_query,
+    OPEN_SESSION_SQL, CLOSE_SESSION_SQL, STATUS_SQL, RECORD_COUNT_SQL, RECORD_MONTHS_SQL, HISTORY_PAGE_ORDER
+)
+from app.services.consent_service import (
+    CURRENT_CONSENT_SQL, CONSENT_COUNT_SQL, CONSENT_HISTORY_SQL, record_consent, record_consents, forget_consents
+)
+from app.services.break_service import (
+    SETTINGS_SQL, Session, plan_break, record_break_plan, policy_for_user, load_session,
+    recompute_breaks
+)
+from app.services.report_service import (
+    REPORT_PAGE_SIZE, REPORT_CACHE_MAX_ROWS, report_rows, report_totals, report_totals_by_user,
+    encode_cursor, decode_cursor, report_version, period_is_closed,
+)
+from app.services.report_cache import ReportCache
+from app.services.export_jobs import EXPORT_KINDS, ExportJobQueue, ExportQueueFull
+from app.services.user_service import EMPLOYEE_ID_SQL, USER_PAGE_SIZE, list_users, normalize_user_sort, user_display
+from app.services.export_service import (
+    USER_EXPORT_HEADER, csv_stream, iter_batches, select_users_for_export, format_user_row,
+    select_user_for_export, select_user_attendance_for_export, user_export_csv, user_export_json,
+)
+from app.services.status_bus import StatusBus
+from app.services.version_service import (
+    SYSTEM_USER_ID, bump_directory_version, bump_user_version, get_user_version, forget_user_version,
+    bump_all_report_months,
+)
+from app.services.user_directory import UserDirectory
 
 # Configure logging
 logging.basicConfig(
@@ -23,50 +59,32 @@ logging.basicConfig(
 
 # Helper function to parse datetime strings
 def try_parse(date_string):
-    """Try to parse a datetime string in various formats."""
-    if not date_string:
-        return None
-    
-    formats = [
-        # Standard formats
-        '%Y-%m-%d %H:%M:%S',
-        '%Y-%m-%d %H:%M:%S.%f',
-        '%Y-%m-%dT%H:%M:%S',
-        '%Y-%m-%dT%H:%M:%S.%f',
-        # Formats with timezone info
-        '%Y-%m-%d %H:%M:%S%z',
-        '%Y-%m-%d %H:%M:%S.%f%z',
-        '%Y-%m-%dT%H:%M:%S%z',
-        '%Y-%m-%dT%H:%M:%S.%f%z'
-    ]
-    
-    for fmt in formats:
-        try:
-            return datetime.strptime(date_string, fmt)
-        except ValueError:
-            continue
-    
-    # If standard parsing fails, try using dateutil as a fallback
-    try:
-        from dateutil import parser
-        return parser.parse(date_string)
-    except:
-        pass
-    
-    return None
+    """Parse a stored datetime string into an aware local datetime."""
+    return parse_timestamp(date_string)
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # Change this in production
 bcrypt = Bcrypt(app)
 DATABASE = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'attendance.db')
+db_pool = ConnectionPool(DATABASE)
+# Every open status stream holds a request thread until the tab closes: one
+# thread of the threaded dev server, or one whole worker under gunicorn's sync
+# worker class (use gthread with more threads than this cap). Beyond the cap
+# the dashboard falls back to polling.
+STATUS_STREAM_MAX = 50
+status_bus = StatusBus(max_subscribers=STATUS_STREAM_MAX)
+report_cache = ReportCache()
+# id -> username, display name, role, status and department of every user
+user_directory = UserDirectory()
+# Background exports; finished files are kept in the spool directory until they expire
+EXPORT_SPOOL_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'exports')
+export_jobs = ExportJobQueue(lambda: db_pool.connection(), EXPORT_SPOOL_DIR)
 
 # Helper functions for templates
 def get_duration(start_time, end_time):
     """Calculate the duration between two time strings."""
     try:
-        start = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S')
-        end = datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S')
-        diff = end - start
+        diff = parse_timestamp(end_time) - parse_timestamp(start_time)
         # Calculate total seconds including days
         total_seconds = int(diff.total_seconds())
         hours = total_seconds // 3600
@@ -98,185 +116,77 @@ def get_local_time():
     """Get the current time in CEST (Central European Summer/Winter Time)"""
     return datetime.now(pytz.timezone(TIMEZONE))
 
+def format_epoch(epoch):
+    """Format epoch seconds as local 'DD.MM.YYYY HH:MM', '-' for None."""
+    if epoch is None:
+        return "-"
+    return from_epoch(epoch).strftime('%d.%m.%Y %H:%M')
+
+def login_url():
+    """Return the URL users log in at, as printed on credentials and datasheets."""
+    if request.host.startswith('localhost') or request.host.startswith('127.0.0.1'):
+        return f"http://{request.host}"
+    return f"https://{request.host}"
+
+# Check-outs cluster at the end of the day; the whole write transaction should
+# stay well below this so that queued writers do not run into busy_timeout.
+CHECKOUT_LATENCY_BUDGET_MS = 50
+
+_checkout_latency_lock = threading.Lock()
+_checkout_latency = {'count': 0, 'over_budget': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0}
+
+def record_checkout_latency(elapsed_ms, user_id):
+    """Track check-out latency and warn when the budget is exceeded."""
+    with _checkout_latency_lock:
+        _checkout_latency['count'] += 1
+        _checkout_latency['total_ms'] += elapsed_ms
+        _checkout_latency['last_ms'] = elapsed_ms
+        _checkout_latency['max_ms'] = max(_checkout_latency['max_ms'], elapsed_ms)
+        if elapsed_ms > CHECKOUT_LATENCY_BUDGET_MS:
+            _checkout_latency['over_budget'] += 1
+    if elapsed_ms > CHECKOUT_LATENCY_BUDGET_MS:
+        logging.warning(f"Checkout for user {user_id} took {elapsed_ms:.1f} ms "
+                        f"(budget {CHECKOUT_LATENCY_BUDGET_MS} ms)")
+
+def checkout_latency_stats():
+    """Return a snapshot of the check-out latency statistics."""
+    with _checkout_latency_lock:
+        stats = dict(_checkout_latency)
+    stats['avg_ms'] = round(stats['total_ms'] / stats['count'], 2) if stats['count'] else 0.0
+    for key in ('total_ms', 'max_ms', 'last_ms'):
+        stats[key] = round(stats[key], 2)
+    stats['budget_ms'] = CHECKOUT_LATENCY_BUDGET_MS
+    return stats
+
 def get_db():
+    """Get the pooled database connection for the current app context."""
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
+        db = g._database = db_pool.acquire()
     return db
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
 
 def check_and_fix_db_schema():
-    """Check and fix database schema issues."""
+    """Bring the database schema up to date by applying pending migrations."""
     print("Checking and fixing database schema...")
     
     with app.app_context():
         db = get_db()
-        cursor = db.cursor()
-        
-        # Check if is_admin column exists in users table
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'is_admin' not in columns:
-            print("Adding is_admin column to users table...")
-            try:
-                cursor.execute("ALTER TABLE users ADD COLUMN is_admin BOOLEAN DEFAULT 0")
-                # Set the admin user as admin (username = 'admin')
-                cursor.execute("UPDATE users SET is_admin = 1 WHERE username = 'admin'")
-                db.commit()
-                print("Added is_admin column successfully and set admin user")
-            except sqlite3.Error as e:
-                print(f"Error adding column: {e}")
-        
-        # Add new enhanced user fields
-        enhanced_user_columns = {
-            'first_name': 'TEXT',
-            'last_name': 'TEXT', 
-            'employee_id': 'TEXT',
-            'user_role': 'TEXT DEFAULT "employee"',
-            'department': 'TEXT',
-            'account_status': 'TEXT DEFAULT "active"',
-            'created_at': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
-            'updated_at': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP'
-        }
-        
-        for column_name, column_def in enhanced_user_columns.items():
-            if column_name not in columns:
-                print(f"Adding {column_name} column to users table...")
-                try:
-                    cursor.execute(f'ALTER TABLE users ADD COLUMN {column_name} {column_def}')
-                    db.commit()
-                    print(f"Added {column_name} column successfully")
-                except sqlite3.Error as e:
-                    print(f"Error adding column {column_name}: {e}")
+        applied = run_migrations(db)
         
-        # Update existing users with default values for new fields
-        try:
-            print("Updating existing users with default values...")
-            
-            # Set default user_role for existing users
-            cursor.execute("UPDATE users SET user_role = 'employee' WHERE user_role IS NULL OR user_role = ''")
-            
-            # Set admin role for admin users
-            cursor.execute("UPDATE users SET user_role = 'admin' WHERE is_admin = 1")
-            
-            # Set default account_status for existing users
-            cursor.execute("UPDATE users SET account_status = 'active' WHERE account_status IS NULL OR account_status = ''")
-            
-            # Set created_at for existing users (use current timestamp as fallback)
-            current_time = get_local_time().strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute("UPDATE users SET created_at = ? WHERE created_at IS NULL OR created_at = ''", (current_time,))
-            cursor.execute("UPDATE users SET updated_at = ? WHERE updated_at IS NULL OR updated_at = ''", (current_time,))
-            
-            db.commit()
-            print("Updated existing users with default values")
-            
-        except sqlite3.Error as e:
-            print(f"Error updating existing users: {e}")
-                
-        # Check if the arbzg_breaks_enabled column exists in user_settings
-        cursor.execute("PRAGMA table_info(user_settings)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'arbzg_breaks_enabled' not in columns:
-            print("Adding arbzg_breaks_enabled column to user_settings...")
-            try:
-                cursor.execute("ALTER TABLE user_settings ADD COLUMN arbzg_breaks_enabled BOOLEAN DEFAULT 1")
-                cursor.execute("UPDATE user_settings SET arbzg_breaks_enabled = 1")
-                db.commit()
-                print("Added arbzg_breaks_enabled column successfully")
-            except sqlite3.Error as e:
-                print(f"Error adding column: {e}")
-        
-        # Add lunch period preference columns
-        lunch_period_columns = [
-            ('lunch_period_start_hour', 'INTEGER DEFAULT 11'),
-            ('lunch_period_start_minute', 'INTEGER DEFAULT 30'),
-            ('lunch_period_end_hour', 'INTEGER DEFAULT 14'),
-            ('lunch_period_end_minute', 'INTEGER DEFAULT 0')
-        ]
-        
-        for column_name, column_def in lunch_period_columns:
-            if column_name not in columns:
-                print(f"Adding {column_name} column to user_settings...")
-                try:
-                    cursor.execute(f"ALTER TABLE user_settings ADD COLUMN {column_name} {column_def}")
-                    db.commit()
-                    print(f"Added {column_name} column successfully")
-                except sqlite3.Error as e:
-                    print(f"Error adding column {column_name}: {e}")
-        
-        # Check if the description column exists in breaks table
-        cursor.execute("PRAGMA table_info(breaks)")
-        break_columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'description' not in break_columns:
-            print("Adding description column to breaks table...")
-            try:
-                cursor.execute("ALTER TABLE breaks ADD COLUMN description TEXT")
-                db.commit()
-                print("Added description column successfully")
-            except sqlite3.Error as e:
-                print(f"Error adding column: {e}")
-        
-        # Check if the original_username column exists in deletion_requests table
-        cursor.execute("PRAGMA table_info(deletion_requests)")
-        deletion_columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'original_username' not in deletion_columns:
-            print("Adding original_username column to deletion_requests table...")
-            try:
-                cursor.execute("ALTER TABLE deletion_requests ADD COLUMN original_username TEXT")
-                db.commit()
-                print("Added original_username column successfully")
-            except sqlite3.Error as e:
-                print(f"Error adding column: {e}")
-        
-        # Ensure all existing users have user_settings records
-        try:
-            print("Ensuring all users have user_settings records...")
-            cursor.execute('''
-                INSERT INTO user_settings (user_id, auto_break_detection_enabled, auto_break_threshold_minutes, exclude_breaks_from_billing, arbzg_breaks_enabled)
-                SELECT u.id, 1, 30, 1, 1
-                FROM users u
-                WHERE u.id NOT IN (SELECT user_id FROM user_settings WHERE user_id IS NOT NULL)
-            ''')
-            db.commit()
-            print("Created missing user_settings records")
-        except sqlite3.Error as e:
-            print(f"Error creating user_settings records: {e}")
-        
-        # Ensure all existing users have consent records with default 'pending' status
-        try:
-            print("Ensuring all users have consent records...")
-            current_time = get_local_time().strftime('%Y-%m-%d %H:%M:%S')
-            cursor.execute('''
-                INSERT INTO user_consents (user_id, consent_status, consent_date)
-                SELECT u.id, 'pending', ?
-                FROM users u
-                WHERE u.id NOT IN (SELECT user_id FROM user_consents WHERE user_id IS NOT NULL)
-            ''', (current_time,))
-            db.commit()
-            print("Created missing consent records")
-        except sqlite3.Error as e:
-            print(f"Error creating consent records: {e}")
-        
-        # Add missing last_login column to users table
-        if 'last_login' not in columns:
-            print("Adding last_login column to users table...")
-            try:
-                cursor.execute("ALTER TABLE users ADD COLUMN last_login TIMESTAMP")
-                db.commit()
-                print("Added last_login column successfully")
-            except sqlite3.Error as e:
-                print(f"Error adding last_login column: {e}")
-        
-        print("Database schema check and fix completed")
+        if applied:
+            print(f"Applied schema migrations: {', '.join(str(version) for version in applied)}")
+        print(f"Database schema is at version {get_schema_version(db)}")
+
+
+def schema_has_column(table, column):
+    """Check the cached schema capability map instead of probing the database."""
+    return has_column(get_db(), table, column)
 
 
 def migrate_existing_user_data():
@@ -321,6 +231,7 @@ def migrate_existing_user_data():
                 except sqlite3.Error as e:
                     print(f"Error migrating user {username}: {e}")
             
+            bump_directory_version(cursor)
             db.commit()
             print("User data migration completed successfully")
             
@@ -436,23 +347,19 @@ def index():
     
     print(f"User logged in: {session.get('username')}")
     
-    # Use direct connection to ensure consistent row factory
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Admin can see all users
+    # Admins pick users through the typeahead (api_lookup_users)
     if session.get('admin_logged_in'):
         print("Admin-Benutzer erkannt")
-        cursor.execute('SELECT id, username FROM users')
-        users = cursor.fetchall()
+        users = []
     else:
         # Regular users can only see themselves
         print("Regulärer Benutzer erkannt")
-        cursor.execute('SELECT id, username FROM users WHERE id = ?', (session.get('user_id'),))
-        users = cursor.fetchall()
+        user = user_directory.get(cursor, session.get('user_id'))
+        users = [user] if user else []
     
-    conn.close()
     return render_template('index.html', users=users)
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -464,11 +371,8 @@ def login():
         password = request.form['password']
         print(f"Login attempt for username: {username}")
         
-        # Connect directly to database
         try:
-            # Use direct connection instead of get_db() to avoid potential issues with g context
-            conn = sqlite3.connect(DATABASE)
-            conn.row_factory = sqlite3.Row
+            conn = get_db()
             cursor = conn.cursor()
             
             # Check if the user exists
@@ -499,7 +403,6 @@ def login():
                         print(f"Login successful for {username}")
                         print(f"Session: {session}")
                         
-                        conn.close()
                         flash('Du wurdest erfolgreich eingeloggt!', 'success')
                         
                         # Log the successful login
@@ -507,18 +410,15 @@ def login():
                         
                         return redirect(url_for('index'))
                     else:
-                        conn.close()
                         print(f"Passwortvalidation fehlgeschlagen für {username}")
                         flash('Ungültige Benutzername oder Passwort', 'error')
                         return render_template('login.html')
                 except Exception as e:
-                    conn.close()
                     print(f"Passwortvalidationfehler: {str(e)}")
                     logging.error(f"Passwortvalidationfehler: {str(e)}")
                     flash('Ein Fehler ist während dem Login aufgetreten', 'error')
                     return render_template('login.html')
             else:
-                conn.close()
                 print(f"Benutzer nicht gefunden: {username}")
                 flash('Ungültige Benutzername oder Passwort', 'error')
                 return render_template('login.html')
@@ -548,7 +448,6 @@ def deletion_requests():
         return redirect(url_for('index'))
     
     db = get_db()
-    db.row_factory = sqlite3.Row  # Enable named column access
     cursor = db.cursor()
     
     # Get all deletion requests with user details
@@ -557,7 +456,7 @@ def deletion_requests():
                COALESCE(dr.original_username, u.username) as username, 
                dr.request_date, dr.reason, dr.status, 
                dr.admin_notes, dr.processed_by, dr.processed_date,
-               (SELECT COUNT(*) FROM attendance WHERE user_id = dr.user_id) as record_count
+               (SELECT COALESCE(SUM(session_count), 0) FROM daily_summaries WHERE user_id = dr.user_id) as record_count
         FROM deletion_requests dr
         JOIN users u ON dr.user_id = u.id
         ORDER BY 
@@ -581,10 +480,7 @@ def deletion_requests():
     admin_usernames = {}
     for req in requests:
         if req['processed_by']:  # If processed_by is not null
-            if req['processed_by'] not in admin_usernames:
-                cursor.execute('SELECT username FROM users WHERE id = ?', (req['processed_by'],))
-                result = cursor.fetchone()
-                admin_usernames[req['processed_by']] = result['username'] if result else "Unknown"
+            admin_usernames[req['processed_by']] = user_directory.username(cursor, req['processed_by'], "Unknown")
     
     message = request.args.get('message')
     message_type = request.args.get('message_type', 'info')
@@ -607,7 +503,6 @@ def process_deletion_request(request_id):
     admin_notes = request.form.get('admin_notes', '')
     
     db = get_db()
-    db.row_factory = sqlite3.Row
     cursor = db.cursor()
     
     now = datetime.now().isoformat()
@@ -646,6 +541,8 @@ def process_deletion_request(request_id):
             
             # Delete user's attendance data
             cursor.execute('DELETE FROM attendance WHERE user_id = ?', (user_id,))
+            forget_daily_summaries(cursor, user_id)
+            bump_user_version(cursor, user_id)
             
             # Anonymize the user rather than delete them
             cursor.execute('''
@@ -654,6 +551,7 @@ def process_deletion_request(request_id):
                     password = 'DELETED'
                 WHERE id = ?
             ''', (user_id,))
+            bump_directory_version(cursor)
             
             # Commit transaction
             db.commit()
@@ -682,45 +580,67 @@ def process_deletion_request(request_id):
     
     return redirect(url_for('deletion_requests'))
 
+def versioned_json(scope, user_id, build, per_day=False):
+    """Answer a JSON GET with an ETag derived from the user's change version.
+
+    build(cursor) only runs when the client's copy is outdated; otherwise the
+    answer is a 304 without touching the attendance tables. build may return
+    JSON text produced by SQLite, which is sent as is. per_day adds the
+    current day for answers that depend on "today".
+    """
+    cursor = get_db().cursor()
+    user_version, system_version = get_user_version(cursor, user_id)
+    etag = f'{scope}-{user_id}-{user_version}-{system_version}'
+    if per_day:
+        etag += f'-{today_local()}'
+    
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        payload = build(cursor)
+        if isinstance(payload, str):
+            response = Response(payload, mimetype='application/json')
+        else:
+            response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/get_user_settings')
 def get_user_settings():
     if 'user_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     
     user_id = session['user_id']
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    # Get user settings
-    cursor.execute('SELECT * FROM user_settings WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    
-    settings = {}
-    
-    if result:
-        # Convert row to dict
-        settings = {key: result[key] for key in result.keys()}
-    
-    # Check if notification_preferences column exists in users table
-    cursor.execute("PRAGMA table_info(users)")
-    columns = [column[1] for column in cursor.fetchall()]
     
-    if 'notification_preferences' in columns:
-        # Also check for notification preferences if they exist
-        cursor.execute('SELECT notification_preferences FROM users WHERE id = ?', (user_id,))
-        user_result = cursor.fetchone()
+    def build(cursor):
+        # Get user settings
+        cursor.execute(SETTINGS_SQL, (user_id,))
+        result = cursor.fetchone()
         
-        # Add notification preferences if they exist
-        if user_result and user_result['notification_preferences']:
-            try:
-                notification_prefs = json.loads(user_result['notification_preferences'])
-                settings.update(notification_prefs)
-            except:
-                pass
+        settings = {}
+        
+        if result:
+            # Convert row to dict
+            settings = {key: result[key] for key in result.keys()}
+        
+        # notification_preferences is optional and only read if the schema has it
+        if schema_has_column('users', 'notification_preferences'):
+            # Also check for notification preferences if they exist
+            cursor.execute('SELECT notification_preferences FROM users WHERE id = ?', (user_id,))
+            user_result = cursor.fetchone()
+            
+            # Add notification preferences if they exist
+            if user_result and user_result['notification_preferences']:
+                try:
+                    notification_prefs = json.loads(user_result['notification_preferences'])
+                    settings.update(notification_prefs)
+                except:
+                    pass
+        
+        return settings
     
-    conn.close()
-    return jsonify(settings)
+    return versioned_json('settings', user_id, build)
 
 @app.route('/get_today_attendance/<int:user_id>')
 def get_today_attendance(user_id):
@@ -731,44 +651,11 @@ def get_today_attendance(user_id):
     if session['user_id'] != user_id and not session.get('admin_logged_in'):
         return jsonify({'error': 'Unauthorized'}), 403
         
-    today = datetime.now(pytz.timezone(TIMEZONE)).strftime('%Y-%m-%d')
-    
-    db = get_db()
-    db.row_factory = sqlite3.Row
-    cursor = db.cursor()
-    
-    # Get today's attendance records
-    cursor.execute('''
-        SELECT * FROM attendance 
-        WHERE user_id = ? AND date(check_in) = ? 
-        ORDER BY check_in ASC
-    ''', (user_id, today))
-    
-    records = cursor.fetchall()
-    
-    # Format records for JSON response
-    attendance_data = []
-    for record in records:
-        record_dict = {key: record[key] for key in record.keys()}
-        
-        # Get breaks for this attendance record
-        cursor.execute('''
-            SELECT * FROM breaks
-            WHERE attendance_id = ?
-            ORDER BY start_time ASC
-        ''', (record['id'],))
-        
-        breaks = cursor.fetchall()
-        breaks_list = []
-        
-        for break_record in breaks:
-            break_dict = {key: break_record[key] for key in break_record.keys()}
-            breaks_list.append(break_dict)
-        
-        record_dict['breaks'] = breaks_list
-        attendance_data.append(record_dict)
+    # Records and their breaks come back as one JSON document
+    def build(cursor):
+        return day_attendance_json(cursor, user_id, today_local())
     
-    return jsonify(attendance_data)
+    return versioned_json('today', user_id, build, per_day=True)
 
 @app.route('/admin')
 def admin():
@@ -781,28 +668,22 @@ def admin():
         flash('Nur Administratoren können auf diese Seite zugreifen', 'error')
         return redirect(url_for('index'))
     
-    # Connect to database with row factory
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    # Connect to database
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Get all users for user selection dropdowns
-    cursor.execute('SELECT id, username FROM users ORDER BY username')
-    users = cursor.fetchall()
     
     # Get attendance records for the table
     cursor.execute('''
         SELECT a.id, u.username, a.check_in, a.check_out, a.has_auto_breaks, a.billable_minutes
         FROM attendance a 
         JOIN users u ON a.user_id = u.id
-        ORDER BY a.check_in DESC 
+        ORDER BY a.check_in_ts DESC 
         LIMIT 100
     ''')
     records = cursor.fetchall()
     
-    conn.close()
-    
-    return render_template('admin.html', users=users, records=records)
+    return render_template('admin.html', records=records)
 
 @app.route('/user_management')
 def user_management():
@@ -815,114 +696,46 @@ def user_management():
         flash('Nur Administratoren können auf die Benutzerverwaltung zugreifen', 'error')
         return redirect(url_for('index'))
     
-    db = get_db()
-    db.row_factory = sqlite3.Row
-    cursor = db.cursor()
-    
-    # First, ensure the users table has all the new columns
+    # Only the first page is rendered here; search, filters and further
+    # pages are loaded from api_user_management_users
     try:
-        cursor.execute("PRAGMA table_info(users)")
-        existing_columns = [column[1] for column in cursor.fetchall()]
-        
-        # Add missing columns if they don't exist
-        new_columns = {
-            'first_name': 'TEXT',
-            'last_name': 'TEXT', 
-            'employee_id': 'TEXT',
-            'user_role': 'TEXT DEFAULT "employee"',
-            'department': 'TEXT',
-            'account_status': 'TEXT DEFAULT "active"',
-            'created_at': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
-            'updated_at': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP'
-        }
-        
-        for column_name, column_def in new_columns.items():
-            if column_name not in existing_columns:
-                try:
-                    cursor.execute(f'ALTER TABLE users ADD COLUMN {column_name} {column_def}')
-                    logging.info(f"Added missing column {column_name} to users table")
-                except sqlite3.Error as e:
-                    logging.warning(f"Could not add column {column_name}: {e}")
-        
-        db.commit()
-    except Exception as e:
-        logging.error(f"Error updating users table schema: {e}")
-    
-    # Get all users with enhanced data and consent status
-    try:
-        cursor.execute('''
-            SELECT 
-                u.id, 
-                u.username, 
-                COALESCE(u.first_name, '') AS first_name,
-                COALESCE(u.last_name, '') AS last_name,
-                COALESCE(u.employee_id, '') AS employee_id,
-                COALESCE(u.user_role, 'employee') AS user_role,
-                COALESCE(u.department, '') AS department,
-                COALESCE(u.account_status, 'active') AS account_status,
-                COALESCE(u.is_admin, 0) AS is_admin,
-                COALESCE(u.created_at, '') AS created_at,
-                COALESCE(u.updated_at, '') AS updated_at,
-                u.last_login,
-                COALESCE(uc.consent_status, 'Unknown') AS consent_status,
-                COALESCE(uc.consent_date, '') AS consent_date
-            FROM users u
-            LEFT JOIN (
-                SELECT user_id, consent_status, consent_date
-                FROM user_consents 
-                WHERE id IN (SELECT MAX(id) FROM user_consents GROUP BY user_id)
-            ) uc ON u.id = uc.user_id
-            ORDER BY u.username
-        ''')
-        users = cursor.fetchall()
-        
-        # Convert to list of dictionaries for easier template handling
-        users_data = []
-        for user in users:
-            user_dict = dict(user)
-            
-            # Create display name
-            if user_dict['first_name'] and user_dict['last_name']:
-                user_dict['display_name'] = f"{user_dict['first_name']} {user_dict['last_name']}"
-            else:
-                user_dict['display_name'] = user_dict['username']
-            
-            # Format role display
-            role_display = {
-                'employee': 'Mitarbeiter',
-                'supervisor': 'Vorgesetzter', 
-                'hr': 'Personalwesen',
-                'admin': 'Administrator'
-            }
-            user_dict['role_display'] = role_display.get(user_dict['user_role'], user_dict['user_role'])
-            
-            # Format status display
-            status_display = {
-                'active': 'Aktiv',
-                'inactive': 'Inaktiv',
-                'suspended': 'Gesperrt'
-            }
-            user_dict['status_display'] = status_display.get(user_dict['account_status'], user_dict['account_status'])
-            
-            # Format consent display
-            consent_display = {
-                'granted': 'Erteilt',
-                'declined': 'Verweigert',
-                'pending': 'Ausstehend',
-                'Unknown': 'Unbekannt'
-            }
-            user_dict['consent_display'] = consent_display.get(user_dict['consent_status'], user_dict['consent_status'])
-            
-            users_data.append(user_dict)
-        
-        logging.info(f"Loaded {len(users_data)} users for management interface")
+        users, total_count, next_cursor = list_users(get_db().cursor())
+        users_data = [user_display(user) for user in users]
+        logging.info(f"Loaded {len(users_data)} of {total_count} users for management interface")
         
     except Exception as e:
         logging.error(f"Error fetching user data: {e}")
-        users_data = []
+        users_data, total_count, next_cursor = [], 0, None
         flash('Fehler beim Laden der Benutzerdaten', 'error')
     
-    return render_template('user_management.html', users=users_data)
+    return render_template('user_management.html', users=users_data, total_count=total_count,
+                           next_cursor=next_cursor)
+
+@app.route('/api/user_management/users')
+def api_user_management_users():
+    """Return a page of user_management table rows as rendered HTML (admins only)."""
+    if not session.get('admin_logged_in'):
+        return jsonify({'success': False, 'message': 'Nicht autorisiert'}), 403
+    
+    search_term = request.args.get('q', '').strip()
+    try:
+        users, total_count, next_cursor = list_users(
+            get_db().cursor(), search_term,
+            role=request.args.get('role', ''),
+            status=request.args.get('status', ''),
+            sort=normalize_user_sort('', search_term),
+            after=request.args.get('after', '')
+        )
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Ungültiger Cursor'}), 400
+    
+    return jsonify({
+        'success': True,
+        'html': render_template('user_management_rows.html', users=[user_display(user) for user in users]),
+        'count': len(users),
+        'total': total_count,
+        'next_cursor': next_cursor
+    })
 
 @app.route('/add_user', methods=['POST'])
 def add_user():
@@ -1006,15 +819,13 @@ def add_user():
         account_status = 'active'  # Default fallback
     
     # Connect to database
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     try:
         # Check if username already exists
         cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
         if cursor.fetchone():
-            conn.close()
             error_msg = f'Benutzername {username} existiert bereits'
             if is_ajax:
                 return jsonify({'success': False, 'message': error_msg}), 400
@@ -1023,9 +834,8 @@ def add_user():
         
         # Check if employee_id already exists (if provided)
         if employee_id:
-            cursor.execute('SELECT id FROM users WHERE employee_id = ?', (employee_id,))
+            cursor.execute(EMPLOYEE_ID_SQL, (employee_id,))
             if cursor.fetchone():
-                conn.close()
                 error_msg = f'Mitarbeiter-ID {employee_id} wird bereits verwendet'
                 if is_ajax:
                     return jsonify({'success': False, 'message': error_msg}), 400
@@ -1038,37 +848,9 @@ def add_user():
         # Determine if user should be admin based on role
         is_admin = 1 if user_role == 'admin' else 0
         
-        # First, check if users table has the new columns, if not add them
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        # Add missing columns to users table if they don't exist
-        new_columns = {
-            'first_name': 'TEXT',
-            'last_name': 'TEXT', 
-            'employee_id': 'TEXT UNIQUE',
-            'user_role': 'TEXT DEFAULT "employee"',
-            'department': 'TEXT',
-            'account_status': 'TEXT DEFAULT "active"',
-            'created_at': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
-            'updated_at': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP'
-        }
-        
-        for column_name, column_def in new_columns.items():
-            if column_name not in columns:
-                try:
-                    cursor.execute(f'ALTER TABLE users ADD COLUMN {column_name} {column_def}')
-                    logging.info(f"Added column {column_name} to users table")
-                except sqlite3.Error as e:
-                    logging.warning(f"Could not add column {column_name}: {e}")
-        
         # Insert new user with all available fields
         current_time = get_local_time().strftime('%Y-%m-%d %H:%M:%S')
         
-        # Build dynamic insert query based on available columns
-        cursor.execute("PRAGMA table_info(users)")
-        available_columns = [column[1] for column in cursor.fetchall()]
-        
         # Base fields that should always exist
         insert_fields = ['username', 'password', 'is_admin']
         insert_values = [username, hashed_password, is_admin]
@@ -1086,7 +868,7 @@ def add_user():
         }
         
         for field, value in optional_fields.items():
-            if field in available_columns:
+            if schema_has_column('users', field):
                 insert_fields.append(field)
                 insert_values.append(value)
         
@@ -1102,9 +884,7 @@ def add_user():
         
         # Create user consent record
         try:
-            cursor.execute('''INSERT INTO user_consents (user_id, consent_status, consent_date) 
-                             VALUES (?, ?, ?)''', 
-                          (user_id, privacy_consent, current_time))
+            record_consent(cursor, user_id, privacy_consent, current_time)
             logging.info(f"Created consent record for user {username}: {privacy_consent}")
         except sqlite3.Error as e:
             logging.warning(f"Could not create consent record: {e}")
@@ -1116,6 +896,7 @@ def add_user():
                               exclude_breaks_from_billing, arbzg_breaks_enabled) 
                              VALUES (?, ?, ?, ?, ?)''', 
                           (user_id, 1, 30, 1, 1))
+            bump_user_version(cursor, user_id)
             logging.info(f"Created default settings for user {username}")
         except sqlite3.Error as e:
             logging.warning(f"Could not create user settings: {e}")
@@ -1131,6 +912,8 @@ def add_user():
         except Exception as e:
             logging.error(f"Error storing temp password: {str(e)}")
         
+        bump_directory_version(cursor)
+        
         # Commit all changes
         conn.commit()
         
@@ -1143,9 +926,6 @@ def add_user():
             logging.info(f"USER_CREATED: ID={user_id}, username={username}, role={user_role}, "
                         f"department={department}, created_by={session.get('username')}")
             
-            # Trigger cache refresh for user lists (if caching is implemented)
-            refresh_user_cache()
-            
             # Notify other system components about the new user
             notify_systems_user_created(user_id, {
                 'username': username,
@@ -1213,24 +993,21 @@ def add_user():
             return jsonify({'success': False, 'message': error_msg}), 500
         else:
             return render_template('user_management.html', error=error_msg)
-    finally:
-        conn.close()
 
 
 def refresh_user_cache():
-    """Refresh any cached user data across the system"""
+    """Invalidate the user directory in every worker.
+    
+    Writes to users bump the directory version in their own transaction;
+    this is for changes reported from elsewhere (webhooks, manual sync).
+    """
     try:
-        # This function can be expanded to clear Redis cache, 
-        # update in-memory caches, etc.
+        db = get_db()
+        bump_directory_version(db.cursor())
+        db.commit()
+        user_directory.invalidate()
         logging.info("User cache refresh triggered")
         
-        # Example: Clear any session-based caches
-        # if hasattr(g, 'user_cache'):
-        #     delattr(g, 'user_cache')
-        
-        # Example: Trigger cache invalidation in external systems
-        # requests.post('http://cache-service/invalidate/users')
-        
     except Exception as e:
         logging.error(f"Error refreshing user cache: {str(e)}")
 
@@ -1337,8 +1114,7 @@ def user_datasheet(user_id):
         flash('Nur Administratoren können Benutzerdatenblätter erstellen', 'error')
         return redirect(url_for('index'))
     
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     try:
@@ -1351,7 +1127,7 @@ def user_datasheet(user_id):
                    uc.consent_status, uc.consent_date,
                    tp.temp_password
             FROM users u
-            LEFT JOIN user_consents uc ON u.id = uc.user_id
+            LEFT JOIN current_consents uc ON u.id = uc.user_id
             LEFT JOIN temp_passwords tp ON u.id = tp.user_id
             WHERE u.id = ?
         ''', (user_id,))
@@ -1361,48 +1137,38 @@ def user_datasheet(user_id):
             flash('Benutzer nicht gefunden', 'error')
             return redirect(url_for('user_management'))
         
-        # Get user statistics
+        # Get user statistics from the daily rollup
         cursor.execute('''
             SELECT 
                 COUNT(*) as total_days,
-                SUM(CASE WHEN total_minutes > 0 THEN 1 ELSE 0 END) as worked_days,
-                AVG(CASE WHEN total_minutes > 0 THEN total_minutes ELSE NULL END) as avg_minutes,
-                SUM(total_minutes) as total_minutes
+                COALESCE(SUM(worked_minutes), 0) as worked_minutes,
+                COALESCE(SUM(billable_minutes), 0) as billable_minutes,
+                COALESCE(SUM(break_minutes), 0) as break_minutes,
+                COALESCE(SUM(session_count), 0) as session_count,
+                MIN(first_check_in_ts) as first_check_in_ts,
+                MAX(last_check_out_ts) as last_check_out_ts
             FROM daily_summaries 
             WHERE user_id = ?
         ''', (user_id,))
         
-        stats = cursor.fetchone()
-        
-        # Generate QR code for user profile
-        import qrcode
-        from io import BytesIO
-        import base64
-        
-        qr_data = f"BTZ-User: {user['username']} | ID: {user['id']} | Role: {user.get('user_role', 'employee')}"
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-        
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-        buffer = BytesIO()
-        qr_img.save(buffer, format='PNG')
-        qr_code_base64 = base64.b64encode(buffer.getvalue()).decode()
-        
-        conn.close()
+        stats = dict(cursor.fetchone())
+        stats['first_punch'] = format_epoch(stats['first_check_in_ts'])
+        stats['last_punch'] = format_epoch(stats['last_check_out_ts'])
         
+        now = get_local_time()
         return render_template('user_datasheet.html', 
                              user=user, 
                              stats=stats,
-                             qr_code=qr_code_base64,
-                             current_datetime=get_local_time().strftime('%d.%m.%Y %H:%M'))
+                             username=user['username'],
+                             password=user['temp_password'] or 'Nicht mehr verfügbar',
+                             creation_date=now.strftime('%d.%m.%Y %H:%M'),
+                             current_date=now.strftime('%d.%m.%Y'),
+                             login_url=login_url())
     
     except Exception as e:
         logging.error(f"Error generating user datasheet: {str(e)}")
         flash(f'Fehler beim Erstellen des Datenblatts: {str(e)}', 'error')
         return redirect(url_for('user_management'))
-    finally:
-        conn.close()
 
 @app.route('/print_user_credentials/<int:user_id>')
 def print_user_credentials(user_id):
@@ -1415,8 +1181,7 @@ def print_user_credentials(user_id):
         flash('Nur Administratoren können Benutzerdaten einsehen', 'error')
         return redirect(url_for('index'))
     
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     try:
@@ -1472,8 +1237,6 @@ def print_user_credentials(user_id):
         logging.error(f"Error displaying user credentials: {str(e)}")
         flash(f'Fehler beim Anzeigen der Zugangsdaten: {str(e)}', 'error')
         return redirect(url_for('user_management'))
-    finally:
-        conn.close()
 
 @app.route('/break_settings')
 def break_settings():
@@ -1487,7 +1250,6 @@ def break_settings():
         return redirect(url_for('index'))
     
     db = get_db()
-    db.row_factory = sqlite3.Row
     cursor = db.cursor()
     
     # Get system-wide settings
@@ -1505,7 +1267,6 @@ def data_access():
     user_id = session.get('user_id')
     
     db = get_db()
-    db.row_factory = sqlite3.Row
     cursor = db.cursor()
     
     # Get user information
@@ -1513,15 +1274,11 @@ def data_access():
     user = cursor.fetchone()
     
     # Get total attendance records
-    cursor.execute('SELECT COUNT(*) as count FROM attendance WHERE user_id = ?', (user_id,))
+    cursor.execute(RECORD_COUNT_SQL, (user_id,))
     record_count = cursor.fetchone()['count']
     
     # Get latest consent status
-    cursor.execute('''
-        SELECT consent_status, consent_date FROM user_consents
-        WHERE user_id = ?
-        ORDER BY id DESC LIMIT 1
-    ''', (user_id,))
+    cursor.execute(CURRENT_CONSENT_SQL, (user_id,))
     consent_data = cursor.fetchone()
     
     # Create user data dict with consent information
@@ -1559,24 +1316,16 @@ def my_attendance():
     selected_date = request.args.get('date', '')
     
     db = get_db()
-    db.row_factory = sqlite3.Row
     cursor = db.cursor()
     
-    # Base query
-    query = '''
-        SELECT * FROM attendance 
-        WHERE user_id = ?
-    '''
-    params = [user_id]
-    
-    # Apply filters
+    # Base query with the month or date filter
+    bounds = None
     if selected_month:
         year, month = selected_month.split('-')
-        query += " AND strftime('%Y-%m', check_in) = ?"
-        params.append(f"{year}-{month}")
+        bounds = month_bounds(year, month)
     elif selected_date:
-        query += " AND date(check_in) = date(?)"
-        params.append(selected_date)
+        bounds = day_bounds(selected_date)
+    query, params = history_query(user_id, bounds)
     
     # Count total records for pagination
     count_query = f"SELECT COUNT(*) as count FROM ({query})"
@@ -1585,7 +1334,7 @@ def my_attendance():
     total_pages = (total_records + per_page - 1) // per_page
     
     # Add sorting and pagination
-    query += " ORDER BY check_in DESC LIMIT ? OFFSET ?"
+    query += HISTORY_PAGE_ORDER
     params.extend([per_page, offset])
     
     # Get paginated records
@@ -1593,12 +1342,7 @@ def my_attendance():
     records = cursor.fetchall()
     
     # Get available months for filter
-    cursor.execute('''
-        SELECT DISTINCT strftime('%Y-%m', check_in) as month
-        FROM attendance
-        WHERE user_id = ?
-        ORDER BY month DESC
-    ''', (user_id,))
+    cursor.execute(RECORD_MONTHS_SQL, (user_id,))
     months_raw = cursor.fetchall()
     
     # Format months for display
@@ -1627,7 +1371,6 @@ def edit_attendance(attendance_id):
     user_id = session.get('user_id')
     
     db = get_db()
-    db.row_factory = sqlite3.Row
     cursor = db.cursor()
     
     # Check if the attendance record exists and belongs to the current user
@@ -1681,124 +1424,43 @@ def edit_attendance(attendance_id):
             flash('Falsches Passwort', 'error')
             return render_template('edit_attendance.html', attendance=attendance)
         
+        check_in_ts, work_date = normalize_timestamp(check_in)
+        
         try:
             # Begin transaction
             db.execute('BEGIN')
             
             # Update the attendance record
             if check_out:
-                # Calculate billable minutes if check-out provided
-                check_in_dt = datetime.strptime(check_in, '%Y-%m-%d %H:%M:%S')
-                check_out_dt = datetime.strptime(check_out, '%Y-%m-%d %H:%M:%S')
-                billable_minutes = int((check_out_dt - check_in_dt).total_seconds() / 60)
+                cursor.execute('''
+                    UPDATE attendance
+                    SET check_in = ?, check_out = ?,
+                        check_in_ts = ?, check_out_ts = ?, work_date = ?
+                    WHERE id = ?
+                ''', (check_in, check_out, check_in_ts, to_epoch(check_out), work_date, attendance_id))
                 
-                # If there are breaks, we need to recalculate them
-                # First, delete old auto breaks regardless of the has_auto_breaks flag
+                # Re-plan the statutory break for the new times; manual breaks stay
                 cursor.execute('''
                     DELETE FROM breaks
                     WHERE attendance_id = ? AND is_auto_detected = 1
                 ''', (attendance_id,))
-                
-                # Get user break settings
-                cursor.execute('''
-                    SELECT us.arbzg_breaks_enabled
-                    FROM user_settings us
-                    WHERE us.user_id = ?
-                ''', (user_id,))
-                
-                settings = cursor.fetchone()
-                
-                # Use system default settings if user has none
-                if not settings:
-                    cursor.execute('''
-                        SELECT arbzg_breaks_enabled
-                        FROM user_settings
-                        WHERE user_id = 0
-                    ''')
-                    settings = cursor.fetchone()
-                
-                # Process ArbZG-compliant breaks if enabled
-                if settings and (settings['arbzg_breaks_enabled'] if 'arbzg_breaks_enabled' in settings else 1):
-                    # Calculate total work duration in minutes without breaks
-                    total_work_minutes = billable_minutes
-                    
-                    # Define required breaks per ArbZG
-                    required_break_minutes = 0
-                    break_desc = ""
-                    
-                    if total_work_minutes > 9 * 60:  # More than 9 hours
-                        required_break_minutes = 45
-                        break_desc = "Gesetzliche Pause (ArbZG §4) für Arbeitszeit über 9 Stunden"
-                    elif total_work_minutes > 6 * 60:  # More than 6 hours
-                        required_break_minutes = 30
-                        break_desc = "Gesetzliche Pause (ArbZG §4) für Arbeitszeit über 6 Stunden"
-                        
-                        if required_break_minutes > 0:
-                            # Try to place break during lunchtime (12:00-13:00) or at middle of the day
-                            halfway_point = check_in_dt + (check_out_dt - check_in_dt) / 2
-                            lunch_start = check_in_dt.replace(hour=12, minute=0, second=0)
-                            lunch_end = check_in_dt.replace(hour=13, minute=0, second=0)
-                            
-                            # If lunch time is within the work period
-                            if check_in_dt <= lunch_end and check_out_dt >= lunch_start:
-                                break_start = max(check_in_dt, lunch_start)
-                                break_end = min(check_out_dt, break_start + timedelta(minutes=required_break_minutes))
-                                
-                                # Make sure break doesn't exceed lunch period
-                                if break_end > lunch_end:
-                                    break_end = lunch_end
-                            else:
-                                # Place break at middle of the day
-                                break_start = halfway_point - timedelta(minutes=required_break_minutes / 2)
-                                break_end = break_start + timedelta(minutes=required_break_minutes)
-                                
-                                # Ensure break is within working hours
-                                if break_start < check_in_dt:
-                                    break_start = check_in_dt
-                                    break_end = min(check_out_dt, break_start + timedelta(minutes=required_break_minutes))
-                                
-                                if break_end > check_out_dt:
-                                    break_end = check_out_dt
-                                    break_start = max(check_in_dt, break_end - timedelta(minutes=required_break_minutes))
-                            
-                            # Format for database
-                            break_start_str = break_start.strftime('%Y-%m-%d %H:%M:%S')
-                            break_end_str = break_end.strftime('%Y-%m-%d %H:%M:%S')
-                            
-                            # Add the break
-                            cursor.execute("""
-                                INSERT INTO breaks (attendance_id, start_time, end_time, duration_minutes,
-                                                is_excluded_from_billing, is_auto_detected, description)
-                                VALUES (?, ?, ?, ?, ?, ?, ?)
-                            """, (attendance_id, break_start_str, break_end_str, required_break_minutes,
-                                1, 1, break_desc))
-                            
-                            # Adjust billable minutes
-                            billable_minutes -= required_break_minutes
-                            
-                            # Set has_auto_breaks flag to true
-                            cursor.execute('''
-                                UPDATE attendance
-                                SET has_auto_breaks = 1
-                                WHERE id = ?
-                            ''', (attendance_id,))
-                
-                # Update attendance record with check-out and billable minutes
-                cursor.execute('''
-                    UPDATE attendance
-                    SET check_in = ?, check_out = ?, billable_minutes = ?
-                    WHERE id = ?
-                ''', (check_in, check_out, billable_minutes, attendance_id))
+                break_session = load_session(cursor, attendance_id, check_in_ts, to_epoch(check_out), work_date)
+                record_break_plan(cursor, attendance_id, plan_break(break_session, policy_for_user(cursor, user_id)))
             else:
                 # Update only the check-in time if no check-out provided
                 cursor.execute('''
                     UPDATE attendance
-                    SET check_in = ?
+                    SET check_in = ?, check_in_ts = ?, work_date = ?
                     WHERE id = ?
-                ''', (check_in, attendance_id))
+                ''', (check_in, check_in_ts, work_date, attendance_id))
+            
+            # The edit may move the record to another day
+            refresh_daily_summaries(cursor, user_id, [attendance['work_date'], work_date])
+            bump_user_version(cursor, user_id)
             
             # Commit transaction
             db.commit()
+            publish_attendance_status(user_id)
             
             flash('Arbeitszeiteintrag wurde erfolgreich aktualisiert', 'success')
             return redirect(url_for('my_attendance'))
@@ -1818,7 +1480,7 @@ def edit_attendance(attendance_id):
             description
         FROM breaks
         WHERE attendance_id = ?
-        ORDER BY start_time
+        ORDER BY start_ts
     ''', (attendance_id,))
     
     breaks = []
@@ -1849,12 +1511,11 @@ def delete_attendance(attendance_id):
     user_id = session.get('user_id')
     
     db = get_db()
-    db.row_factory = sqlite3.Row
     cursor = db.cursor()
     
     # Check if the attendance record exists and belongs to the current user
     cursor.execute('''
-        SELECT id FROM attendance
+        SELECT id, work_date FROM attendance
         WHERE id = ? AND user_id = ?
     ''', (attendance_id, user_id))
     
@@ -1887,9 +1548,12 @@ def delete_attendance(attendance_id):
         
         # Then delete the attendance record itself
         cursor.execute('DELETE FROM attendance WHERE id = ?', (attendance_id,))
+        refresh_daily_summary(cursor, user_id, attendance['work_date'])
+        bump_user_version(cursor, user_id)
         
         # Commit transaction
         db.commit()
+        publish_attendance_status(user_id)
         
         flash('Arbeitszeiteintrag wurde erfolgreich gelöscht', 'success')
         return redirect(url_for('my_attendance'))
@@ -1921,9 +1585,12 @@ def delete_user(user_id):
         cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
         
         # Alle abhängigen Daten löschen
-        cursor.execute('DELETE FROM user_consents WHERE user_id = ?', (user_id,))
+        forget_consents(cursor, user_id)
         cursor.execute('DELETE FROM attendance WHERE user_id = ?', (user_id,))
+        forget_daily_summaries(cursor, user_id)
         cursor.execute('DELETE FROM user_settings WHERE user_id = ?', (user_id,))
+        forget_user_version(cursor, user_id)
+        bump_directory_version(cursor)
         
         db.commit()
         
@@ -1960,7 +1627,6 @@ def request_data_deletion():
     
     # Connect to database
     db = get_db()
-    db.row_factory = sqlite3.Row
     cursor = db.cursor()
     
     # Check if username exists
@@ -2025,20 +1691,11 @@ def manual_attendance():
     user_id = session.get('user_id')
     username = session.get('username')
     
-    # If admin, get all users for selection dropdown
-    users = []
-    if session.get('admin_logged_in'):
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute('SELECT id, username FROM users ORDER BY username')
-        users = cursor.fetchall()
-        conn.close()
-    
+    # Admins pick the user through the typeahead (api_lookup_users)
     return render_template('manual_attendance.html', 
                           user_id=user_id, 
                           username=username,
-                          users=users)
+                          is_admin=session.get('admin_logged_in'))
 
 @app.route('/add_manual_attendance', methods=['POST'])
 def add_manual_attendance():
@@ -2064,9 +1721,8 @@ def add_manual_attendance():
         flash('Sie können nur Aufzeichnungen für sich selbst hinzufügen', 'error')
         return redirect(url_for('manual_attendance'))
     
-    # Connect to database with row factory for easier access
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    # Connect to database
+    conn = get_db()
     cursor = conn.cursor()
     
     # Verify password
@@ -2074,7 +1730,6 @@ def add_manual_attendance():
     user = cursor.fetchone()
     
     if not user or not bcrypt.check_password_hash(user['password'], current_password):
-        conn.close()
         flash('Falsches Passwort', 'error')
         return redirect(url_for('manual_attendance'))
     
@@ -2090,19 +1745,16 @@ def add_manual_attendance():
     check_in_dt = datetime.strptime(check_in_datetime, '%Y-%m-%d %H:%M:%S')
     
     if check_in_dt > now:
-        conn.close()
         flash('Check-In Zeit kann nicht in der Zukunft liegen', 'error')
         return redirect(url_for('manual_attendance'))
     
     if check_out_datetime:
         check_out_dt = datetime.strptime(check_out_datetime, '%Y-%m-%d %H:%M:%S')
         if check_out_dt > now:
-            conn.close()
             flash('Check-Out Zeit kann nicht in der Zukunft liegen', 'error')
             return redirect(url_for('manual_attendance'))
         
         if check_out_dt <= check_in_dt:
-            conn.close()
             flash('Check-Out Zeit muss nach der Check-In Zeit liegen', 'error')
             return redirect(url_for('manual_attendance'))
     
@@ -2115,6 +1767,8 @@ def add_manual_attendance():
         duration_minutes = int((check_out_dt - check_in_dt).total_seconds() / 60)
         billable_minutes = duration_minutes
     
+    check_in_ts, work_date = normalize_timestamp(check_in_datetime)
+    
     # Insert new attendance record
     try:
         # Begin transaction
@@ -2122,107 +1776,32 @@ def add_manual_attendance():
         
         if check_out_datetime:
             cursor.execute('''
-                INSERT INTO attendance (user_id, check_in, check_out, billable_minutes, has_auto_breaks)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, check_in_datetime, check_out_datetime, billable_minutes, has_auto_breaks))
+                INSERT INTO attendance (user_id, check_in, check_out, check_in_ts, check_out_ts, work_date,
+                                        billable_minutes, has_auto_breaks)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, check_in_datetime, check_out_datetime, check_in_ts, to_epoch(check_out_datetime),
+                  work_date, billable_minutes, has_auto_breaks))
         else:
             cursor.execute('''
-                INSERT INTO attendance (user_id, check_in, has_auto_breaks)
-                VALUES (?, ?, ?)
-            ''', (user_id, check_in_datetime, has_auto_breaks))
+                INSERT INTO attendance (user_id, check_in, check_in_ts, work_date, has_auto_breaks)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, check_in_datetime, check_in_ts, work_date, has_auto_breaks))
         
         attendance_id = cursor.lastrowid
         
         # Process ArbZG-compliant breaks if both check-in and check-out are provided
         if check_out_datetime:
-            # Get user break settings
-            cursor.execute('''
-                SELECT us.arbzg_breaks_enabled
-                FROM user_settings us
-                WHERE us.user_id = ?
-            ''', (user_id,))
-            
-            settings = cursor.fetchone()
-            
-            # Use system default settings if user has none
-            if not settings:
-                cursor.execute('''
-                    SELECT arbzg_breaks_enabled
-                    FROM user_settings
-                    WHERE user_id = 0
-                ''')
-                settings = cursor.fetchone()
-            
-            # Process ArbZG-compliant breaks if enabled
-            if settings and (settings['arbzg_breaks_enabled'] if 'arbzg_breaks_enabled' in settings else 1):
-                # Calculate total work duration in minutes
-                total_work_minutes = billable_minutes
-                
-                # Define required breaks per ArbZG
-                required_break_minutes = 0
-                break_desc = ""
-                
-                if total_work_minutes > 9 * 60:  # More than 9 hours
-                    required_break_minutes = 45
-                    break_desc = "Gesetzliche Pause (ArbZG §4) für Arbeitszeit über 9 Stunden"
-                elif total_work_minutes > 6 * 60:  # More than 6 hours
-                    required_break_minutes = 30
-                    break_desc = "Gesetzliche Pause (ArbZG §4) für Arbeitszeit über 6 Stunden"
-                
-                if required_break_minutes > 0:
-                    # Try to place break during lunchtime (12:00-13:00) or at middle of the day
-                    halfway_point = check_in_dt + (check_out_dt - check_in_dt) / 2
-                    lunch_start = check_in_dt.replace(hour=12, minute=0, second=0)
-                    lunch_end = check_in_dt.replace(hour=13, minute=0, second=0)
-                    
-                    # If lunch time is within the work period
-                    if check_in_dt <= lunch_end and check_out_dt >= lunch_start:
-                        break_start = max(check_in_dt, lunch_start)
-                        break_end = min(check_out_dt, break_start + timedelta(minutes=required_break_minutes))
-                        
-                        # Make sure break doesn't exceed lunch period
-                        if break_end > lunch_end:
-                            break_end = lunch_end
-                    else:
-                        # Place break at middle of the day
-                        break_start = halfway_point - timedelta(minutes=required_break_minutes / 2)
-                        break_end = break_start + timedelta(minutes=required_break_minutes)
-                        
-                        # Ensure break is within working hours
-                        if break_start < check_in_dt:
-                            break_start = check_in_dt
-                            break_end = min(check_out_dt, break_start + timedelta(minutes=required_break_minutes))
-                        
-                        if break_end > check_out_dt:
-                            break_end = check_out_dt
-                            break_start = max(check_in_dt, break_end - timedelta(minutes=required_break_minutes))
-                    
-                    # Format for database
-                    break_start_str = break_start.strftime('%Y-%m-%d %H:%M:%S')
-                    break_end_str = break_end.strftime('%Y-%m-%d %H:%M:%S')
-                    
-                    # Add the break
-                    cursor.execute("""
-                        INSERT INTO breaks (attendance_id, start_time, end_time, duration_minutes,
-                                        is_excluded_from_billing, is_auto_detected, description)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """, (attendance_id, break_start_str, break_end_str, required_break_minutes,
-                        1, 1, break_desc))
-                    
-                    # Adjust billable minutes
-                    billable_minutes -= required_break_minutes
-                    has_auto_breaks = True
-                    
-                    # Update the attendance record with adjusted billable minutes and auto breaks flag
-                    cursor.execute('''
-                        UPDATE attendance
-                        SET billable_minutes = ?, has_auto_breaks = ?
-                        WHERE id = ?
-                    ''', (billable_minutes, has_auto_breaks, attendance_id))
+            plan = plan_break(Session(check_in_ts, to_epoch(check_out_datetime), work_date),
+                              policy_for_user(cursor, user_id))
+            record_break_plan(cursor, attendance_id, plan)
+            billable_minutes = plan.billable_minutes
+        
+        refresh_daily_summary(cursor, user_id, work_date)
+        bump_user_version(cursor, user_id)
         
         # Commit transaction
         conn.commit()
-        conn.close()
+        publish_attendance_status(user_id)
         
         # Format the work time for display (hours:minutes) if applicable
         if check_out_datetime and billable_minutes is not None:
@@ -2237,7 +1816,6 @@ def add_manual_attendance():
     
     except sqlite3.Error as e:
         conn.rollback()
-        conn.close()
         flash(f'Fehler beim Hinzufügen der Aufzeichnung: {str(e)}', 'error')
         return redirect(url_for('manual_attendance'))
 
@@ -2250,11 +1828,10 @@ def user_break_preferences():
     user_id = session.get('user_id')
     
     db = get_db()
-    db.row_factory = sqlite3.Row
     cursor = db.cursor()
     
     # Get user settings
-    cursor.execute('SELECT * FROM user_settings WHERE user_id = ?', (user_id,))
+    cursor.execute(SETTINGS_SQL, (user_id,))
     settings = cursor.fetchone()
     
     # If no settings exist yet, create default settings
@@ -2284,14 +1861,40 @@ def user_break_preferences():
                 VALUES (?, ?, ?, ?, ?)
             ''', (user_id, 1, 30, 1, 1))
         
+        bump_user_version(cursor, user_id)
         db.commit()
         
         # Get the newly created settings
-        cursor.execute('SELECT * FROM user_settings WHERE user_id = ?', (user_id,))
+        cursor.execute(SETTINGS_SQL, (user_id,))
         settings = cursor.fetchone()
     
     return render_template('user_break_preferences.html', settings=settings)
 
+def attendance_status(cursor, user_id):
+    """Return today's check-in/check-out status of a user.
+
+    An open session wins over completed ones; otherwise the latest completed
+    session of today is reported.
+    """
+    cursor.execute(STATUS_SQL, (user_id, today_local()))
+    record = cursor.fetchone()
+    
+    return {
+        'is_checked_in': bool(record) and record['check_out'] is None,
+        'is_checked_out': bool(record) and record['check_out'] is not None,
+        'check_in_time': record['check_in'] if record else None,
+        'check_out_time': record['check_out'] if record else None
+    }
+
+def publish_attendance_status(user_id):
+    """Push the new status of a user to open status streams after a commit."""
+    if status_bus.has_subscribers(user_id):
+        status_bus.publish(user_id, attendance_status(get_db().cursor(), user_id))
+
+# Idle streams send a comment this often so proxies keep them open and the
+# day rollover is noticed
+STATUS_STREAM_KEEPALIVE_SECONDS = 25
+
 @app.route('/get_attendance_status')
 def get_attendance_status():
     """API endpoint to check if a user is checked in or out"""
@@ -2299,61 +1902,76 @@ def get_attendance_status():
         return jsonify({'error': 'Not logged in'}), 401
     
     # Get user ID from query parameter
-    user_id = request.args.get('user_id')
+    user_id = request.args.get('user_id', type=int)
     
     # Admin users can check status for other users
     if session.get('admin_logged_in') is not True and str(session.get('user_id')) != str(user_id):
         return jsonify({'error': 'Unauthorized'}), 403
     
-    # Connect to database
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    return versioned_json('status', user_id, lambda cursor: attendance_status(cursor, user_id), per_day=True)
+
+@app.route('/stream/attendance_status')
+def stream_attendance_status():
+    """Server-sent events stream of a user's attendance status.
     
-    # Get current date in the application's timezone
-    today = datetime.now(pytz.timezone(TIMEZONE)).strftime('%Y-%m-%d')
+    The response holds its request thread for as long as the client stays
+    connected; STATUS_STREAM_MAX caps the open streams.
+    """
+    if not session.get('username'):
+        return jsonify({'error': 'Not logged in'}), 401
     
-    # Check for active check-in (no check_out time)
-    cursor.execute('''
-        SELECT * FROM attendance
-        WHERE user_id = ? AND date(check_in) = ?
-        AND check_out IS NULL
-        ORDER BY id DESC LIMIT 1
-    ''', (user_id, today))
+    user_id = request.args.get('user_id', type=int)
+    if user_id is None:
+        return jsonify({'error': 'user_id is required'}), 400
     
-    active_record = cursor.fetchone()
+    # Admin users can watch the status of other users
+    if session.get('admin_logged_in') is not True and str(session.get('user_id')) != str(user_id):
+        return jsonify({'error': 'Unauthorized'}), 403
     
-    # Also get the most recent completed record for today
-    cursor.execute('''
-        SELECT * FROM attendance
-        WHERE user_id = ? AND date(check_in) = ?
-        AND check_out IS NOT NULL
-        ORDER BY id DESC LIMIT 1
-    ''', (user_id, today))
-    
-    completed_record = cursor.fetchone()
-    
-    result = {
-        'is_checked_in': False,
-        'is_checked_out': False,
-        'check_in_time': None,
-        'check_out_time': None
-    }
+    subscriber = status_bus.subscribe(user_id)
+    if subscriber is None:
+        # Clients fall back to polling /get_attendance_status
+        return jsonify({'error': 'Too many open status streams'}), 503
+    
+    # Short-lived connections, so that the stream does not hold one
+    def current_version():
+        with db_pool.connection() as conn:
+            return get_user_version(conn.cursor(), user_id), today_local()
+    
+    def current_status():
+        with db_pool.connection() as conn:
+            return attendance_status(conn.cursor(), user_id)
+    
+    # Read before the status, so a write in between is sent again later
+    sent_version = current_version()
+    initial_status = current_status()
     
-    if active_record:
-        # User is currently checked in (active session)
-        result['is_checked_in'] = True
-        result['check_in_time'] = active_record['check_in']
-        result['is_checked_out'] = False
-    elif completed_record:
-        # User has completed a session today but is not currently checked in
-        result['is_checked_in'] = False
-        result['is_checked_out'] = True
-        result['check_in_time'] = completed_record['check_in']
-        result['check_out_time'] = completed_record['check_out']
-    
-    conn.close()
-    return jsonify(result)
+    def events():
+        nonlocal sent_version
+        try:
+            yield 'retry: 5000\n'
+            yield f'data: {json.dumps(initial_status)}\n\n'
+            while True:
+                try:
+                    status = subscriber.get(timeout=STATUS_STREAM_KEEPALIVE_SECONDS)
+                    sent_version = current_version()
+                except queue.Empty:
+                    # Writes made through other worker processes never reach
+                    # this process's bus; they show up as a new user version
+                    version = current_version()
+                    if version == sent_version:
+                        yield ': keepalive\n\n'
+                        continue
+                    sent_version = version
+                    status = current_status()
+                yield f'data: {json.dumps(status)}\n\n'
+        finally:
+            status_bus.unsubscribe(user_id, subscriber)
+    
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/checkin', methods=['POST'])
 def checkin():
@@ -2370,35 +1988,31 @@ def checkin():
         return redirect(url_for('index'))
     
     # Connect to database
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     # Check if already checked in
     check_in_time = datetime.now(pytz.timezone(TIMEZONE)).isoformat()
-    today = check_in_time.split('T')[0]
+    check_in_ts, today = normalize_timestamp(check_in_time)
     
-    cursor.execute('''
-        SELECT * FROM attendance
-        WHERE user_id = ? AND date(check_in) = ?
-        AND check_out IS NULL
-    ''', (user_id, today))
+    cursor.execute(OPEN_SESSION_SQL, (user_id, today))
     
     existing_check_in = cursor.fetchone()
     
     if existing_check_in:
-        conn.close()
         flash('You are already checked in', 'error')
         return redirect(url_for('index'))
     
     # Insert check-in record
     cursor.execute('''
-        INSERT INTO attendance (user_id, check_in, has_auto_breaks)
-                VALUES (?, ?, ?)
-    ''', (user_id, check_in_time, True))
+        INSERT INTO attendance (user_id, check_in, check_in_ts, work_date, has_auto_breaks)
+                VALUES (?, ?, ?, ?, ?)
+    ''', (user_id, check_in_time, check_in_ts, today, True))
+    refresh_daily_summary(cursor, user_id, today)
+    bump_user_version(cursor, user_id)
     
     conn.commit()
-    conn.close()
+    publish_attendance_status(user_id)
     
     flash('Check-in successful', 'success')
     return redirect(url_for('index'))
@@ -2417,193 +2031,64 @@ def checkout():
         flash('You can only check out for yourself', 'error')
         return redirect(url_for('index'))
     
-    # Connect to database
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    started = time.perf_counter()
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Find the active check-in record
-    today = datetime.now(pytz.timezone(TIMEZONE)).strftime('%Y-%m-%d')
-    
-    cursor.execute('''
-        SELECT id FROM attendance
-        WHERE user_id = ? AND date(check_in) = ?
-        AND check_out IS NULL
-        ORDER BY check_in DESC LIMIT 1
-    ''', (user_id, today))
+    check_out_dt = get_local_time()
+    check_out_time = check_out_dt.isoformat()
+    check_out_ts = to_epoch(check_out_dt)
     
-    active_record = cursor.fetchone()
-    
-    if not active_record:
-        conn.close()
-        flash('No active check-in found', 'error')
+    # Everything below runs in one write transaction: readers never see a
+    # closed session without its ArbZG break, and there is a single fsync.
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+    except sqlite3.OperationalError as e:
+        logging.error(f"Checkout for user {user_id} could not acquire the write lock: {e}")
+        flash('Die Datenbank ist gerade ausgelastet. Bitte versuchen Sie es erneut.', 'error')
         return redirect(url_for('index'))
     
-    # Update with check-out time
-    check_out_time = datetime.now(pytz.timezone(TIMEZONE)).isoformat()
-    attendance_id = active_record['id']
-    
-    # Get check-in time to calculate billable minutes
-    cursor.execute('SELECT check_in FROM attendance WHERE id = ?', (attendance_id,))
-    check_in_result = cursor.fetchone()
-    
-    check_in_time = try_parse(check_in_result['check_in'])
-    check_out_dt = try_parse(check_out_time)
-    
-    # Calculate billable minutes (excluding breaks)
-    billable_minutes = int((check_out_dt - check_in_time).total_seconds() / 60)
-    
-    # Get breaks for this attendance record
-    cursor.execute('''
-        SELECT duration_minutes, is_excluded_from_billing FROM breaks
-        WHERE attendance_id = ?
-    ''', (attendance_id,))
-    
-    breaks = cursor.fetchall()
-    
-    # Subtract break times from billable minutes if they are excluded from billing
-    # Log the breaks for debugging purposes
-    print(f"Processing {len(breaks)} breaks for attendance ID {attendance_id}")
-    total_break_minutes = 0
-    for break_record in breaks:
-        excluded = break_record['is_excluded_from_billing']
-        duration = break_record['duration_minutes']
-        print(f"Break: {duration} minutes, excluded from billing: {excluded}")
+    try:
+        # Close today's open session
+        cursor.execute(CLOSE_SESSION_SQL, (check_out_time, check_out_ts, user_id, today_local()))
+        closed = cursor.fetchone()
         
-        # Check if break should be excluded from billing (is_excluded_from_billing = 1)
-        if excluded == 1:
-            total_break_minutes += duration
-            billable_minutes -= duration
-            print(f"Subtracted {duration} minutes, new billable minutes: {billable_minutes}")
-    
-    print(f"Total break minutes subtracted initially: {total_break_minutes}")
-    
-    # Update the attendance record
-    cursor.execute('''
-        UPDATE attendance
-        SET check_out = ?, billable_minutes = ?
-        WHERE id = ?
-    ''', (check_out_time, billable_minutes, attendance_id))
-    
-    conn.commit()
-    
-    # Process automatic breaks if enabled
-    cursor.execute('''
-        SELECT us.auto_break_detection_enabled, us.auto_break_threshold_minutes,
-               us.exclude_breaks_from_billing
-        FROM user_settings us
-        WHERE us.user_id = ?
-    ''', (user_id,))
-    
-    settings = cursor.fetchone()
+        if not closed:
+            conn.rollback()
+            flash('No active check-in found', 'error')
+            return redirect(url_for('index'))
+        
+        attendance_id = closed['id']
+        
+        # Same break policy and session loading as the bulk recompute, on
+        # this transaction's cursor
+        plan = plan_break(
+            load_session(cursor, attendance_id, closed['check_in_ts'], check_out_ts, closed['work_date']),
+            policy_for_user(cursor, user_id)
+        )
+        record_break_plan(cursor, attendance_id, plan)
+        billable_minutes = plan.billable_minutes
+        if plan.break_minutes:
+            logging.info(f"Added ArbZG break of {plan.break_minutes} minutes to attendance {attendance_id}")
+        
+        refresh_daily_summary(cursor, user_id, closed['work_date'])
+        bump_user_version(cursor, user_id)
+        conn.commit()
     
-    if not settings:
-        # Use system default settings
-        cursor.execute('''
-            SELECT auto_break_detection_enabled, auto_break_threshold_minutes,
-                   exclude_breaks_from_billing
-            FROM user_settings
-            WHERE user_id = 0
-        ''')
-        settings = cursor.fetchone()
+    except sqlite3.Error as e:
+        conn.rollback()
+        logging.error(f"Checkout for user {user_id} failed: {e}")
+        flash('Check-out fehlgeschlagen. Bitte versuchen Sie es erneut.', 'error')
+        return redirect(url_for('index'))
     
-    # Process auto breaks if enabled
-    if settings and settings['auto_break_detection_enabled']:
-        threshold_minutes = settings['auto_break_threshold_minutes']
-        exclude_from_billing = settings['exclude_breaks_from_billing']
-        
-        # Auto break detection logic - not implemented here
-        
-    # Process ArbZG-compliant breaks
-    print("Checking ArbZG break requirements...")
-    if settings and (settings['arbzg_breaks_enabled'] if 'arbzg_breaks_enabled' in settings else 1):
-        # Calculate total work duration in minutes
-        total_work_minutes = int((check_out_dt - check_in_time).total_seconds() / 60)
-        print(f"Total work minutes: {total_work_minutes}")
-        
-        # Define required breaks per ArbZG
-        required_break_minutes = 0
-        if total_work_minutes > 9 * 60:  # More than 9 hours
-            required_break_minutes = 45
-            break_desc = "Gesetzliche Pause (ArbZG §4) für Arbeitszeit über 9 Stunden"
-            print(f"Required break: 45 minutes (>9 hours)")
-        elif total_work_minutes > 6 * 60:  # More than 6 hours
-            required_break_minutes = 30
-            break_desc = "Gesetzliche Pause (ArbZG §4) für Arbeitszeit über 6 Stunden"
-            print(f"Required break: 30 minutes (>6 hours)")
-        else:
-            print(f"No break required (work time < 6 hours)")
-        
-        if required_break_minutes > 0:
-            # Check existing breaks
-            cursor.execute("""
-                SELECT SUM(duration_minutes) 
-                FROM breaks 
-                WHERE attendance_id = ?
-            """, (attendance_id,))
-            
-            existing_breaks_row = cursor.fetchone()
-            existing_break_minutes = existing_breaks_row[0] if existing_breaks_row and existing_breaks_row[0] is not None else 0
-            print(f"Existing break minutes: {existing_break_minutes}")
-            
-            # Calculate missing break minutes
-            missing_break_minutes = required_break_minutes - existing_break_minutes
-            print(f"Missing break minutes: {missing_break_minutes}")
-            
-            # If breaks are missing, add them
-            if missing_break_minutes > 0:
-                # Try to place break during lunchtime (12:00-13:00) or at end of day
-                lunch_start = check_in_time.replace(hour=12, minute=0, second=0)
-                lunch_end = check_in_time.replace(hour=13, minute=0, second=0)
-                
-                # If lunch time is within the work period
-                if check_in_time <= lunch_end and check_out_dt >= lunch_start:
-                    break_start = max(check_in_time, lunch_start)
-                    # Fix: lunch_start.replace() doesn't add minutes but sets them to a value
-                    break_end = min(check_out_dt, break_start + timedelta(minutes=missing_break_minutes))
-                    
-                    # Make sure break doesn't exceed lunch period
-                    if break_end > lunch_end:
-                        break_end = lunch_end
-                else:
-                    # Place break at end of workday
-                    break_end = check_out_dt
-                    break_start = break_end - timedelta(minutes=missing_break_minutes)
-                
-                # Format for database
-                break_start_str = break_start.isoformat()
-                break_end_str = break_end.isoformat()
-                
-                # Add the break
-                cursor.execute("""
-                    INSERT INTO breaks (attendance_id, start_time, end_time, duration_minutes,
-                                    is_excluded_from_billing, is_auto_detected, description)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (attendance_id, break_start_str, break_end_str, missing_break_minutes,
-                    1, 1, break_desc))
-                    
-                conn.commit()
-                
-                # Recalculate billable minutes after adding the break
-                billable_minutes -= missing_break_minutes
-                print(f"Added ArbZG break: {missing_break_minutes} minutes, new billable time: {billable_minutes} minutes")
-                
-                # Update the attendance record with the new billable minutes and mark as having auto breaks
-                cursor.execute('''
-                    UPDATE attendance
-                    SET billable_minutes = ?, has_auto_breaks = 1
-                    WHERE id = ?
-                ''', (billable_minutes, attendance_id))
-                conn.commit()
-                
-                print(f"Updated database record: attendance ID {attendance_id} now has {billable_minutes} billable minutes and has_auto_breaks=1")
+    record_checkout_latency((time.perf_counter() - started) * 1000, user_id)
+    publish_attendance_status(user_id)
     
     # Format the work time for display (hours:minutes)
     hours = billable_minutes // 60
     minutes = billable_minutes % 60
     work_time = f"{hours}:{minutes:02d}"
     
-    conn.close()
     flash(f'Check-out erfolgreich. Gesamtarbeitszeit: {work_time} Stunden', 'success')
     return redirect(url_for('index'))
 
@@ -2632,7 +2117,7 @@ def update_user_break_preferences():
         }
     
     # Connect to database
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
     # Check if user has settings
@@ -2693,8 +2178,8 @@ def update_user_break_preferences():
         
         cursor.execute(query, params)
     
+    bump_user_version(cursor, user_id)
     conn.commit()
-    conn.close()
     
     flash('Pauseneinstellungen wurden aktualisiert', 'success')
     return redirect(url_for('user_break_preferences'))
@@ -2717,7 +2202,7 @@ def update_user_settings():
     arbzg_breaks_enabled = request.form.get('arbzg_breaks_enabled') == 'on'
     
     # Connect to database
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
     # Update system settings (user_id = 0)
@@ -2730,8 +2215,9 @@ def update_user_settings():
         WHERE user_id = 0
     ''', (auto_break_detection, auto_break_threshold, exclude_breaks, arbzg_breaks_enabled))
     
+    # Applies to every user without own settings
+    bump_user_version(cursor, SYSTEM_USER_ID)
     conn.commit()
-    conn.close()
     
     flash('Systemeinstellungen wurden aktualisiert', 'success')
     return redirect(url_for('break_settings'))
@@ -2777,7 +2263,7 @@ def reset_password(user_id):
     hashed_password = bcrypt.generate_password_hash(new_password).decode('utf-8')
     
     # Connect to database
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     
     # Update the user's password
@@ -2789,16 +2275,13 @@ def reset_password(user_id):
     username = user[0] if user else 'Unknown'
     
     conn.commit()
-    conn.close()
     
     success_message = f'Passwort für {username} wurde erfolgreich geändert'
     
     # Store the temporary password in encrypted format for datasheet generation
     # Use the same encryption method but with a different salt to allow decryption
     try:
-        # We need to reconnect to the database here since we closed it above
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row  # Set row factory for consistent behavior
+        conn = get_db()
         cursor = conn.cursor()
         
         # Generate a secure random key for this password that we can use to verify
@@ -2817,12 +2300,9 @@ def reset_password(user_id):
             WHERE id = ?
         ''', (hashed_password, verification_hash, user_id))
         conn.commit()
-        conn.close()
         logging.info(f"Encrypted temporary password stored in database for password reset, user ID: {user_id}")
     except Exception as e:
         logging.error(f"Error storing encrypted temp password for reset: {str(e)}")
-        if 'conn' in locals() and conn:
-            conn.close()
     
     # Generate datasheet URL
     datasheet_url = url_for('user_datasheet', user_id=user_id)
@@ -2860,8 +2340,7 @@ def change_password():
             return render_template('change_password.html')
         
         # Connect to database
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row
+        conn = get_db()
         cursor = conn.cursor()
         
         # Get current user's data
@@ -2870,13 +2349,11 @@ def change_password():
         user = cursor.fetchone()
         
         if not user:
-            conn.close()
             flash('Benutzer nicht gefunden', 'error')
             return render_template('change_password.html')
         
         # Verify current password
         if not bcrypt.check_password_hash(user['password'], current_password):
-            conn.close()
             flash('Das aktuelle Passwort ist nicht korrekt', 'error')
             return render_template('change_password.html')
         
@@ -2886,13 +2363,10 @@ def change_password():
         # Update the password
         cursor.execute('UPDATE users SET password = ? WHERE id = ?', (hashed_password, user_id))
         conn.commit()
-        conn.close()
         
         # Store the temporary password in encrypted format for password print button
         try:
-            # Reconnect to the database
-            conn = sqlite3.connect(DATABASE)
-            conn.row_factory = sqlite3.Row  # Set row factory for consistent behavior
+            conn = get_db()
             cursor = conn.cursor()
             
             # Generate a verification hash for the password
@@ -2908,12 +2382,9 @@ def change_password():
                 WHERE id = ?
             ''', (hashed_password, verification_hash, user_id))
             conn.commit()
-            conn.close()
             logging.info(f"Encrypted temporary password stored in database after user-initiated password change, user ID: {user_id}")
         except Exception as e:
             logging.error(f"Error storing encrypted temp password after password change: {str(e)}")
-            if 'conn' in locals() and conn:
-                conn.close()
         
         flash('Ihr Passwort wurde erfolgreich geändert', 'success')
         return redirect(url_for('index'))
@@ -2936,8 +2407,8 @@ def generate_report():
     is_ajax_request = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
     
     # Build the user_report URL
-    if user_id and session.get('admin_logged_in'):
-        # Admin accessing another user's report
+    if session.get('admin_logged_in'):
+        # Admin accessing another user's report; empty means all users
         username = user_id
     else:
         # Regular user or admin viewing their own report
@@ -2990,6 +2461,7 @@ def report_auth(username):
                            month=month,
                            entire_period=entire_period))
 
+@app.route('/user_report/', defaults={'username': ''}, methods=['GET', 'POST'])
 @app.route('/user_report/<username>', methods=['GET', 'POST'])
 def user_report(username):
     # Check if user is authorized
@@ -3035,101 +2507,98 @@ def user_report(username):
     month = request.args.get('month', '') if request.method == 'GET' else request.form.get('month', '')
     entire_period = request.args.get('entire_period', 'false') if request.method == 'GET' else request.form.get('entire_period', 'false')
     
-    # Connect to database with row factory
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    # Prepare query based on parameters
-    query = '''
-        SELECT a.check_in, a.check_out, a.has_auto_breaks, a.billable_minutes
-        FROM attendance a
-        JOIN users u ON a.user_id = u.id
-        WHERE u.username = ?
-    '''
-    params = [username]
-    all_users = False
-    
-    # If username is empty and admin requested all users
-    if not username and session.get('admin_logged_in'):
-        query = '''
-            SELECT u.username, a.check_in, a.check_out, a.has_auto_breaks, a.billable_minutes
-            FROM attendance a
-            JOIN users u ON a.user_id = u.id
-        '''
-        params = []
-        all_users = True
-    
-    # Filter by date if provided
-    if date:
-        query += " AND DATE(a.check_in) = DATE(?)"
-        params.append(date)
-    
-    # Filter by week if provided
-    elif week:
-        # Parse week string (format: YYYY-Www)
-        year, week_num = week.split('-W')
-        query += " AND strftime('%Y', a.check_in) = ? AND strftime('%W', a.check_in) = ?"
-        params.extend([year, week_num.zfill(2)])
-    
-    # Filter by month if provided
-    elif month:
-        # Parse month string (format: YYYY-MM)
-        year, month_num = month.split('-')
-        query += " AND strftime('%Y', a.check_in) = ? AND strftime('%m', a.check_in) = ?"
-        params.extend([year, month_num.zfill(2)])
-    
-    # Sort by date
-    query += " ORDER BY a.check_in DESC"
-    
-    # Execute query
-    cursor.execute(query, params)
-    attendance_records = cursor.fetchall()
+    # The entire-period option wins over a date the form still carries
+    if entire_period in ('1', 'true'):
+        date = week = month = ''
     
-    # Calculate durations
-    records_with_duration = []
-    total_minutes = 0
-    
-    for rec in attendance_records:
-        if all_users:
-            checkin = rec['check_in']
-            checkout = rec['check_out']
-        else:
-            checkin = rec['check_in']
-            checkout = rec['check_out']
-        
-        if checkin and checkout:
-            duration = get_duration(checkin, checkout)
-            # Add to total (extract hours and minutes)
-            try:
-                hours, minutes = map(int, duration.split(':'))
-                total_minutes += (hours * 60 + minutes)
-            except:
-                pass
-        else:
-            duration = "-"
-        
-        records_with_duration.append((rec, duration))
+    # Connect to database
+    conn = get_db()
+    cursor = conn.cursor()
     
-    # Calculate total hours and minutes
-    total_hours = total_minutes // 60
-    remaining_minutes = total_minutes % 60
-    total_duration = f"{total_hours}:{remaining_minutes:02d}"
+    # An empty username means all users (admins only)
+    all_users = not username and session.get('admin_logged_in')
+    user_id = None
+    if not all_users:
+        user = user_directory.find(cursor, username)
+        # Unknown users simply get an empty report
+        user_id = user.id if user else -1
     
-    conn.close()
+    # Date, ISO week (YYYY-Www) or month (YYYY-MM) as half-open bounds
+    try:
+        bounds = period_bounds(date, week, month)
+    except ValueError:
+        return 'Ungültiger Zeitraum', 400
+    
+    # Cached results are valid while the report version of the user (or of
+    # all users) over the period's months is unchanged
+    period = ('day', date) if date else ('week', week.upper()) if week else ('month', month) if month else ('all', '')
+    version = report_version(cursor, user_id, bounds)
+    closed = period_is_closed(bounds)
+    
+    def cached(variant, build):
+        return report_cache.get_or_build((user_id, *period, variant), version, build, closed)
+    
+    totals = cached('totals', lambda: report_totals(cursor, user_id, bounds))
+    
+    # Rows are streamed into the template from their own cursor unless they
+    # come from the cache. The all-users report renders the first page plus
+    # per-user totals; further pages are loaded from /api/reports/all_users.
+    user_totals = None
+    page_url = None
+    if all_users:
+        user_totals = cached('user_totals', lambda: report_totals_by_user(cursor, bounds))
+        records = cached('first_page', lambda: list(report_rows(cursor, None, bounds, limit=REPORT_PAGE_SIZE)))
+        if totals['records'] > REPORT_PAGE_SIZE:
+            period_args = {'date': date, 'week': week, 'month': month}
+            page_url = url_for('api_all_users_report', **{key: value for key, value in period_args.items() if value})
+    elif totals['records'] <= REPORT_CACHE_MAX_ROWS:
+        records = cached('rows', lambda: list(report_rows(cursor, user_id, bounds)))
+    else:
+        records = report_rows(conn.cursor(), user_id, bounds)
     
     # Format the current time for the report
     current_time = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
     
-    return render_template(
+    return stream_template(
         'user_report.html',
         username=username,
-        records=records_with_duration,
+        records=records,
         all_users=all_users,
-        total_duration=total_duration,
+        totals=totals,
+        user_totals=user_totals,
+        page_url=page_url,
+        page_size=REPORT_PAGE_SIZE,
+        period=period,
         current_time=current_time
     )
 
+@app.route('/api/reports/all_users')
+def api_all_users_report():
+    """Return one keyset page of the all-users report as JSON (admins only)."""
+    if not session.get('admin_logged_in'):
+        return jsonify({'success': False, 'message': 'Nicht autorisiert'}), 403
+    
+    try:
+        bounds = period_bounds(request.args.get('date', ''), request.args.get('week', ''),
+                               request.args.get('month', ''))
+        after = decode_cursor(request.args['after']) if request.args.get('after') else None
+        limit = min(max(int(request.args.get('limit', REPORT_PAGE_SIZE)), 1), REPORT_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Ungültiger Zeitraum oder Cursor'}), 400
+    
+    rows = list(report_rows(get_db().cursor(), None, bounds, after=after, limit=limit))
+    records = [{
+        'username': row['username'],
+        'check_in': row['check_in'],
+        'check_out': row['check_out'],
+        'work_date': row['work_date'],
+        'gross_minutes': row['gross_minutes'],
+        'billable_minutes': row['billable_minutes'],
+    } for row in rows]
+    # A full page may have a successor; the client stops at an empty page
+    next_cursor = encode_cursor(rows[-1]) if len(rows) == limit else None
+    return jsonify({'success': True, 'records': records, 'next_cursor': next_cursor})
+
 @app.route('/get_breaks/<int:attendance_id>')
 def get_breaks(attendance_id):
     """Get breaks for a specific attendance record"""
@@ -3137,67 +2606,71 @@ def get_breaks(attendance_id):
         return jsonify({'success': False, 'message': 'Nicht angemeldet'}), 401
 
     # Connect to database
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     try:
-        # Get breaks for the attendance record
-        cursor.execute('''
-            SELECT id, start_time, end_time, duration_minutes, 
-                is_excluded_from_billing AS is_excluded, 
-                is_auto_detected AS is_auto, 
-                description
-            FROM breaks
-            WHERE attendance_id = ?
-            ORDER BY start_time
-        ''', (attendance_id,))
-        
-        breaks = []
-        for row in cursor.fetchall():
-            # Determine break type for better display
-            break_type = None
-            if row['is_auto']:
-                if row['description'] and 'ArbZG' in row['description']:
-                    if 'Mittagspause' in row['description']:
-                        break_type = 'lunch'
-                    else:
-                        break_type = 'arbzg'
-                else:
-                    break_type = 'auto'
-            else:
-                break_type = 'manual'
-            
-            breaks.append({
-                'id': row['id'],
-                'start_time': row['start_time'],
-                'end_time': row['end_time'],
-                'duration': row['duration_minutes'],
-                'is_excluded': bool(row['is_excluded']),
-                'is_auto': bool(row['is_auto']),
-                'break_type': break_type,
-                'description': row['description'] or ''
-            })
-        
-        # Check if attendance record has auto breaks flag set
-        cursor.execute('SELECT has_auto_breaks FROM attendance WHERE id = ?', (attendance_id,))
+        # The owner decides access and which change version applies
+        cursor.execute('SELECT user_id FROM attendance WHERE id = ?', (attendance_id,))
         attendance = cursor.fetchone()
         
-        conn.close()
+        if attendance and not session.get('admin_logged_in') and str(attendance['user_id']) != str(session.get('user_id')):
+            return jsonify({'success': False, 'message': 'Keine Berechtigung'}), 403
         
-        # Include information about the attendance record
-        return jsonify({
-            'success': True, 
-            'breaks': breaks,
-            'has_auto_breaks': bool(attendance and attendance['has_auto_breaks']),
-            'total_count': len(breaks)
-        })
+        def build(cursor):
+            _, breaks_json = breaks_by_attendance(cursor, [attendance_id])[attendance_id]
+            result = json.loads(breaks_json)
+            result['success'] = True
+            return result
+        
+        if not attendance:
+            return jsonify({'success': True, 'breaks': [], 'has_auto_breaks': False, 'total_count': 0})
+        return versioned_json(f'breaks-{attendance_id}', attendance['user_id'], build)
         
     except Exception as e:
-        conn.close()
         logging.error(f"Error retrieving breaks: {str(e)}")
         return jsonify({'success': False, 'message': f'Fehler beim Abrufen der Pausen: {str(e)}'}), 500
 
+# Upper bound of records per batch request; the admin table shows 100 rows
+BREAKS_BATCH_LIMIT = 500
+
+@app.route('/get_breaks_batch')
+def get_breaks_batch():
+    """Get the breaks of many attendance records, grouped by attendance id.
+
+    Select the records with ids=1,2,3 or with start_date/end_date
+    (YYYY-MM-DD) and an optional user_id. Non-admin users only get their
+    own records.
+    """
+    if not session.get('username'):
+        return jsonify({'success': False, 'message': 'Nicht angemeldet'}), 401
+    
+    try:
+        ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        for day in (start_date, end_date):
+            if day:
+                datetime.strptime(day, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Ungültige IDs oder Datumsangaben'}), 400
+    
+    if ids:
+        if len(ids) > BREAKS_BATCH_LIMIT:
+            return jsonify({'success': False, 'message': f'Höchstens {BREAKS_BATCH_LIMIT} IDs pro Anfrage'}), 400
+        start_date = end_date = None
+    elif not (start_date and end_date):
+        return jsonify({'success': False, 'message': 'Bitte IDs oder einen Zeitraum angeben'}), 400
+    
+    user_id = request.args.get('user_id', type=int)
+    if not session.get('admin_logged_in'):
+        user_id = session.get('user_id')
+    
+    # The whole response is one JSON value built by SQLite
+    row_json = breaks_batch_json(get_db().cursor(), ids or None, user_id, start_date, end_date,
+                                 limit=BREAKS_BATCH_LIMIT)
+    return Response(row_json, mimetype='application/json')
+
 @app.route('/update_consent', methods=['POST'])
 def update_consent():
     """Update user consent status (admin only)"""
@@ -3218,24 +2691,19 @@ def update_consent():
             return jsonify({'success': False, 'message': 'Benutzer-ID und Einwilligungsstatus sind erforderlich'}), 400
             
         # Connect to database
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         
         # Check if user exists
         cursor.execute('SELECT id FROM users WHERE id = ?', (user_id,))
         if not cursor.fetchone():
-            conn.close()
             return jsonify({'success': False, 'message': 'Benutzer nicht gefunden'}), 404
         
         # Insert new consent record with timestamp
         now = datetime.now().isoformat()
-        cursor.execute('''
-            INSERT INTO user_consents (user_id, consent_status, consent_date)
-            VALUES (?, ?, ?)
-        ''', (user_id, consent_status, now))
+        record_consent(cursor, user_id, consent_status, now)
         
         conn.commit()
-        conn.close()
         
         return jsonify({
             'success': True, 
@@ -3267,7 +2735,6 @@ def get_user_password(user_id):
     
     try:
         db = get_db()
-        db.row_factory = sqlite3.Row
         cursor = db.cursor()
         
         # Fetch user information
@@ -3423,8 +2890,7 @@ def api_user_datasheet(user_id):
         return jsonify({'error': 'Admin access required'}), 403
     
     # Connect to database
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    conn = get_db()
     cursor = conn.cursor()
     
     try:
@@ -3449,12 +2915,6 @@ def api_user_datasheet(user_id):
         creation_date = datetime.now().strftime("%d.%m.%Y %H:%M")
         current_date = datetime.now().strftime("%d.%m.%Y")
         
-        # Get the base URL for login
-        if request.host.startswith('localhost') or request.host.startswith('127.0.0.1'):
-            login_url = f"http://{request.host}"
-        else:
-            login_url = f"https://{request.host}"
-        
         # Delete the temp password after use (one-time use)
         cursor.execute('DELETE FROM temp_passwords WHERE user_id = ?', (user_id,))
         conn.commit()
@@ -3465,14 +2925,12 @@ def api_user_datasheet(user_id):
             'password': temp_password,
             'creation_date': creation_date,
             'current_date': current_date,
-            'login_url': login_url
+            'login_url': login_url()
         })
     
     except Exception as e:
         logging.error(f"Error getting datasheet data: {str(e)}")
         return jsonify({'error': f'Fehler beim Laden der Daten: {str(e)}'}), 500
-    finally:
-        conn.close()
 
 @app.route('/my_credentials')
 def my_credentials():
@@ -3487,19 +2945,13 @@ def my_credentials():
         flash('Benutzerinformationen nicht gefunden', 'error')
         return redirect(url_for('index'))
     
-    # Get the base URL for login
-    if request.host.startswith('localhost') or request.host.startswith('127.0.0.1'):
-        login_url = f"http://{request.host}"
-    else:
-        login_url = f"https://{request.host}"
-    
     # Get current date
     current_date = datetime.now().strftime("%d.%m.%Y")
     
     return render_template('my_credentials.html',
                          username=username,
                          user_id=user_id,
-                         login_url=login_url,
+                         login_url=login_url(),
                          current_date=current_date)
 
 @app.route('/api/search_users', methods=['GET'])
@@ -3515,77 +2967,15 @@ def api_search_users():
     # Get search parameters
     search_term = request.args.get('search', '').strip()
     consent_filter = request.args.get('consent', '').strip()
-    sort_by = request.args.get('sort', 'username-asc')
-    limit = request.args.get('limit', type=int)
-    offset = request.args.get('offset', 0, type=int)
-    
-    db = get_db()
-    db.row_factory = sqlite3.Row
-    cursor = db.cursor()
+    sort_by = normalize_user_sort(request.args.get('sort', ''), search_term)
     
     try:
-        # Build the query
-        query = '''
-            SELECT u.id, u.username, COALESCE(uc.consent_status, 'Unknown') AS consent_status
-            FROM users u
-            LEFT JOIN (
-                SELECT user_id, consent_status 
-                FROM user_consents 
-                WHERE id IN (SELECT MAX(id) FROM user_consents GROUP BY user_id)
-            ) uc ON u.id = uc.user_id
-        '''
-        
-        params = []
-        conditions = []
-        
-        # Add search filter
-        if search_term:
-            conditions.append('(u.username LIKE ? OR u.id LIKE ?)')
-            search_pattern = f'%{search_term}%'
-            params.extend([search_pattern, search_pattern])
-        
-        # Add consent filter
-        if consent_filter:
-            conditions.append('COALESCE(uc.consent_status, "Unknown") = ?')
-            params.append(consent_filter)
-        
-        # Add WHERE clause if there are conditions
-        if conditions:
-            query += ' WHERE ' + ' AND '.join(conditions)
-        
-        # Add sorting
-        if sort_by == 'username-desc':
-            query += ' ORDER BY u.username DESC'
-        elif sort_by == 'id-asc':
-            query += ' ORDER BY u.id ASC'
-        elif sort_by == 'id-desc':
-            query += ' ORDER BY u.id DESC'
-        else:  # default: username-asc
-            query += ' ORDER BY u.username ASC'
-        
-        # Add pagination if specified
-        if limit:
-            query += f' LIMIT {limit} OFFSET {offset}'
-        
-        cursor.execute(query, params)
-        users = cursor.fetchall()
-        
-        # Get total count for pagination
-        count_query = '''
-            SELECT COUNT(*) as total
-            FROM users u
-            LEFT JOIN (
-                SELECT user_id, consent_status 
-                FROM user_consents 
-                WHERE id IN (SELECT MAX(id) FROM user_consents GROUP BY user_id)
-            ) uc ON u.id = uc.user_id
-        '''
-        
-        if conditions:
-            count_query += ' WHERE ' + ' AND '.join(conditions)
-        
-        cursor.execute(count_query, params)
-        total_count = cursor.fetchone()['total']
+        # One page in (sort key, id) order; 'after' is the next_cursor of the previous page
+        users, total_count, next_cursor = list_users(
+            get_db().cursor(), search_term, consent=consent_filter, sort=sort_by,
+            after=request.args.get('after', ''),
+            limit=request.args.get('limit', USER_PAGE_SIZE, type=int)
+        )
         
         # Convert to list of dictionaries
         users_list = []
@@ -3601,15 +2991,33 @@ def api_search_users():
             'users': users_list,
             'total': total_count,
             'filtered': len(users_list),
+            'next_cursor': next_cursor,
             'search_term': search_term,
             'consent_filter': consent_filter,
             'sort_by': sort_by
         })
         
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Ungültiger Cursor'}), 400
     except Exception as e:
         logging.error(f"Error searching users: {str(e)}")
         return jsonify({'success': False, 'message': f'Fehler bei der Suche: {str(e)}'}), 500
 
+@app.route('/api/users/lookup')
+def api_lookup_users():
+    """Username prefix search for the user pickers (admins only)"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'success': False, 'message': 'Nicht autorisiert'}), 403
+    
+    prefix = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 50)
+    users = user_directory.search(get_db().cursor(), prefix, limit)
+    return jsonify({
+        'success': True,
+        'users': [{'id': user.id, 'username': user.username, 'display_name': user.display_name,
+                   'account_status': user.account_status} for user in users]
+    })
+
 @app.route('/api/sync_user_data', methods=['POST'])
 def api_sync_user_data():
     """API endpoint to trigger user data synchronization across systems"""
@@ -3626,13 +3034,12 @@ def api_sync_user_data():
         
         # Get user data
         db = get_db()
-        db.row_factory = sqlite3.Row
         cursor = db.cursor()
         
         cursor.execute('''
             SELECT u.*, uc.consent_status, uc.consent_date
             FROM users u
-            LEFT JOIN user_consents uc ON u.id = uc.user_id
+            LEFT JOIN current_consents uc ON u.id = uc.user_id
             WHERE u.id = ?
         ''', (user_id,))
         
@@ -3734,7 +3141,7 @@ def api_system_status():
         cursor.execute("SELECT COUNT(*) as active_users FROM users WHERE account_status = 'active'")
         active_users = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(*) as pending_consents FROM user_consents WHERE consent_status = 'pending'")
+        cursor.execute(CONSENT_COUNT_SQL, ('pending',))
         pending_consents = cursor.fetchone()[0]
         
         # Check last sync times (this would be stored in a sync_log table in a real implementation)
@@ -3744,6 +3151,12 @@ def api_system_status():
         status = {
             'system_health': 'healthy',
             'database_status': 'connected',
+            'database_pool': db_pool.stats(),
+            'checkout_latency': checkout_latency_stats(),
+            'status_streams': status_bus.stats(),
+            'report_cache': report_cache.stats(),
+            'user_directory': user_directory.stats(),
+            'export_jobs': export_jobs.stats(),
             'user_statistics': {
                 'total_users': total_users,
                 'active_users': active_users,
@@ -3768,6 +3181,129 @@ def api_system_status():
         }), 500
 
 
+# State of the background break recomputation started from the admin API
+_recompute_lock = threading.Lock()
+_recompute_job = {'status': 'idle'}
+
+def _run_break_recompute(options):
+    def report(totals):
+        with _recompute_lock:
+            _recompute_job['progress'] = totals
+        logging.info(f"Break recomputation: {totals['processed']}/{totals['total']} records, "
+                     f"{totals['changed']} changed")
+    
+    try:
+        with db_pool.connection() as conn:
+            result = recompute_breaks(conn, progress=report, **options)
+        with _recompute_lock:
+            _recompute_job.update(status='finished', result=result, finished_at=get_local_time().isoformat())
+    except Exception as e:
+        logging.error(f"Break recomputation failed: {str(e)}")
+        with _recompute_lock:
+            _recompute_job.update(status='failed', error=str(e), finished_at=get_local_time().isoformat())
+
+@app.route('/api/admin/recompute_breaks', methods=['GET', 'POST'])
+def api_recompute_breaks():
+    """Start (POST) or poll (GET) the recomputation of ArbZG breaks and billable minutes"""
+    if not session.get('username') or not session.get('admin_logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if request.method == 'GET':
+        with _recompute_lock:
+            return jsonify(dict(_recompute_job))
+    
+    data = request.get_json(silent=True) or request.form
+    user_ids = data.get('user_ids') or []
+    if isinstance(user_ids, str):
+        user_ids = [user_id for user_id in user_ids.split(',') if user_id.strip()]
+    
+    try:
+        options = {
+            'user_ids': [int(user_id) for user_id in user_ids],
+            'first_day': data.get('start_date') or None,
+            'last_day': data.get('end_date') or None,
+            'dry_run': str(data.get('dry_run', '')).lower() in ('1', 'true', 'on', 'yes'),
+        }
+        for day in (options['first_day'], options['last_day']):
+            if day:
+                datetime.strptime(day, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': 'Ungültige Benutzer-IDs oder Datumsangaben'}), 400
+    
+    with _recompute_lock:
+        if _recompute_job.get('status') == 'running':
+            return jsonify({'error': 'Eine Neuberechnung läuft bereits', 'job': dict(_recompute_job)}), 409
+        _recompute_job.clear()
+        _recompute_job.update(status='running', options=options, started_at=get_local_time().isoformat(),
+                              started_by=session.get('username'))
+    
+    logging.info(f"Break recomputation started by {session.get('username')}: {options}")
+    threading.Thread(target=_run_break_recompute, args=(options,), daemon=True).start()
+    return jsonify({'success': True, 'job': options}), 202
+
+
+
+@app.route('/full_data_export')
+def full_data_export():
+    """Admin page for background exports"""
+    if not session.get('username'):
+        return redirect(url_for('login'))
+    
+    if not session.get('admin_logged_in'):
+        flash('Nur Administratoren können Datenexporte erstellen', 'error')
+        return redirect(url_for('index'))
+    
+    return render_template('full_data_export.html', export_kinds=EXPORT_KINDS)
+
+@app.route('/api/admin/exports', methods=['GET', 'POST'])
+def api_export_jobs():
+    """Queue an export (POST) or list the newest export jobs (GET)"""
+    if not session.get('username') or not session.get('admin_logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if request.method == 'GET':
+        return jsonify({'jobs': export_jobs.list()})
+    
+    data = request.get_json(silent=True) or request.form
+    try:
+        job = export_jobs.submit(data.get('kind', ''), {
+            'user_id': data.get('user_id'),
+            'format': data.get('format'),
+        }, requested_by=session.get('username'))
+    except ExportQueueFull as e:
+        return jsonify({'error': f'Zu viele laufende Exporte, bitte später erneut versuchen ({e})'}), 429
+    except ValueError as e:
+        return jsonify({'error': f'Ungültiger Export: {e}'}), 400
+    
+    logging.info(f"Export job {job['id']} ({job['kind']}) queued by {session.get('username')}")
+    return jsonify({'success': True, 'job': job}), 202
+
+@app.route('/api/admin/exports/<int:job_id>')
+def api_export_job(job_id):
+    """Poll one export job"""
+    if not session.get('username') or not session.get('admin_logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    job = export_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Export nicht gefunden'}), 404
+    return jsonify(job)
+
+@app.route('/api/admin/exports/<int:job_id>/download')
+def download_export(job_id):
+    """Download the file of a finished export job"""
+    if not session.get('username') or not session.get('admin_logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    job = export_jobs.get(job_id)
+    if job is None or job['status'] != 'finished':
+        return jsonify({'error': 'Export nicht verfügbar oder abgelaufen'}), 404
+    
+    logging.info(f"Export job {job_id} downloaded by {session.get('username')}")
+    return send_file(export_jobs.file_path(job), as_attachment=True, download_name=job['file_name'],
+                     mimetype='application/json' if job['file_name'].endswith('.json') else 'text/csv')
+
+
 def verify_webhook_auth(auth_header):
     """Verify webhook authentication"""
     # Implement your authentication mechanism here
@@ -3907,7 +3443,6 @@ def edit_user(user_id):
         # Return user data for editing
         try:
             db = get_db()
-            db.row_factory = sqlite3.Row
             cursor = db.cursor()
             
             cursor.execute('''
@@ -3916,11 +3451,7 @@ def edit_user(user_id):
                     u.user_role, u.department, u.account_status,
                     COALESCE(uc.consent_status, 'pending') AS consent_status
                 FROM users u
-                LEFT JOIN (
-                    SELECT user_id, consent_status
-                    FROM user_consents 
-                    WHERE id IN (SELECT MAX(id) FROM user_consents GROUP BY user_id)
-                ) uc ON u.id = uc.user_id
+                LEFT JOIN current_consents uc ON u.id = uc.user_id
                 WHERE u.id = ?
             ''', (user_id,))
             
@@ -4007,14 +3538,17 @@ def edit_user(user_id):
             
             # Check if employee_id already exists for another user (if provided)
             if employee_id:
-                cursor.execute('SELECT id FROM users WHERE employee_id = ? AND id != ?', (employee_id, user_id))
-                if cursor.fetchone():
+                cursor.execute(EMPLOYEE_ID_SQL, (employee_id,))
+                if any(row['id'] != user_id for row in cursor.fetchall()):
                     error_msg = f'Mitarbeiter-ID {employee_id} wird bereits verwendet'
                     if is_ajax:
                         return jsonify({'success': False, 'message': error_msg}), 400
                     flash(error_msg, 'error')
                     return redirect(url_for('user_management'))
             
+            cursor.execute('SELECT username FROM users WHERE id = ?', (user_id,))
+            previous = cursor.fetchone()
+            
             # Update user data
             current_time = get_local_time().strftime('%Y-%m-%d %H:%M:%S')
             is_admin = 1 if user_role == 'admin' else 0
@@ -4028,11 +3562,13 @@ def edit_user(user_id):
             ''', (username, first_name, last_name, employee_id, user_role, 
                   department, account_status, is_admin, current_time, user_id))
             
+            # Cached report rows carry the username
+            if previous and previous['username'] != username:
+                bump_all_report_months(cursor, user_id)
+            
             # Update consent status if changed
-            cursor.execute('''
-                INSERT INTO user_consents (user_id, consent_status, consent_date)
-                VALUES (?, ?, ?)
-            ''', (user_id, consent_status, current_time))
+            record_consent(cursor, user_id, consent_status, current_time)
+            bump_directory_version(cursor)
             
             db.commit()
             
@@ -4085,6 +3621,7 @@ def toggle_user_status(user_id):
         cursor.execute('''
             UPDATE users SET account_status = ?, updated_at = ? WHERE id = ?
         ''', (new_status, current_time, user_id))
+        bump_directory_version(cursor)
         
         db.commit()
         
@@ -4115,7 +3652,6 @@ def view_user_details(user_id):
     
     try:
         db = get_db()
-        db.row_factory = sqlite3.Row
         cursor = db.cursor()
         
         # Get user details with consent history
@@ -4127,11 +3663,7 @@ def view_user_details(user_id):
                 COALESCE(uc.consent_status, 'Unknown') AS current_consent_status,
                 COALESCE(uc.consent_date, '') AS current_consent_date
             FROM users u
-            LEFT JOIN (
-                SELECT user_id, consent_status, consent_date
-                FROM user_consents 
-                WHERE id IN (SELECT MAX(id) FROM user_consents GROUP BY user_id)
-            ) uc ON u.id = uc.user_id
+            LEFT JOIN current_consents uc ON u.id = uc.user_id
             WHERE u.id = ?
         ''', (user_id,))
         
@@ -4142,29 +3674,20 @@ def view_user_details(user_id):
         user_data = dict(user)
         
         # Get consent history
-        cursor.execute('''
-            SELECT consent_status, consent_date
-            FROM user_consents
-            WHERE user_id = ?
-            ORDER BY consent_date DESC
-            LIMIT 10
-        ''', (user_id,))
+        cursor.execute(CONSENT_HISTORY_SQL, (user_id,))
         
         consent_history = [dict(row) for row in cursor.fetchall()]
         user_data['consent_history'] = consent_history
         
-        # Get attendance summary
+        # Get attendance summary from the daily rollup
         cursor.execute('''
             SELECT 
                 COUNT(*) as total_days,
-                COUNT(CASE WHEN check_out IS NOT NULL THEN 1 END) as completed_days,
-                AVG(CASE 
-                    WHEN check_out IS NOT NULL 
-                    THEN (julianday(check_out) - julianday(check_in)) * 24 * 60 
-                END) as avg_hours_per_day
-            FROM attendance
-            WHERE user_id = ? AND check_in >= date('now', '-30 days')
-        ''', (user_id,))
+                COUNT(CASE WHEN worked_minutes > 0 THEN 1 END) as completed_days,
+                AVG(CASE WHEN worked_minutes > 0 THEN worked_minutes END) as avg_hours_per_day
+            FROM daily_summaries
+            WHERE user_id = ? AND work_date >= ?
+        ''', (user_id, (get_local_time() - timedelta(days=30)).strftime('%Y-%m-%d')))
         
         attendance_stats = cursor.fetchone()
         if attendance_stats:
@@ -4217,62 +3740,19 @@ def export_users():
         return jsonify({'success': False, 'message': 'Nur Administratoren können Benutzerdaten exportieren'}), 403
     
     try:
-        import csv
-        import io
-        
-        db = get_db()
-        db.row_factory = sqlite3.Row
-        cursor = db.cursor()
-        
-        # Get all users with consent status
-        cursor.execute('''
-            SELECT 
-                u.id, u.username, u.first_name, u.last_name, u.employee_id,
-                u.user_role, u.department, u.account_status, u.is_admin,
-                u.created_at, u.updated_at,
-                COALESCE(uc.consent_status, 'Unknown') AS consent_status,
-                COALESCE(uc.consent_date, '') AS consent_date
-            FROM users u
-            LEFT JOIN (
-                SELECT user_id, consent_status, consent_date
-                FROM user_consents 
-                WHERE id IN (SELECT MAX(id) FROM user_consents GROUP BY user_id)
-            ) uc ON u.id = uc.user_id
-            ORDER BY u.username
-        ''')
-        
-        users = cursor.fetchall()
-        
-        # Create CSV content
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow([
-            'ID', 'Benutzername', 'Vorname', 'Nachname', 'Mitarbeiter-ID',
-            'Rolle', 'Abteilung', 'Status', 'Admin', 'Erstellt am', 'Aktualisiert am',
-            'Datenschutz-Status', 'Datenschutz-Datum'
-        ])
-        
-        # Write user data
-        for user in users:
-            writer.writerow([
-                user['id'], user['username'], user['first_name'] or '', 
-                user['last_name'] or '', user['employee_id'] or '',
-                user['user_role'], user['department'] or '', user['account_status'],
-                'Ja' if user['is_admin'] else 'Nein', user['created_at'], user['updated_at'],
-                user['consent_status'], user['consent_date']
-            ])
-        
-        # Create response
-        output.seek(0)
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-        response.headers['Content-Disposition'] = f'attachment; filename=benutzer_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        cursor = get_db().cursor()
+        # Run the query before the response starts, so errors still get a JSON answer
+        select_users_for_export(cursor)
         
+        filename = f'benutzer_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
         logging.info(f"User data exported by admin {session.get('username')}")
         
-        return response
+        # Header row first, then the users in batches straight from the cursor
+        return Response(
+            stream_with_context(csv_stream(USER_EXPORT_HEADER, iter_batches(cursor), format_user_row)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
         
     except Exception as e:
         logging.error(f"Error exporting users: {str(e)}")
@@ -4307,25 +3787,13 @@ def bulk_consent_action():
             cursor.execute(f'SELECT id, username FROM users WHERE id IN ({placeholders})', user_ids)
             users = cursor.fetchall()
             
-            for user_id, username in users:
-                cursor.execute('''
-                    INSERT INTO user_consents (user_id, consent_status, consent_date)
-                    VALUES (?, ?, ?)
-                ''', (user_id, action, current_time))
-            
-            affected_count = len(users)
+            affected_count = record_consents(cursor, [row['id'] for row in users], action, current_time)
         else:
             # Update all users
             cursor.execute('SELECT id FROM users')
             all_user_ids = [row[0] for row in cursor.fetchall()]
             
-            for user_id in all_user_ids:
-                cursor.execute('''
-                    INSERT INTO user_consents (user_id, consent_status, consent_date)
-                    VALUES (?, ?, ?)
-                ''', (user_id, action, current_time))
-            
-            affected_count = len(all_user_ids)
+            affected_count = record_consents(cursor, all_user_ids, action, current_time)
         
         db.commit()
         
@@ -4357,100 +3825,31 @@ def search_users():
     try:
         # Get search parameters
         search_term = request.args.get('q', '').strip()
-        role_filter = request.args.get('role', '')
-        status_filter = request.args.get('status', '')
-        department_filter = request.args.get('department', '')
-        consent_filter = request.args.get('consent', '')
+        sort_by = normalize_user_sort(request.args.get('sort', ''), search_term)
         
-        db = get_db()
-        db.row_factory = sqlite3.Row
-        cursor = db.cursor()
-        
-        # Build query with filters
-        query = '''
-            SELECT 
-                u.id, u.username, u.first_name, u.last_name, u.employee_id,
-                u.user_role, u.department, u.account_status,
-                COALESCE(uc.consent_status, 'Unknown') AS consent_status,
-                COALESCE(uc.consent_date, '') AS consent_date
-            FROM users u
-            LEFT JOIN (
-                SELECT user_id, consent_status, consent_date
-                FROM user_consents 
-                WHERE id IN (SELECT MAX(id) FROM user_consents GROUP BY user_id)
-            ) uc ON u.id = uc.user_id
-            WHERE 1=1
-        '''
-        
-        params = []
-        
-        # Add search term filter
-        if search_term:
-            query += '''
-                AND (
-                    u.username LIKE ? OR 
-                    u.first_name LIKE ? OR 
-                    u.last_name LIKE ? OR 
-                    u.employee_id LIKE ? OR
-                    u.department LIKE ?
-                )
-            '''
-            search_pattern = f'%{search_term}%'
-            params.extend([search_pattern] * 5)
+        users, total_count, next_cursor = list_users(
+            get_db().cursor(), search_term,
+            role=request.args.get('role', ''),
+            status=request.args.get('status', ''),
+            department=request.args.get('department', ''),
+            consent=request.args.get('consent', ''),
+            sort=sort_by,
+            after=request.args.get('after', ''),
+            limit=request.args.get('limit', USER_PAGE_SIZE, type=int)
+        )
         
-        # Add role filter
-        if role_filter:
-            query += ' AND u.user_role = ?'
-            params.append(role_filter)
-        
-        # Add status filter
-        if status_filter:
-            query += ' AND u.account_status = ?'
-            params.append(status_filter)
-        
-        # Add department filter
-        if department_filter:
-            query += ' AND u.department LIKE ?'
-            params.append(f'%{department_filter}%')
-        
-        # Add consent filter
-        if consent_filter:
-            query += ' AND COALESCE(uc.consent_status, "Unknown") = ?'
-            params.append(consent_filter)
-        
-        query += ' ORDER BY u.username'
-        
-        cursor.execute(query, params)
-        users = cursor.fetchall()
-        
-        # Format user data
-        users_data = []
-        for user in users:
-            user_dict = dict(user)
-            
-            # Create display name
-            if user_dict['first_name'] and user_dict['last_name']:
-                user_dict['display_name'] = f"{user_dict['first_name']} {user_dict['last_name']}"
-            else:
-                user_dict['display_name'] = user_dict['username']
-            
-            # Format role display
-            role_display = {
-                'employee': 'Mitarbeiter',
-                'supervisor': 'Vorgesetzter', 
-                'hr': 'Personalwesen',
-                'admin': 'Administrator'
-            }
-            user_dict['role_display'] = role_display.get(user_dict['user_role'], user_dict['user_role'])
-            
-            users_data.append(user_dict)
+        users_data = [user_display(user) for user in users]
         
         return jsonify({
             'success': True, 
             'users': users_data,
-            'count': len(users_data)
+            'count': len(users_data),
+            'total': total_count,
+            'next_cursor': next_cursor
         })
         
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Ungültiger Cursor'}), 400
     except Exception as e:
         logging.error(f"Error searching users: {str(e)}")
         return jsonify({'success': False, 'message': f'Fehler: {str(e)}'}), 500
@@ -4468,7 +3867,6 @@ def user_options(user_id):
     
     try:
         db = get_db()
-        db.row_factory = sqlite3.Row
         cursor = db.cursor()
         
         # Get comprehensive user data
@@ -4489,11 +3887,7 @@ def user_options(user_id):
                 COALESCE(uc.consent_status, 'pending') AS consent_status,
                 COALESCE(uc.consent_date, '') AS consent_date
             FROM users u
-            LEFT JOIN (
-                SELECT user_id, consent_status, consent_date
-                FROM user_consents 
-                WHERE id IN (SELECT MAX(id) FROM user_consents GROUP BY user_id)
-            ) uc ON u.id = uc.user_id
+            LEFT JOIN current_consents uc ON u.id = uc.user_id
             WHERE u.id = ?
         ''', (user_id,))
         
@@ -4581,6 +3975,7 @@ def update_user_status(user_id):
         cursor.execute('''
             UPDATE users SET account_status = ?, updated_at = ? WHERE id = ?
         ''', (new_status, current_time, user_id))
+        bump_directory_version(cursor)
         
         db.commit()
         
@@ -4653,7 +4048,7 @@ def generate_temp_password(user_id):
 
 @app.route('/export_user_data/<int:user_id>')
 def export_user_data(user_id):
-    """Export all data for a specific user as CSV (admin only)"""
+    """Export all data for a specific user as CSV, or JSON with ?format=json (admin only)"""
     if not session.get('username'):
         return redirect(url_for('login'))
     
@@ -4663,81 +4058,31 @@ def export_user_data(user_id):
         return redirect(url_for('index'))
     
     try:
-        import csv
-        from io import StringIO
-        
         db = get_db()
-        db.row_factory = sqlite3.Row
         cursor = db.cursor()
         
-        # Get user data
-        cursor.execute('''
-            SELECT 
-                u.id, u.username, u.first_name, u.last_name, u.employee_id,
-                u.user_role, u.department, u.account_status, u.is_admin,
-                u.created_at, u.updated_at, u.last_login,
-                COALESCE(uc.consent_status, 'Unknown') AS consent_status,
-                COALESCE(uc.consent_date, '') AS consent_date
-            FROM users u
-            LEFT JOIN (
-                SELECT user_id, consent_status, consent_date
-                FROM user_consents 
-                WHERE id IN (SELECT MAX(id) FROM user_consents GROUP BY user_id)
-            ) uc ON u.id = uc.user_id
-            WHERE u.id = ?
-        ''', (user_id,))
-        
-        user = cursor.fetchone()
+        user = select_user_for_export(cursor, user_id)
         if not user:
             flash('Benutzer nicht gefunden', 'error')
             return redirect(url_for('user_management'))
         
-        # Get attendance data for the user
-        cursor.execute('''
-            SELECT date, check_in, check_out, total_hours, break_duration
-            FROM attendance 
-            WHERE user_id = ? 
-            ORDER BY date DESC
-        ''', (user_id,))
+        # Attendance with breaks, read in batches from one ordered join
+        select_user_attendance_for_export(cursor, user_id)
+        batches = iter_batches(cursor)
         
-        attendance_records = cursor.fetchall()
-        
-        # Create CSV output
-        output = StringIO()
-        
-        # Write user information
-        output.write("=== BENUTZERDATEN ===\n")
-        output.write(f"ID,{user['id']}\n")
-        output.write(f"Benutzername,{user['username']}\n")
-        output.write(f"Vorname,{user['first_name'] or ''}\n")
-        output.write(f"Nachname,{user['last_name'] or ''}\n")
-        output.write(f"Mitarbeiter-ID,{user['employee_id'] or ''}\n")
-        output.write(f"Rolle,{user['user_role']}\n")
-        output.write(f"Abteilung,{user['department'] or ''}\n")
-        output.write(f"Kontostatus,{user['account_status']}\n")
-        output.write(f"Administrator,{'Ja' if user['is_admin'] else 'Nein'}\n")
-        output.write(f"Erstellt am,{user['created_at']}\n")
-        output.write(f"Letzter Login,{user['last_login'] or 'Nie'}\n")
-        output.write(f"Datenschutz-Einwilligung,{user['consent_status']}\n")
-        output.write(f"Einwilligung am,{user['consent_date']}\n")
-        output.write("\n")
-        
-        # Write attendance data
-        output.write("=== ANWESENHEITSDATEN ===\n")
-        output.write("Datum,Ankunft,Abgang,Gesamtstunden,Pausenzeit\n")
-        
-        for record in attendance_records:
-            output.write(f"{record['date']},{record['check_in'] or ''},{record['check_out'] or ''},{record['total_hours'] or ''},{record['break_duration'] or ''}\n")
-        
-        # Create response
-        output.seek(0)
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'text/csv; charset=utf-8'
-        response.headers['Content-Disposition'] = f'attachment; filename=benutzer_{user["username"]}_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        if request.args.get('format') == 'json':
+            body, mimetype, extension = user_export_json(user, batches), 'application/json', 'json'
+        else:
+            body, mimetype, extension = user_export_csv(user, batches), 'text/csv', 'csv'
         
         logging.info(f"User data exported for user {user_id} by admin {session.get('username')}")
         
-        return response
+        return Response(
+            stream_with_context(body),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename=benutzer_{user["username"]}_export_{timestamp}.{extension}'}
+        )
         
     except Exception as e:
         logging.error(f"Error exporting user data: {str(e)}")
@@ -0,0 +1,143 @@
+# Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
+# Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
+
+"""
+Shared SQLite connection layer.
+
+Connections are opened once, tuned with the pragmas below and then kept alive
+in a small pool so that requests reuse a warm page cache instead of paying for
+connection setup every time.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Applied once per connection when it is opened
+DEFAULT_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -20000),      # ~20 MB page cache per connection
+    ('mmap_size', 268435456),    # 256 MB memory mapped I/O
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),      # wait up to 5 s for a competing writer
+)
+
+
+class ConnectionPool:
+    """Pool of pre-tuned SQLite connections shared by all request threads.
+
+    A connection is checked out by one thread at a time and returned at the end
+    of the request. Idle connections are reused LIFO so the most recently used
+    (and therefore warmest) connection is handed out first.
+    """
+
+    def __init__(self, database, max_idle=8, pragmas=DEFAULT_PRAGMAS):
+        self.database = database
+        self.max_idle = max_idle
+        self.pragmas = tuple(pragmas)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._stats = {
+            'connections_created': 0,
+            'connections_reused': 0,
+            'connections_closed': 0,
+            'rollbacks_on_release': 0,
+            'in_use': 0,
+            'peak_in_use': 0,
+            'connect_time_ms': 0.0,
+        }
+
+    def _connect(self):
+        started = time.perf_counter()
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._stats['connections_created'] += 1
+            self._stats['connect_time_ms'] += elapsed_ms
+        logging.debug(f"Opened pooled database connection in {elapsed_ms:.2f} ms")
+        return conn
+
+    def acquire(self):
+        """Check out a connection, opening a new one if the pool is empty."""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            self._stats['in_use'] += 1
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._stats['in_use'])
+            if conn is not None:
+                self._stats['connections_reused'] += 1
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._stats['in_use'] -= 1
+                raise
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool.
+
+        Any transaction left open by the caller is rolled back so that the next
+        user never inherits a pending write lock.
+        """
+        rolled_back = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+                rolled_back = True
+        except sqlite3.Error as e:
+            logging.warning(f"Discarding pooled connection after failed rollback: {e}")
+            self._discard(conn)
+            return
+
+        with self._lock:
+            self._stats['in_use'] -= 1
+            if rolled_back:
+                self._stats['rollbacks_on_release'] += 1
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self._stats['connections_closed'] += 1
+        conn.close()
+
+    def _discard(self, conn):
+        with self._lock:
+            self._stats['in_use'] -= 1
+            self._stats['connections_closed'] += 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Context manager for code running outside of a request."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Close all idle connections (e.g. before replacing the database file)."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._stats['connections_closed'] += len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        """Return a snapshot of the pool statistics."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        stats['max_idle'] = self.max_idle
+        stats['connect_time_ms'] = round(stats['connect_time_ms'], 2)
+        stats['pragmas'] = {name: value for name, value in self.pragmas}
+        return stats
@@ -0,0 +1,394 @@
+# Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
+# Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
+
+"""
+Versioned schema migrations.
+
+Each migration is applied exactly once, in order, and the database records the
+last applied version in PRAGMA user_version. Request handlers never inspect the
+schema themselves; they read the cached column map from get_capabilities().
+
+Migrations carry their own SQL instead of calling the services, so a later
+change to a service never changes what an applied migration did.
+"""
+
+import logging
+import threading
+from datetime import datetime
+
+import pytz
+
+
+TIMEZONE = 'Europe/Berlin'
+
+# (version, description, function) tuples, filled by the @migration decorator
+MIGRATIONS = []
+
+_capabilities = None
+_capabilities_lock = threading.Lock()
+
+
+def migration(version, description):
+    """Register a function as schema migration number `version`."""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return func
+    return decorator
+
+
+def _table_columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {column[1] for column in cursor.fetchall()}
+
+
+def _add_missing_columns(cursor, table, columns):
+    existing = _table_columns(cursor, table)
+    for column_name, column_def in columns:
+        if column_name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column_name} {column_def}')
+            logging.info(f"Migration added column {table}.{column_name}")
+
+
+@migration(1, 'Enhanced user profile fields, break settings and deletion metadata')
+def _migration_001_baseline(cursor):
+    users_had_is_admin = 'is_admin' in _table_columns(cursor, 'users')
+
+    # SQLite cannot add a column with a non-constant default such as
+    # CURRENT_TIMESTAMP, so the timestamp columns are backfilled below instead.
+    _add_missing_columns(cursor, 'users', [
+        ('is_admin', 'BOOLEAN DEFAULT 0'),
+        ('first_name', 'TEXT'),
+        ('last_name', 'TEXT'),
+        ('employee_id', 'TEXT'),
+        ('user_role', "TEXT DEFAULT 'employee'"),
+        ('department', 'TEXT'),
+        ('account_status', "TEXT DEFAULT 'active'"),
+        ('last_login', 'TIMESTAMP'),
+        ('created_at', 'TIMESTAMP'),
+        ('updated_at', 'TIMESTAMP'),
+    ])
+    if not users_had_is_admin:
+        cursor.execute("UPDATE users SET is_admin = 1 WHERE username = 'admin'")
+
+    _add_missing_columns(cursor, 'user_settings', [
+        ('arbzg_breaks_enabled', 'BOOLEAN DEFAULT 1'),
+        ('lunch_period_start_hour', 'INTEGER DEFAULT 11'),
+        ('lunch_period_start_minute', 'INTEGER DEFAULT 30'),
+        ('lunch_period_end_hour', 'INTEGER DEFAULT 14'),
+        ('lunch_period_end_minute', 'INTEGER DEFAULT 0'),
+    ])
+    _add_missing_columns(cursor, 'breaks', [('description', 'TEXT')])
+    _add_missing_columns(cursor, 'deletion_requests', [('original_username', 'TEXT')])
+
+    # Backfill defaults for users created before the enhanced fields existed
+    current_time = datetime.now(pytz.timezone(TIMEZONE)).strftime('%Y-%m-%d %H:%M:%S')
+    cursor.execute("UPDATE users SET user_role = 'employee' WHERE user_role IS NULL OR user_role = ''")
+    cursor.execute("UPDATE users SET user_role = 'admin' WHERE is_admin = 1")
+    cursor.execute("UPDATE users SET account_status = 'active' WHERE account_status IS NULL OR account_status = ''")
+    cursor.execute("UPDATE users SET created_at = ? WHERE created_at IS NULL OR created_at = ''", (current_time,))
+    cursor.execute("UPDATE users SET updated_at = ? WHERE updated_at IS NULL OR updated_at = ''", (current_time,))
+
+    # Every user needs a settings row and an initial consent record
+    cursor.execute('''
+        INSERT INTO user_settings (user_id, auto_break_detection_enabled, auto_break_threshold_minutes, exclude_breaks_from_billing, arbzg_breaks_enabled)
+        SELECT u.id, 1, 30, 1, 1
+        FROM users u
+        WHERE u.id NOT IN (SELECT user_id FROM user_settings WHERE user_id IS NOT NULL)
+    ''')
+    cursor.execute('''
+        INSERT INTO user_consents (user_id, consent_status, consent_date)
+        SELECT u.id, 'pending', ?
+        FROM users u
+        WHERE u.id NOT IN (SELECT user_id FROM user_consents WHERE user_id IS NOT NULL)
+    ''', (current_time,))
+
+
+def _local_epoch(value):
+    """Return (epoch seconds, local work_date) of a stored timestamp, (None, None) if empty.
+
+    Frozen copy of the parsing the app used when migration 2 was written:
+    ISO 8601 text, naive values being Europe/Berlin local time.
+    """
+    if not value:
+        return None, None
+    try:
+        dt = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return None, None
+    tz = pytz.timezone(TIMEZONE)
+    dt = tz.localize(dt) if dt.tzinfo is None else dt.astimezone(tz)
+    return int(dt.timestamp()), dt.strftime('%Y-%m-%d')
+
+
+# Migration 3 (epoch columns) was folded into migration 2 before release; the
+# number stays unused so existing databases keep their recorded version.
+@migration(2, 'Epoch timestamp and work_date columns and secondary indexes')
+def _migration_002_timestamps_and_indexes(cursor):
+    _add_missing_columns(cursor, 'attendance', [
+        ('check_in_ts', 'INTEGER'),
+        ('check_out_ts', 'INTEGER'),
+        ('work_date', 'TEXT'),
+    ])
+    _add_missing_columns(cursor, 'breaks', [
+        ('start_ts', 'INTEGER'),
+        ('end_ts', 'INTEGER'),
+    ])
+
+    # One-time backfill; from now on every write path stores these columns
+    updates = []
+    for row_id, check_in, check_out in cursor.execute('SELECT id, check_in, check_out FROM attendance').fetchall():
+        check_in_ts, work_date = _local_epoch(check_in)
+        updates.append((check_in_ts, _local_epoch(check_out)[0], work_date, row_id))
+    cursor.executemany('UPDATE attendance SET check_in_ts = ?, check_out_ts = ?, work_date = ? WHERE id = ?', updates)
+    logging.info(f"Migration normalized timestamps of {len(updates)} attendance records")
+
+    updates = [
+        (_local_epoch(start_time)[0], _local_epoch(end_time)[0], row_id)
+        for row_id, start_time, end_time in cursor.execute('SELECT id, start_time, end_time FROM breaks').fetchall()
+    ]
+    cursor.executemany('UPDATE breaks SET start_ts = ?, end_ts = ? WHERE id = ?', updates)
+    logging.info(f"Migration normalized timestamps of {len(updates)} breaks")
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_user_check_in_ts ON attendance(user_id, check_in_ts)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_user_work_date ON attendance(user_id, work_date)')
+    # Partial index: only open sessions, so status and checkout lookups stay tiny
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_open_sessions
+        ON attendance(user_id, work_date) WHERE check_out IS NULL
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_breaks_attendance_start_ts ON breaks(attendance_id, start_ts)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_consents_user_id ON user_consents(user_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_settings_user_id ON user_settings(user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_employee_id ON users(employee_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_deletion_requests_user_status ON deletion_requests(user_id, status)')
+
+
+@migration(4, 'Materialized current consent status per user')
+def _migration_004_current_consents(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS current_consents (
+            user_id INTEGER PRIMARY KEY,
+            consent_status TEXT,
+            consent_date TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_current_consents_status ON current_consents(consent_status)')
+    # Latest history row per user
+    cursor.execute('DELETE FROM current_consents')
+    cursor.execute('''
+        INSERT INTO current_consents (user_id, consent_status, consent_date)
+        SELECT user_id, consent_status, consent_date
+        FROM user_consents
+        WHERE id IN (SELECT MAX(id) FROM user_consents WHERE user_id IS NOT NULL GROUP BY user_id)
+    ''')
+    logging.info(f"Migration materialized current consent status for {cursor.rowcount} users")
+
+
+@migration(5, 'Per-user daily_summaries rollup')
+def _migration_005_daily_summaries(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_summaries (
+            user_id INTEGER NOT NULL,
+            work_date TEXT NOT NULL,
+            worked_minutes INTEGER NOT NULL DEFAULT 0,
+            billable_minutes INTEGER NOT NULL DEFAULT 0,
+            break_minutes INTEGER NOT NULL DEFAULT 0,
+            session_count INTEGER NOT NULL DEFAULT 0,
+            first_check_in_ts INTEGER,
+            last_check_out_ts INTEGER,
+            PRIMARY KEY (user_id, work_date),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT INTO daily_summaries (user_id, work_date, worked_minutes, billable_minutes,
+                                     break_minutes, session_count, first_check_in_ts, last_check_out_ts)
+        SELECT a.user_id, a.work_date,
+               COALESCE(SUM(CASE WHEN a.check_out_ts IS NOT NULL
+                                 THEN (a.check_out_ts - a.check_in_ts) / 60 END), 0),
+               COALESCE(SUM(a.billable_minutes), 0),
+               COALESCE(SUM((SELECT SUM(b.duration_minutes) FROM breaks b WHERE b.attendance_id = a.id)), 0),
+               COUNT(*),
+               MIN(a.check_in_ts),
+               MAX(a.check_out_ts)
+        FROM attendance a
+        WHERE a.work_date IS NOT NULL
+        GROUP BY a.user_id, a.work_date
+    ''')
+    logging.info(f"Migration built {cursor.rowcount} daily summaries")
+
+
+@migration(6, 'Per-user change versions for conditional GETs')
+def _migration_006_user_versions(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+@migration(7, 'Index on attendance work_date for cross-user date ranges')
+def _migration_007_attendance_work_date(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_work_date ON attendance(work_date)')
+
+
+@migration(8, 'Index on attendance check_in_ts for all-user reports')
+def _migration_008_attendance_check_in_ts(cursor):
+    # Also lets the admin dashboard read its newest 100 rows from the index
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_check_in_ts ON attendance(check_in_ts)')
+
+
+@migration(9, 'Per-user, per-month report versions for the report cache')
+def _migration_009_report_versions(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS report_versions (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month)
+        ) WITHOUT ROWID
+    ''')
+    # All-users reports sum a month range over every user
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_report_versions_month ON report_versions(month, version)')
+    # Months with existing attendance start at 1, so deleting them is a change
+    cursor.execute('''
+        INSERT OR IGNORE INTO report_versions (user_id, month, version)
+        SELECT DISTINCT user_id, substr(work_date, 1, 7), 1
+        FROM attendance WHERE work_date IS NOT NULL
+    ''')
+
+
+
+@migration(10, 'Background export jobs')
+def _migration_010_export_jobs(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS export_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL DEFAULT 'queued',
+            requested_by TEXT,
+            created_ts INTEGER NOT NULL,
+            started_ts INTEGER,
+            finished_ts INTEGER,
+            heartbeat_ts INTEGER,
+            expires_ts INTEGER,
+            progress_done INTEGER NOT NULL DEFAULT 0,
+            progress_total INTEGER,
+            file_name TEXT,
+            file_size INTEGER,
+            error TEXT
+        )
+    ''')
+    # Workers claim the oldest queued job; the sweep looks up finished/running ones
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_export_jobs_status ON export_jobs(status, id)')
+
+
+@migration(11, 'Full-text user search index')
+def _migration_011_user_search(cursor):
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            username, first_name, last_name, employee_id, department,
+            content='users', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts (rowid, username, first_name, last_name, employee_id, department)
+            VALUES (new.id, new.username, new.first_name, new.last_name, new.employee_id, new.department);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username, first_name, last_name, employee_id, department)
+            VALUES ('delete', old.id, old.username, old.first_name, old.last_name, old.employee_id, old.department);
+        END
+    ''')
+    # Only the indexed columns; last_login and password changes leave the index alone
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS users_fts_update
+        AFTER UPDATE OF username, first_name, last_name, employee_id, department ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username, first_name, last_name, employee_id, department)
+            VALUES ('delete', old.id, old.username, old.first_name, old.last_name, old.employee_id, old.department);
+            INSERT INTO users_fts (rowid, username, first_name, last_name, employee_id, department)
+            VALUES (new.id, new.username, new.first_name, new.last_name, new.employee_id, new.department);
+        END
+    ''')
+    cursor.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+
+@migration(12, 'Indexes on users role and status for the user list counts')
+def _migration_012_user_filters(cursor):
+    # The user list counts every user that matches its filter
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_user_role ON users(user_role)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_account_status ON users(account_status)')
+
+
+def latest_version():
+    """Return the schema version the code expects."""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def run_migrations(conn):
+    """Apply all pending migrations and return the list of applied versions.
+
+    Each migration runs in its own write transaction. The current version is
+    re-read after taking the write lock, so concurrently booting workers never
+    apply the same migration twice.
+    """
+    global _capabilities
+    applied = []
+
+    for version, description, func in MIGRATIONS:
+        if get_schema_version(conn) >= version:
+            continue
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            logging.info(f"Applying schema migration {version}: {description}")
+            func(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+            applied.append(version)
+        except Exception:
+            conn.rollback()
+            logging.exception(f"Schema migration {version} failed")
+            raise
+
+    if applied:
+        with _capabilities_lock:
+            _capabilities = None
+    return applied
+
+
+def load_capabilities(conn):
+    """Read the column map for every table and view from the database."""
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'"
+    ).fetchall()]
+    return {table: frozenset(_table_columns(conn.cursor(), table)) for table in tables}
+
+
+def get_capabilities(conn):
+    """Return the cached column map, loading it on first use."""
+    global _capabilities
+    if _capabilities is None:
+        with _capabilities_lock:
+            if _capabilities is None:
+                _capabilities = load_capabilities(conn)
+    return _capabilities
+
+
+def has_column(conn, table, column):
+    return column in get_capabilities(conn).get(table, ())
@@ -0,0 +1,103 @@
+# Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
+# Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
+
+"""
+Query plan check for the queries on the request hot path.
+
+HOT_QUERIES holds the SQL the services and routes actually execute (their
+module constants and *_query builders), with sample parameters.
+check_query_plans() reports every one of them that needs a full table scan,
+so a dropped or unusable index is caught before it shows up as latency.
+"""
+
+from app.services.attendance_service import (
+    OPEN_SESSION_SQL, CLOSE_SESSION_SQL, STATUS_SQL, RECORD_COUNT_SQL, RECORD_MONTHS_SQL,
+    HISTORY_PAGE_ORDER, DAY_ATTENDANCE_JSON, history_query, breaks_batch_query,
+)
+from app.services.break_service import SETTINGS_SQL, POLICY_SQL, SESSION_BREAKS_SQL
+from app.services.consent_service import CURRENT_CONSENT_SQL, CONSENT_COUNT_SQL, CONSENT_HISTORY_SQL
+from app.services.report_service import REPORT_PAGE_SIZE, report_rows_query
+from app.services.user_service import EMPLOYEE_ID_SQL, user_matches, user_page_query
+from app.services.version_service import report_version_query
+
+# January 2025 in Europe/Berlin, as half-open epoch bounds
+_MONTH = (1735686000, 1738364400)
+
+
+def _page(query, limit, offset):
+    sql, params = query
+    return sql + HISTORY_PAGE_ORDER, [*params, limit, offset]
+
+
+HOT_QUERIES = {
+    'attendance_open_session': (OPEN_SESSION_SQL, (1, '2025-01-01')),
+    'attendance_close_session': (CLOSE_SESSION_SQL, ('2025-01-01T17:00:00', 1735747200, 1, '2025-01-01')),
+    'attendance_status': (STATUS_SQL, (1, '2025-01-01')),
+    'attendance_today': (DAY_ATTENDANCE_JSON, (1, '2025-01-01')),
+    'attendance_history_page': _page(history_query(1), 15, 0),
+    'attendance_month_page': _page(history_query(1, _MONTH), 15, 0),
+    'attendance_count_for_user': (RECORD_COUNT_SQL, (1,)),
+    'attendance_months_for_user': (RECORD_MONTHS_SQL, (1,)),
+    'user_report': report_rows_query(1, _MONTH),
+    'all_users_report': report_rows_query(None, _MONTH),
+    'all_users_report_page': report_rows_query(None, None, (_MONTH[1], 1000), REPORT_PAGE_SIZE),
+    'report_version_all_users': report_version_query(None, '2025-01', '2025-03'),
+    'breaks_batch_for_range': breaks_batch_query(first_day='2025-01-01', last_day='2025-01-31', limit=500),
+    'breaks_for_session': (SESSION_BREAKS_SQL, (1,)),
+    'consent_history_for_user': (CONSENT_HISTORY_SQL, (1,)),
+    'current_consent_for_user': (CURRENT_CONSENT_SQL, (1,)),
+    'pending_consent_count': (CONSENT_COUNT_SQL, ('pending',)),
+    'user_settings_for_user': (SETTINGS_SQL, (1,)),
+    'break_policy_for_user': (POLICY_SQL, (1,)),
+    'user_by_employee_id': (EMPLOYEE_ID_SQL, ('E-1',)),
+    'user_search': user_matches('mül'),
+    # The unfiltered user list counts every user, which reads them all
+    'user_list_page_by_role': user_page_query(role='admin', after='5:j.mueller', limit=101),
+    'user_list_page_by_status': user_page_query(status='active', after='5:j.mueller', limit=101),
+    'user_search_page': user_page_query('mül', sort='relevance', limit=101),
+}
+
+
+def explain_query_plan(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a query."""
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+
+
+def _is_table_scan(detail, subqueries=()):
+    # FTS5 reports a MATCH as 'SCAN users_fts VIRTUAL TABLE INDEX 0:M1'; only
+    # an empty index string after the colon is a full scan of the virtual table
+    if not detail.startswith('SCAN '):
+        return False
+    if ' VIRTUAL TABLE INDEX ' in detail:
+        return detail.rsplit(':', 1)[-1] == ''
+    # Reading back the rows of a subquery (co-routine or materialized) is
+    # not a scan of a table
+    return detail[len('SCAN '):].split(' ')[0] not in subqueries
+
+
+def _subqueries(plan):
+    """Return the names the plan uses for the results of its subqueries."""
+    names = set()
+    for detail in plan:
+        for prefix in ('CO-ROUTINE ', 'MATERIALIZE '):
+            if detail.startswith(prefix):
+                names.add(detail[len(prefix):])
+    return names
+
+
+def check_query_plans(conn, queries=None):
+    """Return {name: plan} for every hot query that falls back to a table scan.
+
+    An empty result means every query is served by an index.
+    """
+    # EXPLAIN does not verify the schema cookie, so a long-lived connection
+    # would report plans from before the latest migration. A real read does.
+    conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+
+    failures = {}
+    for name, (sql, params) in (queries or HOT_QUERIES).items():
+        plan = explain_query_plan(conn, sql, params)
+        subqueries = _subqueries(plan)
+        if any(_is_table_scan(detail, subqueries) for detail in plan):
+            failures[name] = plan
+    return failures
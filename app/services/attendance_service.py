@@ -1,2 +1,409 @@
 # Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
 # Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
+
+"""
+Timestamp normalization for attendance and break records.
+
+The text columns (check_in, check_out, start_time, end_time) keep whatever
+format the writer used. Every write also stores the same instant as epoch
+seconds (check_in_ts, start_ts, ...) and the local Europe/Berlin day as
+work_date, so queries can filter with plain range predicates on an index.
+"""
+
+from datetime import date, datetime, timedelta
+
+import pytz
+
+from app.services.version_service import bump_report_months, bump_all_report_months
+
+TIMEZONE = 'Europe/Berlin'
+LOCAL_TZ = pytz.timezone(TIMEZONE)
+
+
+def parse_timestamp(value):
+    """Parse a stored timestamp into an aware Europe/Berlin datetime.
+
+    Accepts datetimes and the ISO 8601 variants written by the app
+    ('YYYY-MM-DD HH:MM:SS', with 'T' separator, fractions or UTC offset).
+    Naive values are local time. Returns None for empty or unparseable input.
+    """
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        try:
+            dt = datetime.fromisoformat(str(value).strip())
+        except ValueError:
+            return None
+    if dt.tzinfo is None:
+        return LOCAL_TZ.localize(dt)
+    return dt.astimezone(LOCAL_TZ)
+
+
+def to_epoch(value):
+    """Return a timestamp as integer epoch seconds, or None."""
+    dt = parse_timestamp(value)
+    return int(dt.timestamp()) if dt else None
+
+
+def from_epoch(epoch):
+    """Return epoch seconds as an aware Europe/Berlin datetime."""
+    return datetime.fromtimestamp(epoch, LOCAL_TZ)
+
+
+def work_date_for(value):
+    """Return the local calendar day ('YYYY-MM-DD') of a timestamp, or None."""
+    dt = parse_timestamp(value)
+    return dt.strftime('%Y-%m-%d') if dt else None
+
+
+def normalize_timestamp(value):
+    """Return (epoch_seconds, work_date) for a timestamp, (None, None) if empty."""
+    dt = parse_timestamp(value)
+    if dt is None:
+        return None, None
+    return int(dt.timestamp()), dt.strftime('%Y-%m-%d')
+
+
+def today_local():
+    """Return today's local work_date."""
+    return datetime.now(LOCAL_TZ).strftime('%Y-%m-%d')
+
+
+def _local_midnight_epoch(day):
+    return int(LOCAL_TZ.localize(datetime(day.year, day.month, day.day)).timestamp())
+
+
+def _as_date(day):
+    if isinstance(day, str):
+        return date.fromisoformat(day.strip()[:10])
+    if isinstance(day, datetime):
+        return day.date()
+    return day
+
+
+def date_range_bounds(first_day, last_day):
+    """Return half-open epoch bounds [start, end) covering first_day..last_day.
+
+    Days are dates or 'YYYY-MM-DD'. Local midnights are resolved in
+    Europe/Berlin, so DST days span 23 or 25 hours.
+    """
+    first_day, last_day = _as_date(first_day), _as_date(last_day)
+    if last_day < first_day:
+        raise ValueError(f'Ungültiger Zeitraum: {first_day} nach {last_day}')
+    return _local_midnight_epoch(first_day), _local_midnight_epoch(last_day + timedelta(days=1))
+
+
+def day_bounds(day):
+    """Return epoch bounds for one local day given as date or 'YYYY-MM-DD'."""
+    day = _as_date(day)
+    return date_range_bounds(day, day)
+
+
+def month_bounds(year, month):
+    """Return epoch bounds for a calendar month."""
+    year, month = int(year), int(month)
+    first_day = date(year, month, 1)
+    next_month = date(year + month // 12, month % 12 + 1, 1)
+    return date_range_bounds(first_day, next_month - timedelta(days=1))
+
+
+def iso_week_bounds(year, week):
+    """Return epoch bounds for an ISO 8601 week (Monday to Sunday).
+
+    Week 1 is the week containing the year's first Thursday, so the days
+    around New Year can belong to the previous or next ISO year.
+    """
+    monday = date.fromisocalendar(int(year), int(week), 1)
+    return date_range_bounds(monday, monday + timedelta(days=6))
+
+
+def period_bounds(day='', week='', month='', first_day='', last_day=''):
+    """Return epoch bounds for a report period, or None for the entire period.
+
+    Takes the values the report forms send: a day 'YYYY-MM-DD', an ISO week
+    'YYYY-Www', a month 'YYYY-MM' or a first_day/last_day range; the first
+    one given wins. Raises ValueError for malformed values.
+    """
+    if day:
+        return day_bounds(day)
+    if week:
+        year, _, week_num = week.strip().upper().partition('-W')
+        return iso_week_bounds(year, week_num)
+    if month:
+        year, _, month_num = month.strip().partition('-')
+        return month_bounds(year, month_num)
+    if first_day or last_day:
+        return date_range_bounds(first_day or last_day, last_day or first_day)
+    return None
+
+
+# Aggregates one (user, day) from attendance and breaks. Open sessions count
+# towards session_count and first punch only; durations need a check-out.
+_SUMMARY_SELECT = '''
+    SELECT a.user_id, a.work_date,
+           COALESCE(SUM(CASE WHEN a.check_out_ts IS NOT NULL
+                             THEN (a.check_out_ts - a.check_in_ts) / 60 END), 0),
+           COALESCE(SUM(a.billable_minutes), 0),
+           COALESCE(SUM((SELECT SUM(b.duration_minutes) FROM breaks b WHERE b.attendance_id = a.id)), 0),
+           COUNT(*),
+           MIN(a.check_in_ts),
+           MAX(a.check_out_ts)
+    FROM attendance a
+'''
+
+_SUMMARY_INSERT = '''
+    INSERT INTO daily_summaries (user_id, work_date, worked_minutes, billable_minutes,
+                                 break_minutes, session_count, first_check_in_ts, last_check_out_ts)
+'''
+
+
+def refresh_daily_summary(cursor, user_id, work_date):
+    """Recompute the daily_summaries row of one user and day.
+
+    Call inside the transaction that changed the day's attendance or breaks.
+    The row is removed when no attendance is left for that day, and the
+    month's report version is bumped.
+    """
+    if not work_date:
+        return
+    cursor.execute('DELETE FROM daily_summaries WHERE user_id = ? AND work_date = ?', (user_id, work_date))
+    cursor.execute(
+        _SUMMARY_INSERT + _SUMMARY_SELECT + ' WHERE a.user_id = ? AND a.work_date = ? GROUP BY a.user_id, a.work_date',
+        (user_id, work_date)
+    )
+    bump_report_months(cursor, [(user_id, work_date)])
+
+
+def refresh_daily_summaries(cursor, user_id, work_dates):
+    """Recompute several days of one user (e.g. old and new day of an edit)."""
+    refresh_daily_summary_keys(cursor, {(user_id, work_date) for work_date in work_dates})
+
+
+def refresh_daily_summary_keys(cursor, keys):
+    """Recompute many (user_id, work_date) rows with two batched statements."""
+    keys = [key for key in keys if key[1]]
+    cursor.executemany('DELETE FROM daily_summaries WHERE user_id = ? AND work_date = ?', keys)
+    cursor.executemany(
+        _SUMMARY_INSERT + _SUMMARY_SELECT + ' WHERE a.user_id = ? AND a.work_date = ? GROUP BY a.user_id, a.work_date',
+        keys
+    )
+    bump_report_months(cursor, keys)
+
+
+def forget_daily_summaries(cursor, user_id):
+    """Drop every summary of a user whose attendance was deleted."""
+    cursor.execute('DELETE FROM daily_summaries WHERE user_id = ?', (user_id,))
+    bump_all_report_months(cursor, user_id)
+
+
+def rebuild_daily_summaries(cursor):
+    """Rebuild the whole rollup from attendance; returns the number of rows."""
+    cursor.execute('DELETE FROM daily_summaries')
+    cursor.execute(
+        _SUMMARY_INSERT + _SUMMARY_SELECT + ' WHERE a.work_date IS NOT NULL GROUP BY a.user_id, a.work_date'
+    )
+    return cursor.rowcount
+
+
+# Hot-path queries. They are module constants (or built by *_query functions)
+# so that app.query_plans explains exactly the SQL the routes execute.
+
+# Today's open session of a user (check-in refuses a second one)
+OPEN_SESSION_SQL = '''
+    SELECT * FROM attendance
+    WHERE user_id = ? AND work_date = ? AND check_out IS NULL
+'''
+
+# Checkout: close the latest open session of the day and report what was closed
+CLOSE_SESSION_SQL = '''
+    UPDATE attendance
+    SET check_out = ?, check_out_ts = ?
+    WHERE id = (
+        SELECT id FROM attendance
+        WHERE user_id = ? AND work_date = ? AND check_out IS NULL
+        ORDER BY check_in_ts DESC LIMIT 1
+    )
+    RETURNING id, check_in_ts, work_date
+'''
+
+# An open session wins over completed ones, then the latest completed one
+STATUS_SQL = '''
+    SELECT check_in, check_out FROM attendance
+    WHERE user_id = ? AND work_date = ?
+    ORDER BY check_out IS NULL DESC, id DESC LIMIT 1
+'''
+
+RECORD_COUNT_SQL = 'SELECT COUNT(*) AS count FROM attendance WHERE user_id = ?'
+
+RECORD_MONTHS_SQL = '''
+    SELECT DISTINCT substr(work_date, 1, 7) AS month
+    FROM attendance
+    WHERE user_id = ?
+    ORDER BY month DESC
+'''
+
+HISTORY_PAGE_ORDER = ' ORDER BY check_in_ts DESC LIMIT ? OFFSET ?'
+
+
+def history_query(user_id, bounds=None):
+    """Return (sql, params) selecting a user's records, within epoch bounds if given.
+
+    Append HISTORY_PAGE_ORDER and (limit, offset) for one page of the history.
+    """
+    sql = 'SELECT * FROM attendance WHERE user_id = ?'
+    params = [user_id]
+    if bounds is not None:
+        sql += ' AND check_in_ts >= ? AND check_in_ts < ?'
+        params.extend(bounds)
+    return sql, params
+
+
+# Nested JSON views. SQLite's JSON1 functions build the complete response
+# body in one statement, so records with their breaks need neither one query
+# per record nor a dict per sqlite3.Row in Python.
+
+def _json_bool(column):
+    return f"json(CASE WHEN {column} THEN 'true' ELSE 'false' END)"
+
+
+# All break columns, as stored (used by /get_today_attendance)
+_BREAK_ROW_JSON = '''json_object(
+    'id', b.id, 'attendance_id', b.attendance_id, 'start_time', b.start_time, 'end_time', b.end_time,
+    'duration_minutes', b.duration_minutes, 'is_excluded_from_billing', b.is_excluded_from_billing,
+    'is_auto_detected', b.is_auto_detected, 'description', b.description,
+    'start_ts', b.start_ts, 'end_ts', b.end_ts
+)'''
+
+# Display form of a break (used by /get_breaks and the admin dashboard)
+_BREAK_DISPLAY_JSON = f'''json_object(
+    'id', b.id, 'start_time', b.start_time, 'end_time', b.end_time, 'duration', b.duration_minutes,
+    'is_excluded', {_json_bool('b.is_excluded_from_billing')}, 'is_auto', {_json_bool('b.is_auto_detected')},
+    'break_type', CASE
+        WHEN NOT b.is_auto_detected THEN 'manual'
+        WHEN instr(b.description, 'ArbZG') = 0 OR b.description IS NULL THEN 'auto'
+        WHEN instr(b.description, 'Mittagspause') > 0 THEN 'lunch'
+        ELSE 'arbzg'
+    END,
+    'description', COALESCE(b.description, '')
+)'''
+
+
+def _breaks_array(break_json):
+    """Correlated subquery: the breaks of attendance row a as JSON array."""
+    return f'''json((
+        SELECT json_group_array(json(item)) FROM (
+            SELECT {break_json} AS item FROM breaks b
+            WHERE b.attendance_id = a.id ORDER BY b.start_ts
+        )
+    ))'''
+
+
+DAY_ATTENDANCE_JSON = f'''
+    SELECT COALESCE(json_group_array(json_object(
+        'id', a.id, 'user_id', a.user_id, 'check_in', a.check_in, 'check_out', a.check_out,
+        'has_auto_breaks', a.has_auto_breaks, 'billable_minutes', a.billable_minutes,
+        'check_in_ts', a.check_in_ts, 'check_out_ts', a.check_out_ts, 'work_date', a.work_date,
+        'breaks', {_breaks_array(_BREAK_ROW_JSON)}
+    )), '[]')
+    FROM (
+        SELECT * FROM attendance
+        WHERE user_id = ? AND work_date = ?
+        ORDER BY check_in_ts ASC
+    ) a
+'''
+
+
+def day_attendance_json(cursor, user_id, work_date):
+    """Return a user's records of one day with nested breaks as JSON text."""
+    cursor.execute(DAY_ATTENDANCE_JSON, (user_id, work_date))
+    return cursor.fetchone()[0]
+
+
+_BREAKS_BY_ATTENDANCE = f'''
+    SELECT a.id, a.user_id, json_object(
+        'breaks', {_breaks_array(_BREAK_DISPLAY_JSON)},
+        'has_auto_breaks', {_json_bool('a.has_auto_breaks')},
+        'total_count', (SELECT COUNT(*) FROM breaks b WHERE b.attendance_id = a.id)
+    ) AS breaks
+    FROM attendance a
+'''
+
+
+def breaks_by_attendance_query(attendance_ids=None, user_id=None, first_day=None, last_day=None, limit=None):
+    """Return (sql, params) selecting the records and their breaks, lowest ids first.
+
+    Every given filter applies: attendance ids, owner, and first/last work
+    date ('YYYY-MM-DD', inclusive); limit caps the number of records.
+    """
+    conditions, params = [], []
+    if attendance_ids is not None:
+        attendance_ids = list(attendance_ids)
+        conditions.append(f"a.id IN ({', '.join('?' * len(attendance_ids))})")
+        params.extend(attendance_ids)
+    if user_id is not None:
+        conditions.append('a.user_id = ?')
+        params.append(user_id)
+    if first_day is not None:
+        conditions.append('a.work_date >= ?')
+        params.append(first_day)
+    if last_day is not None:
+        conditions.append('a.work_date <= ?')
+        params.append(last_day)
+    sql = _BREAKS_BY_ATTENDANCE
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY a.id'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return sql, params
+
+
+def breaks_by_attendance(cursor, attendance_ids=None, user_id=None, first_day=None, last_day=None, limit=None):
+    """Return {attendance_id: (user_id, json_text)} for many records in one query.
+
+    json_text is an object with breaks (display form), has_auto_breaks and
+    total_count. The filters are those of breaks_by_attendance_query.
+    """
+    if attendance_ids is not None:
+        attendance_ids = list(attendance_ids)
+        if not attendance_ids:
+            return {}
+    cursor.execute(*breaks_by_attendance_query(attendance_ids, user_id, first_day, last_day, limit))
+    return {attendance_id: (user_id, breaks) for attendance_id, user_id, breaks in cursor.fetchall()}
+
+
+def breaks_batch_query(attendance_ids=None, user_id=None, first_day=None, last_day=None, limit=None):
+    """Return (sql, params) of breaks_batch_json."""
+    if limit is None:
+        sql, params = breaks_by_attendance_query(attendance_ids, user_id, first_day, last_day)
+        return f'''
+            SELECT json_object(
+                'success', json('true'),
+                'truncated', json('false'),
+                'records', json_group_object(id, json(breaks))
+            )
+            FROM ({sql})
+        ''', params
+    # One record more than the limit tells whether records were left out
+    sql, params = breaks_by_attendance_query(attendance_ids, user_id, first_day, last_day, limit + 1)
+    return f'''
+        SELECT json_object(
+            'success', json('true'),
+            'truncated', {_json_bool('COUNT(*) > ?')},
+            'records', json_group_object(id, json(breaks)) FILTER (WHERE position <= ?)
+        )
+        FROM (SELECT *, row_number() OVER (ORDER BY id) AS position FROM ({sql}))
+    ''', [limit, limit, *params]
+
+
+def breaks_batch_json(cursor, attendance_ids=None, user_id=None, first_day=None, last_day=None, limit=None):
+    """Return the /get_breaks_batch response as JSON text, built in one query.
+
+    The object has success, truncated (limit reached) and records, which maps
+    each attendance id to the breaks_by_attendance object of the record.
+    """
+    cursor.execute(*breaks_batch_query(attendance_ids, user_id, first_day, last_day, limit))
+    return cursor.fetchone()[0]
@@ -1,4 +1,384 @@
 # Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
 # Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
 
+"""
+ArbZG §4 break engine.
 
+plan_break()/plan_breaks() are pure functions that decide which statutory
+break a finished attendance session needs, where it goes and how many
+minutes remain billable. The write paths load the session and policy with
+the cursor helpers below, plan, and store the result with
+record_break_plan() inside their own transaction.
+
+All times are epoch seconds so that a batch of sessions is planned with
+integer arithmetic only; the lunch window of a work day is resolved once per
+day and window and cached. The window comes from the lunch_period_* columns
+of user_settings (the user's row, else the system row user_id 0).
+"""
+
+from datetime import date, datetime
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from app.services.attendance_service import LOCAL_TZ, refresh_daily_summary_keys
+from app.services.version_service import bump_user_versions
+
+
+class BreakPolicy(NamedTuple):
+    """Statutory break rules.
+
+    tiers: (minimum gross minutes, required break minutes, description),
+    checked from the longest threshold down. A session needs the break of
+    the first tier whose threshold it exceeds. The lunch window defaults
+    match the user_settings column defaults.
+    """
+    tiers: tuple = (
+        (9 * 60, 45, 'Gesetzliche Pause (ArbZG §4) für Arbeitszeit über 9 Stunden'),
+        (6 * 60, 30, 'Gesetzliche Pause (ArbZG §4) für Arbeitszeit über 6 Stunden'),
+    )
+    lunch_start_hour: int = 11
+    lunch_start_minute: int = 30
+    lunch_end_hour: int = 14
+    lunch_end_minute: int = 0
+
+
+ARBZG_POLICY = BreakPolicy()
+
+# Users who switched automatic breaks off still get billable minutes computed
+NO_BREAK_POLICY = BreakPolicy(tiers=())
+
+
+class Session(NamedTuple):
+    """A finished attendance session as seen by the engine."""
+    check_in_ts: int
+    check_out_ts: int
+    work_date: str
+    break_minutes: int = 0            # breaks already recorded (manual ones)
+    excluded_break_minutes: int = 0   # part of break_minutes that is not billable
+
+
+class BreakPlan(NamedTuple):
+    """Result for one session; start_ts/end_ts are None when no break is added."""
+    billable_minutes: int
+    break_minutes: int = 0
+    start_ts: Optional[int] = None
+    end_ts: Optional[int] = None
+    description: Optional[str] = None
+
+
+@lru_cache(maxsize=1024)
+def _lunch_window(work_date, start_hour, start_minute, end_hour, end_minute):
+    day = date.fromisoformat(work_date)
+    start = LOCAL_TZ.localize(datetime(day.year, day.month, day.day, start_hour, start_minute))
+    end = LOCAL_TZ.localize(datetime(day.year, day.month, day.day, end_hour, end_minute))
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def plan_break(session, policy=ARBZG_POLICY):
+    """Plan the missing statutory break of one session.
+
+    The break covers whatever the already recorded breaks do not. It is put
+    at the start of the lunch window if the session overlaps it, otherwise
+    at the end of the session, and always lies completely inside the
+    session. billable_minutes is the gross time minus non-billable breaks
+    including the planned one.
+    """
+    check_in_ts, check_out_ts, work_date, break_minutes, excluded_minutes = session
+    gross_minutes = (check_out_ts - check_in_ts) // 60
+    billable_minutes = gross_minutes - excluded_minutes
+
+    for threshold, required, description in policy.tiers:
+        if gross_minutes > threshold:
+            break
+    else:
+        return BreakPlan(billable_minutes)
+
+    missing = required - break_minutes
+    if missing <= 0:
+        return BreakPlan(billable_minutes)
+
+    length = missing * 60
+    lunch_start, lunch_end = _lunch_window(work_date, policy.lunch_start_hour, policy.lunch_start_minute,
+                                           policy.lunch_end_hour, policy.lunch_end_minute)
+    if check_in_ts <= lunch_end and check_out_ts >= lunch_start:
+        start_ts = max(check_in_ts, lunch_start)
+    else:
+        start_ts = check_out_ts - length
+    start_ts = max(check_in_ts, min(start_ts, check_out_ts - length))
+
+    return BreakPlan(billable_minutes - missing, missing, start_ts, start_ts + length, description)
+
+
+def plan_breaks(sessions, policy=ARBZG_POLICY):
+    """Plan breaks for many sessions; returns the plans in input order."""
+    return [plan_break(session, policy) for session in sessions]
+
+
+def record_break_plan(cursor, attendance_id, plan):
+    """Store a plan: insert the auto break (if any) and the billable minutes.
+
+    Does not commit; the caller decides the transaction boundary.
+    """
+    if plan.start_ts is not None:
+        cursor.execute('''
+            INSERT INTO breaks (attendance_id, start_time, end_time, start_ts, end_ts,
+                                duration_minutes, is_excluded_from_billing, is_auto_detected, description)
+            VALUES (?, ?, ?, ?, ?, ?, 1, 1, ?)
+        ''', (attendance_id,
+              datetime.fromtimestamp(plan.start_ts, LOCAL_TZ).strftime('%Y-%m-%d %H:%M:%S'),
+              datetime.fromtimestamp(plan.end_ts, LOCAL_TZ).strftime('%Y-%m-%d %H:%M:%S'),
+              plan.start_ts, plan.end_ts, plan.break_minutes, plan.description))
+    cursor.execute('''
+        UPDATE attendance
+        SET billable_minutes = ?, has_auto_breaks = ?
+        WHERE id = ?
+    ''', (plan.billable_minutes, plan.start_ts is not None, attendance_id))
+
+
+SETTINGS_SQL = 'SELECT * FROM user_settings WHERE user_id = ?'
+
+_POLICY_COLUMNS = '''arbzg_breaks_enabled, lunch_period_start_hour, lunch_period_start_minute,
+           lunch_period_end_hour, lunch_period_end_minute'''
+
+# The user's settings row, else the system row (user_id 0)
+POLICY_SQL = f'''
+    SELECT {_POLICY_COLUMNS} FROM user_settings
+    WHERE user_id IN (?, 0)
+    ORDER BY user_id DESC LIMIT 1
+'''
+
+SESSION_BREAKS_SQL = '''
+    SELECT COALESCE(SUM(duration_minutes), 0),
+           COALESCE(SUM(CASE WHEN is_excluded_from_billing = 1 THEN duration_minutes END), 0)
+    FROM breaks WHERE attendance_id = ?
+'''
+
+
+def _policy(enabled=None, start_hour=None, start_minute=None, end_hour=None, end_minute=None):
+    """Build the policy of a user_settings row; NULL columns keep the defaults.
+
+    Automatic breaks are on unless explicitly switched off.
+    """
+    policy = NO_BREAK_POLICY if enabled is not None and not enabled else ARBZG_POLICY
+    lunch = {
+        field: value
+        for field, value in zip(('lunch_start_hour', 'lunch_start_minute', 'lunch_end_hour', 'lunch_end_minute'),
+                                (start_hour, start_minute, end_hour, end_minute))
+        if value is not None
+    }
+    return policy._replace(**lunch) if lunch else policy
+
+
+def policy_for_user(cursor, user_id):
+    """Return the break policy of a user.
+
+    Uses the user's settings row, falling back to the system row (user_id 0).
+    """
+    cursor.execute(POLICY_SQL, (user_id,))
+    row = cursor.fetchone()
+    return _policy(*row) if row else ARBZG_POLICY
+
+
+def load_session(cursor, attendance_id, check_in_ts, check_out_ts, work_date):
+    """Build a Session with the breaks currently recorded for a record."""
+    cursor.execute(SESSION_BREAKS_SQL, (attendance_id,))
+    break_minutes, excluded_minutes = cursor.fetchone()
+    return Session(check_in_ts, check_out_ts, work_date, break_minutes, excluded_minutes)
+
+
+def load_policies(cursor):
+    """Return ({user_id: policy}, default policy) for all configured users."""
+    cursor.execute(f'SELECT user_id, {_POLICY_COLUMNS} FROM user_settings')
+    policies = {row[0]: _policy(*row[1:]) for row in cursor.fetchall()}
+    return policies, policies.get(0, ARBZG_POLICY)
+
+
+def _local_time(epoch):
+    return datetime.fromtimestamp(epoch, LOCAL_TZ).strftime('%H:%M') if epoch is not None else None
+
+
+# Closed sessions with their manual breaks and current auto break, keyset
+# paginated on attendance.id
+_RECOMPUTE_SELECT = '''
+    SELECT a.id, a.user_id, a.check_in_ts, a.check_out_ts, a.work_date, a.billable_minutes,
+           COALESCE(SUM(CASE WHEN b.is_auto_detected = 1 THEN 0 ELSE b.duration_minutes END), 0),
+           COALESCE(SUM(CASE WHEN b.is_auto_detected = 1 THEN 0
+                             WHEN b.is_excluded_from_billing = 1 THEN b.duration_minutes END), 0),
+           COALESCE(SUM(CASE WHEN b.is_auto_detected = 1 THEN b.duration_minutes END), 0),
+           MIN(CASE WHEN b.is_auto_detected = 1 THEN b.start_ts END)
+    FROM attendance a
+    LEFT JOIN breaks b ON b.attendance_id = a.id
+    WHERE a.id > ? AND a.check_out_ts IS NOT NULL AND a.check_in_ts IS NOT NULL
+'''
+
+
+def recompute_breaks(conn, user_ids=None, first_day=None, last_day=None, dry_run=False,
+                     chunk_size=500, progress=None, max_diff_rows=200):
+    """Recompute auto breaks and billable_minutes for many attendance records.
+
+    Records are read in chunks of chunk_size ordered by id. Each chunk is
+    planned with plan_break() and, unless dry_run is set, written with
+    executemany in its own BEGIN IMMEDIATE transaction, so the write lock is
+    only held for one chunk at a time. Only records whose result differs are
+    written; manual breaks are never touched.
+
+    user_ids limits the run to some users, first_day/last_day ('YYYY-MM-DD',
+    inclusive) to a range of work dates. progress, if given, is called with
+    the running totals after every chunk. Returns the totals together with
+    the first max_diff_rows changes (billable minutes, auto break minutes
+    and local auto break start, each as [old, new]).
+    """
+    filters, params = [], []
+    if user_ids:
+        user_ids = [int(user_id) for user_id in user_ids]
+        filters.append(f"a.user_id IN ({', '.join('?' * len(user_ids))})")
+        params.extend(user_ids)
+    if first_day:
+        filters.append('a.work_date >= ?')
+        params.append(first_day)
+    if last_day:
+        filters.append('a.work_date <= ?')
+        params.append(last_day)
+    where = ''.join(f' AND {condition}' for condition in filters)
+    select_sql = _RECOMPUTE_SELECT + where + ' GROUP BY a.id ORDER BY a.id LIMIT ?'
+
+    cursor = conn.cursor()
+    policies, default_policy = load_policies(cursor)
+    cursor.execute(
+        'SELECT COUNT(*) FROM attendance a WHERE a.id > ? AND a.check_out_ts IS NOT NULL '
+        'AND a.check_in_ts IS NOT NULL' + where, [0] + params
+    )
+    totals = {'total': cursor.fetchone()[0], 'processed': 0, 'changed': 0,
+              'breaks_added': 0, 'breaks_removed': 0, 'chunks': 0, 'dry_run': dry_run}
+    diff = []
+    last_id = 0
+
+    while True:
+        if not dry_run:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor.execute(select_sql, [last_id] + params + [chunk_size])
+            rows = cursor.fetchall()
+            if not rows:
+                if not dry_run:
+                    conn.rollback()
+                break
+
+            removed_ids, new_breaks, updates, summary_keys = [], [], [], set()
+            for (attendance_id, user_id, check_in_ts, check_out_ts, work_date, billable_minutes,
+                 manual_minutes, excluded_minutes, auto_minutes, auto_start_ts) in rows:
+                plan = plan_break(
+                    Session(check_in_ts, check_out_ts, work_date, manual_minutes, excluded_minutes),
+                    policies.get(user_id, default_policy)
+                )
+                if (plan.billable_minutes == billable_minutes and plan.break_minutes == auto_minutes
+                        and plan.start_ts == auto_start_ts):
+                    continue
+
+                totals['changed'] += 1
+                if len(diff) < max_diff_rows:
+                    diff.append({
+                        'attendance_id': attendance_id, 'user_id': user_id, 'work_date': work_date,
+                        'billable_minutes': [billable_minutes, plan.billable_minutes],
+                        'auto_break_minutes': [auto_minutes, plan.break_minutes],
+                        'auto_break_start': [_local_time(auto_start_ts), _local_time(plan.start_ts)],
+                    })
+                if auto_minutes:
+                    removed_ids.append((attendance_id,))
+                    totals['breaks_removed'] += 1
+                if plan.start_ts is not None:
+                    new_breaks.append((
+                        attendance_id,
+                        datetime.fromtimestamp(plan.start_ts, LOCAL_TZ).strftime('%Y-%m-%d %H:%M:%S'),
+                        datetime.fromtimestamp(plan.end_ts, LOCAL_TZ).strftime('%Y-%m-%d %H:%M:%S'),
+                        plan.start_ts, plan.end_ts, plan.break_minutes, plan.description
+                    ))
+                    totals['breaks_added'] += 1
+                updates.append((plan.billable_minutes, plan.start_ts is not None, attendance_id))
+                summary_keys.add((user_id, work_date))
+
+            if not dry_run:
+                cursor.executemany('DELETE FROM breaks WHERE attendance_id = ? AND is_auto_detected = 1',
+                                   removed_ids)
+                cursor.executemany('''
+                    INSERT INTO breaks (attendance_id, start_time, end_time, start_ts, end_ts,
+                                        duration_minutes, is_excluded_from_billing, is_auto_detected, description)
+                    VALUES (?, ?, ?, ?, ?, ?, 1, 1, ?)
+                ''', new_breaks)
+                cursor.executemany('UPDATE attendance SET billable_minutes = ?, has_auto_breaks = ? WHERE id = ?',
+                                   updates)
+                refresh_daily_summary_keys(cursor, summary_keys)
+                bump_user_versions(cursor, [user_id for user_id, _ in summary_keys])
+                conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+        last_id = rows[-1][0]
+        totals['processed'] += len(rows)
+        totals['chunks'] += 1
+        if progress:
+            progress(dict(totals))
+
+    totals['diff'] = diff
+    return totals
+
+
+
+if __name__ == '__main__':
+    # Micro-benchmark over a synthetic workload:
+    # python -m app.services.break_service [sessions]
+    import os
+    import random
+    import sqlite3
+    import sys
+    import tempfile
+    import time
+
+    import setup_database
+    from app.services.attendance_service import day_bounds
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rng = random.Random(4)
+    days = [f'2025-{month:02d}-{day:02d}' for month in range(1, 13) for day in (3, 14, 27)]
+    days += ['2025-03-30', '2025-10-26']  # DST changes
+
+    sessions = []
+    for _ in range(count):
+        work_date = rng.choice(days)
+        check_in_ts = day_bounds(work_date)[0] + rng.randrange(0, 16 * 3600)
+        check_out_ts = check_in_ts + rng.randrange(0, 13 * 3600)
+        break_minutes = rng.choice((0, 0, 0, 10, 15, 30, 50))
+        sessions.append(Session(check_in_ts, check_out_ts, work_date, break_minutes, rng.choice((0, break_minutes))))
+
+    started = time.perf_counter()
+    for session in sessions:
+        plan_break(session)
+    elapsed = time.perf_counter() - started
+    print(f'plan_break: {count} sessions in {elapsed * 1000:.1f} ms ({elapsed / count * 1e6:.2f} µs per session)')
+
+    # recompute_breaks on a fresh database with the same sessions spread over 50 users
+    with tempfile.TemporaryDirectory() as directory:
+        setup_database.DATABASE = os.path.join(directory, 'attendance.db')
+        setup_database.create_fresh_database()
+        conn = sqlite3.connect(setup_database.DATABASE, isolation_level=None)
+        conn.execute('BEGIN')
+        conn.executemany("INSERT INTO users (username, password) VALUES (?, 'x')",
+                         [(f'bench{number}',) for number in range(50)])
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE username LIKE 'bench%'")]
+        conn.executemany('''
+            INSERT INTO attendance (user_id, check_in, check_out, check_in_ts, check_out_ts, work_date)
+            VALUES (?, 'x', 'x', ?, ?, ?)
+        ''', [(rng.choice(user_ids), session.check_in_ts, session.check_out_ts, session.work_date)
+              for session in sessions])
+        conn.execute('COMMIT')
+
+        for dry_run in (True, False, False):
+            started = time.perf_counter()
+            totals = recompute_breaks(conn, dry_run=dry_run)
+            elapsed = time.perf_counter() - started
+            print(f"recompute_breaks{' --dry-run' if dry_run else ''}: {totals['processed']} records, "
+                  f"{totals['changed']} changed in {elapsed * 1000:.1f} ms "
+                  f"({elapsed / max(totals['processed'], 1) * 1e6:.2f} µs per record)")
+        conn.close()
@@ -0,0 +1,69 @@
+# Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
+# Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
+
+"""
+Privacy consent bookkeeping.
+
+user_consents keeps the full history, one row per change. current_consents
+holds only the latest status per user so that user listings join on a
+primary key instead of searching the history for MAX(id) per user. Both
+tables are written together by record_consent()/record_consents(), inside the
+caller's transaction.
+"""
+
+CURRENT_CONSENT_SQL = 'SELECT consent_status, consent_date FROM current_consents WHERE user_id = ?'
+
+CONSENT_COUNT_SQL = 'SELECT COUNT(*) FROM current_consents WHERE consent_status = ?'
+
+# The latest changes of a user, for the user details dialog
+CONSENT_HISTORY_SQL = '''
+    SELECT consent_status, consent_date
+    FROM user_consents
+    WHERE user_id = ?
+    ORDER BY consent_date DESC
+    LIMIT 10
+'''
+
+_INSERT_HISTORY = 'INSERT INTO user_consents (user_id, consent_status, consent_date) VALUES (?, ?, ?)'
+
+_UPSERT_CURRENT = '''
+    INSERT INTO current_consents (user_id, consent_status, consent_date)
+    VALUES (?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        consent_status = excluded.consent_status,
+        consent_date = excluded.consent_date
+'''
+
+
+def record_consents(cursor, user_ids, consent_status, consent_date):
+    """Append a history row and update the current status for every user.
+
+    Does not commit; the caller decides the transaction boundary.
+    """
+    rows = [(user_id, consent_status, consent_date) for user_id in user_ids]
+    cursor.executemany(_INSERT_HISTORY, rows)
+    cursor.executemany(_UPSERT_CURRENT, rows)
+    return len(rows)
+
+
+def record_consent(cursor, user_id, consent_status, consent_date):
+    """Record a consent change for a single user."""
+    record_consents(cursor, [user_id], consent_status, consent_date)
+
+
+def forget_consents(cursor, user_id):
+    """Remove the complete consent history and current status of a user."""
+    cursor.execute('DELETE FROM user_consents WHERE user_id = ?', (user_id,))
+    cursor.execute('DELETE FROM current_consents WHERE user_id = ?', (user_id,))
+
+
+def sync_current_consents(cursor):
+    """Rebuild current_consents from the history (latest row per user)."""
+    cursor.execute('DELETE FROM current_consents')
+    cursor.execute('''
+        INSERT INTO current_consents (user_id, consent_status, consent_date)
+        SELECT user_id, consent_status, consent_date
+        FROM user_consents
+        WHERE id IN (SELECT MAX(id) FROM user_consents WHERE user_id IS NOT NULL GROUP BY user_id)
+    ''')
+    return cursor.rowcount
@@ -0,0 +1,299 @@
+# Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
+# Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
+
+"""
+Background export jobs.
+
+Large exports run outside the request workers. A request only inserts a row
+into export_jobs; a small fixed pool of worker threads claims queued rows
+(UPDATE ... RETURNING, so every process can take part), writes the export
+into the spool directory and records progress in the row. The admin page
+polls the row and downloads the finished file until it expires.
+
+Files are written as '<id>.part' and renamed when complete, so a download
+never sees a half-written export. Jobs whose worker stopped sending
+heartbeats (process restart) are marked as failed by the sweep.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from app.services.export_service import (
+    ALL_ATTENDANCE_EXPORT_HEADER, USER_EXPORT_HEADER, count_all_attendance, csv_stream,
+    format_all_attendance_row, format_user_row, full_export_json, iter_batches,
+    select_all_attendance_for_export, select_user_attendance_for_export, select_user_for_export,
+    select_users_for_export, user_export_csv, user_export_json,
+)
+
+
+class ExportQueueFull(Exception):
+    """Raised by submit() when too many jobs are waiting."""
+
+
+def _counted(batches, progress, total):
+    done = 0
+    for rows in batches:
+        yield rows
+        done += len(rows)
+        progress(done, total)
+
+
+def _write_users_csv(conn, params, progress):
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM users')
+    total = cursor.fetchone()[0]
+    select_users_for_export(cursor)
+    return csv_stream(USER_EXPORT_HEADER, _counted(iter_batches(cursor), progress, total), format_user_row)
+
+
+def _write_attendance_csv(conn, params, progress):
+    cursor = conn.cursor()
+    total = count_all_attendance(cursor)
+    select_all_attendance_for_export(cursor)
+    return csv_stream(ALL_ATTENDANCE_EXPORT_HEADER, _counted(iter_batches(cursor), progress, total),
+                      format_all_attendance_row)
+
+
+def _write_full_json(conn, params, progress):
+    return full_export_json(conn.cursor(), conn.cursor(), progress)
+
+
+def _write_user_data(conn, params, progress):
+    cursor = conn.cursor()
+    user = select_user_for_export(cursor, params['user_id'])
+    if user is None:
+        raise ValueError(f"Benutzer {params['user_id']} nicht gefunden")
+    # Progress counts joined rows (one per break, at least one per record)
+    cursor.execute('''
+        SELECT COUNT(*) FROM attendance a LEFT JOIN breaks b ON b.attendance_id = a.id WHERE a.user_id = ?
+    ''', (params['user_id'],))
+    total = cursor.fetchone()[0]
+    select_user_attendance_for_export(cursor, params['user_id'])
+    batches = _counted(iter_batches(cursor), progress, total)
+    if params.get('format') == 'json':
+        return user_export_json(user, batches)
+    return user_export_csv(user, batches)
+
+
+# kind -> (label, file extension, writer(conn, params, progress) -> iterable of str)
+EXPORT_KINDS = {
+    'users_csv': ('Benutzerliste (CSV)', 'csv', _write_users_csv),
+    'attendance_csv': ('Alle Anwesenheiten (CSV)', 'csv', _write_attendance_csv),
+    'full_json': ('Vollständiger Datenexport (JSON)', 'json', _write_full_json),
+    'user_data': ('Daten eines Benutzers', None, _write_user_data),
+}
+
+_JOB_COLUMNS = '''
+    id, kind, params, status, requested_by, created_ts, started_ts, finished_ts,
+    heartbeat_ts, expires_ts, progress_done, progress_total, file_name, file_size, error
+'''
+
+
+def _job_dict(row):
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    job['label'] = EXPORT_KINDS.get(job['kind'], (job['kind'],))[0]
+    return job
+
+
+class ExportJobQueue:
+    """Persisted export jobs worked off by a bounded pool of threads.
+
+    connect is a zero-argument callable returning a context manager that
+    yields a database connection (db_pool.connection).
+    """
+
+    def __init__(self, connect, spool_dir, workers=2, max_pending=20, retention_hours=24,
+                 poll_interval=5.0, stale_after=900):
+        self.connect = connect
+        self.spool_dir = spool_dir
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retention_seconds = retention_hours * 3600
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stats = {'submitted': 0, 'finished': 0, 'failed': 0, 'expired': 0, 'rejected': 0}
+
+    def start(self):
+        """Start the worker threads once; called lazily by submit, get and list."""
+        with self._lock:
+            if self._threads:
+                return
+            os.makedirs(self.spool_dir, exist_ok=True)
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'export-worker-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, kind, params=None, requested_by=None):
+        """Queue an export and return the job.
+
+        Raises ValueError for unknown kinds or invalid parameters and
+        ExportQueueFull when max_pending jobs are already waiting.
+        """
+        if kind not in EXPORT_KINDS:
+            raise ValueError(f'Unbekannter Exporttyp: {kind}')
+        params = dict(params or {})
+        if kind == 'user_data':
+            params = {'user_id': int(params.get('user_id') or ''), 'format': 'json' if params.get('format') == 'json' else 'csv'}
+        self.start()
+        with self.connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                pending = conn.execute(
+                    "SELECT COUNT(*) FROM export_jobs WHERE status IN ('queued', 'running')"
+                ).fetchone()[0]
+                if pending >= self.max_pending:
+                    with self._lock:
+                        self._stats['rejected'] += 1
+                    raise ExportQueueFull(f'{pending} Exporte warten bereits')
+                row = conn.execute(f'''
+                    INSERT INTO export_jobs (kind, params, status, requested_by, created_ts)
+                    VALUES (?, ?, 'queued', ?, ?)
+                    RETURNING {_JOB_COLUMNS}
+                ''', (kind, json.dumps(params), requested_by, int(time.time()))).fetchall()[0]
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        with self._lock:
+            self._stats['submitted'] += 1
+        self._wakeup.set()
+        return _job_dict(row)
+
+    def get(self, job_id):
+        self.start()
+        with self.connect() as conn:
+            row = conn.execute(f'SELECT {_JOB_COLUMNS} FROM export_jobs WHERE id = ?', (job_id,)).fetchone()
+        return _job_dict(row) if row else None
+
+    def list(self, limit=50):
+        """Return the newest jobs, newest first."""
+        self.start()
+        with self.connect() as conn:
+            rows = conn.execute(f'SELECT {_JOB_COLUMNS} FROM export_jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        return [_job_dict(row) for row in rows]
+
+    def file_path(self, job):
+        return os.path.join(self.spool_dir, f"{job['id']}.{job['file_name'].rsplit('.', 1)[-1]}")
+
+    def sweep(self):
+        """Expire finished jobs past their retention and fail abandoned ones."""
+        now = int(time.time())
+        with self.connect() as conn:
+            expired = conn.execute(f'''
+                UPDATE export_jobs SET status = 'expired'
+                WHERE status = 'finished' AND expires_ts <= ?
+                RETURNING {_JOB_COLUMNS}
+            ''', (now,)).fetchall()
+            conn.execute('''
+                UPDATE export_jobs SET status = 'failed', finished_ts = ?, error = 'Abgebrochen (Worker beendet)'
+                WHERE status = 'running' AND heartbeat_ts < ?
+            ''', (now, now - self.stale_after))
+            conn.commit()
+        for row in expired:
+            try:
+                os.remove(self.file_path(row))
+            except OSError:
+                pass
+        if expired:
+            with self._lock:
+                self._stats['expired'] += len(expired)
+        return len(expired)
+
+    def stats(self):
+        """Return a snapshot of the queue statistics."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['workers'] = len(self._threads)
+        stats['max_pending'] = self.max_pending
+        return stats
+
+    def _claim(self):
+        now = int(time.time())
+        with self.connect() as conn:
+            row = conn.execute(f'''
+                UPDATE export_jobs SET status = 'running', started_ts = ?, heartbeat_ts = ?
+                WHERE id = (SELECT id FROM export_jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+                  AND status = 'queued'
+                RETURNING {_JOB_COLUMNS}
+            ''', (now, now)).fetchall()
+            conn.commit()
+        return _job_dict(row[0]) if row else None
+
+    def _work(self):
+        last_sweep = 0
+        while True:
+            try:
+                if time.monotonic() - last_sweep > 60:
+                    self.sweep()
+                    last_sweep = time.monotonic()
+                job = self._claim()
+            except Exception as e:
+                logging.error(f"Export worker could not claim a job: {str(e)}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        label, extension, writer = EXPORT_KINDS[job['kind']]
+        extension = extension or job['params'].get('format', 'csv')
+        file_name = f"{job['kind']}_{time.strftime('%Y%m%d_%H%M%S')}_{job['id']}.{extension}"
+        final_path = os.path.join(self.spool_dir, f"{job['id']}.{extension}")
+        part_path = final_path + '.part'
+        logging.info(f"Export job {job['id']} ({job['kind']}) started for {job['requested_by']}")
+
+        # Bookkeeping uses its own connection: the export keeps a read
+        # statement open on the data connection for its whole run
+        with self.connect() as data_conn, self.connect() as job_conn:
+            last_update = 0.0
+
+            def progress(done, total):
+                nonlocal last_update
+                if time.monotonic() - last_update < 1.0 and done != total:
+                    return
+                last_update = time.monotonic()
+                job_conn.execute(
+                    'UPDATE export_jobs SET progress_done = ?, progress_total = ?, heartbeat_ts = ? WHERE id = ?',
+                    (done, total, int(time.time()), job['id'])
+                )
+                job_conn.commit()
+
+            try:
+                with open(part_path, 'w', encoding='utf-8', newline='') as output:
+                    for chunk in writer(data_conn, job['params'], progress):
+                        output.write(chunk)
+                os.replace(part_path, final_path)
+                now = int(time.time())
+                job_conn.execute('''
+                    UPDATE export_jobs SET status = 'finished', finished_ts = ?, expires_ts = ?,
+                                           file_name = ?, file_size = ?
+                    WHERE id = ?
+                ''', (now, now + self.retention_seconds, file_name, os.path.getsize(final_path), job['id']))
+                job_conn.commit()
+                with self._lock:
+                    self._stats['finished'] += 1
+                logging.info(f"Export job {job['id']} finished: {file_name}")
+            except Exception as e:
+                logging.error(f"Export job {job['id']} failed: {str(e)}")
+                try:
+                    os.remove(part_path)
+                except OSError:
+                    pass
+                job_conn.rollback()
+                job_conn.execute(
+                    "UPDATE export_jobs SET status = 'failed', finished_ts = ?, error = ? WHERE id = ?",
+                    (int(time.time()), str(e), job['id'])
+                )
+                job_conn.commit()
+                with self._lock:
+                    self._stats['failed'] += 1
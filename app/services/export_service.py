@@ -1,2 +1,278 @@
 # Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
 # Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
+
+"""
+CSV and JSON exports.
+
+Exports are generators over an executed cursor: rows are fetched batch_size
+at a time and handed out as soon as they are formatted, so memory stays the
+same for 50 or 50,000 rows. The header is the first chunk; routes wrap the
+generator in a streaming Response whose headers go out before the body.
+"""
+
+import csv
+import json
+
+
+class _LineBuffer:
+    """File-like target for csv.writer that returns each line instead of storing it."""
+
+    def write(self, line):
+        return line
+
+
+def iter_batches(cursor, batch_size=500):
+    """Yield the remaining rows of an executed cursor as lists of batch_size rows."""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def csv_stream(header, batches, format_row=tuple):
+    """Yield CSV text: the header line first, then one chunk per batch of rows."""
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(header)
+    for rows in batches:
+        yield ''.join(writer.writerow(format_row(row)) for row in rows)
+
+
+USER_EXPORT_HEADER = [
+    'ID', 'Benutzername', 'Vorname', 'Nachname', 'Mitarbeiter-ID',
+    'Rolle', 'Abteilung', 'Status', 'Admin', 'Erstellt am', 'Aktualisiert am',
+    'Datenschutz-Status', 'Datenschutz-Datum'
+]
+
+
+def select_users_for_export(cursor):
+    """Run the user export query on cursor; rows are read by the caller."""
+    cursor.execute('''
+        SELECT
+            u.id, u.username, u.first_name, u.last_name, u.employee_id,
+            u.user_role, u.department, u.account_status, u.is_admin,
+            u.created_at, u.updated_at,
+            COALESCE(uc.consent_status, 'Unknown') AS consent_status,
+            COALESCE(uc.consent_date, '') AS consent_date
+        FROM users u
+        LEFT JOIN current_consents uc ON u.id = uc.user_id
+        ORDER BY u.username
+    ''')
+
+
+def format_user_row(user):
+    return [
+        user['id'], user['username'], user['first_name'] or '',
+        user['last_name'] or '', user['employee_id'] or '',
+        user['user_role'], user['department'] or '', user['account_status'],
+        'Ja' if user['is_admin'] else 'Nein', user['created_at'], user['updated_at'],
+        user['consent_status'], user['consent_date']
+    ]
+
+
+# Per-user data export: the user's master data, then every attendance record
+# followed by its breaks, read from one ordered join.
+
+USER_DATA_FIELDS = [
+    ('id', 'ID'), ('username', 'Benutzername'), ('first_name', 'Vorname'), ('last_name', 'Nachname'),
+    ('employee_id', 'Mitarbeiter-ID'), ('user_role', 'Rolle'), ('department', 'Abteilung'),
+    ('account_status', 'Kontostatus'), ('is_admin', 'Administrator'), ('created_at', 'Erstellt am'),
+    ('last_login', 'Letzter Login'), ('consent_status', 'Datenschutz-Einwilligung'),
+    ('consent_date', 'Einwilligung am'),
+]
+
+ATTENDANCE_EXPORT_HEADER = [
+    'Typ', 'Datum', 'Beginn', 'Ende', 'Dauer (Min)', 'Abrechenbar (Min)',
+    'Automatisch', 'Von Abrechnung ausgenommen', 'Beschreibung'
+]
+
+
+_USER_EXPORT_SELECT = '''
+    SELECT
+        u.id, u.username, u.first_name, u.last_name, u.employee_id,
+        u.user_role, u.department, u.account_status, u.is_admin,
+        u.created_at, u.updated_at, u.last_login,
+        COALESCE(uc.consent_status, 'Unknown') AS consent_status,
+        COALESCE(uc.consent_date, '') AS consent_date
+    FROM users u
+    LEFT JOIN current_consents uc ON u.id = uc.user_id
+'''
+
+
+def select_user_for_export(cursor, user_id):
+    """Return the user row with its current consent, or None."""
+    cursor.execute(_USER_EXPORT_SELECT + ' WHERE u.id = ?', (user_id,))
+    return cursor.fetchone()
+
+
+def select_user_attendance_for_export(cursor, user_id):
+    """Run the attendance/breaks join for a user, newest record first.
+
+    One row per break, or one row with NULL break columns for records
+    without breaks; a record's rows are consecutive and its breaks ordered
+    by start time.
+    """
+    cursor.execute('''
+        SELECT a.id, a.work_date, a.check_in, a.check_out,
+               CASE WHEN a.check_out_ts IS NOT NULL THEN (a.check_out_ts - a.check_in_ts) / 60 END AS gross_minutes,
+               a.billable_minutes, a.has_auto_breaks,
+               b.id AS break_id, b.start_time, b.end_time, b.duration_minutes,
+               b.is_auto_detected, b.is_excluded_from_billing, b.description
+        FROM attendance a
+        LEFT JOIN breaks b ON b.attendance_id = a.id
+        WHERE a.user_id = ?
+        ORDER BY a.check_in_ts DESC, a.id DESC, b.start_ts, b.id
+    ''', (user_id,))
+
+
+def _yes_no(value):
+    return 'Ja' if value else 'Nein'
+
+
+def _blank_if_none(value):
+    return '' if value is None else value
+
+
+def _attendance_csv_batches(batches):
+    """Turn joined row batches into CSV row batches; a record may span batches."""
+    current_id = None
+    for rows in batches:
+        formatted = []
+        for row in rows:
+            if row['id'] != current_id:
+                current_id = row['id']
+                formatted.append([
+                    'Anwesenheit', row['work_date'] or '', row['check_in'] or '', row['check_out'] or '',
+                    _blank_if_none(row['gross_minutes']), _blank_if_none(row['billable_minutes']),
+                    _yes_no(row['has_auto_breaks']), '', ''
+                ])
+            if row['break_id'] is not None:
+                formatted.append([
+                    'Pause', row['work_date'] or '', row['start_time'] or '', row['end_time'] or '',
+                    _blank_if_none(row['duration_minutes']), '',
+                    _yes_no(row['is_auto_detected']), _yes_no(row['is_excluded_from_billing']),
+                    row['description'] or ''
+                ])
+        yield formatted
+
+
+def user_export_csv(user, batches):
+    """Yield the CSV export of a user: master data section, then attendance and breaks."""
+    writer = csv.writer(_LineBuffer())
+    lines = [writer.writerow(['=== BENUTZERDATEN ==='])]
+    for column, label in USER_DATA_FIELDS:
+        value = user[column]
+        if column == 'is_admin':
+            value = _yes_no(value)
+        elif column == 'last_login':
+            value = value or 'Nie'
+        lines.append(writer.writerow([label, _blank_if_none(value)]))
+    lines.append(writer.writerow([]))
+    lines.append(writer.writerow(['=== ANWESENHEITSDATEN ===']))
+    yield ''.join(lines)
+    yield from csv_stream(ATTENDANCE_EXPORT_HEADER, _attendance_csv_batches(batches))
+
+
+def _attendance_records(batches):
+    """Yield one dict per attendance record with its list of breaks."""
+    record = None
+    for rows in batches:
+        for row in rows:
+            if record is None or row['id'] != record['id']:
+                if record is not None:
+                    yield record
+                record = {
+                    'id': row['id'], 'work_date': row['work_date'],
+                    'check_in': row['check_in'], 'check_out': row['check_out'],
+                    'gross_minutes': row['gross_minutes'], 'billable_minutes': row['billable_minutes'],
+                    'has_auto_breaks': bool(row['has_auto_breaks']), 'breaks': [],
+                }
+            if row['break_id'] is not None:
+                record['breaks'].append({
+                    'id': row['break_id'], 'start_time': row['start_time'], 'end_time': row['end_time'],
+                    'duration_minutes': row['duration_minutes'],
+                    'is_auto_detected': bool(row['is_auto_detected']),
+                    'is_excluded_from_billing': bool(row['is_excluded_from_billing']),
+                    'description': row['description'],
+                })
+    if record is not None:
+        yield record
+
+
+def user_export_json(user, batches):
+    """Yield the JSON export of a user as {"user": {...}, "attendance": [...]}.
+
+    Every attendance record is serialized on its own, so only one record is
+    held in memory at a time.
+    """
+    user_data = {column: user[column] for column, _ in USER_DATA_FIELDS}
+    user_data['is_admin'] = bool(user_data['is_admin'])
+    yield '{"user": ' + json.dumps(user_data, ensure_ascii=False) + ', "attendance": ['
+    separator = ''
+    for record in _attendance_records(batches):
+        yield separator + json.dumps(record, ensure_ascii=False)
+        separator = ', '
+    yield ']}'
+
+
+def full_export_json(user_cursor, data_cursor, progress=None):
+    """Yield a JSON dump of every user with attendance and breaks.
+
+    The result is {"users": [...]} with one user_export_json object per
+    user. Users are read from user_cursor, each user's records from
+    data_cursor; progress(done, total) is called after every user.
+    """
+    user_cursor.execute('SELECT COUNT(*) FROM users')
+    total = user_cursor.fetchone()[0]
+    user_cursor.execute(_USER_EXPORT_SELECT + ' ORDER BY u.id')
+    yield '{"users": ['
+    done = 0
+    for users in iter_batches(user_cursor, 100):
+        for user in users:
+            select_user_attendance_for_export(data_cursor, user['id'])
+            if done:
+                yield ', '
+            yield from user_export_json(user, iter_batches(data_cursor))
+            done += 1
+            if progress:
+                progress(done, total)
+    yield ']}'
+
+
+# All attendance of all users, one row per record with its break minutes
+
+ALL_ATTENDANCE_EXPORT_HEADER = [
+    'Benutzername', 'Mitarbeiter-ID', 'Datum', 'Ankunft', 'Abgang',
+    'Dauer (Min)', 'Abrechenbar (Min)', 'Pausen (Min)', 'Automatische Pausen'
+]
+
+
+def count_all_attendance(cursor):
+    cursor.execute('SELECT COUNT(*) FROM attendance')
+    return cursor.fetchone()[0]
+
+
+def select_all_attendance_for_export(cursor):
+    """Run the all-attendance export query, ordered by user and check-in.
+
+    The order follows idx_attendance_user_check_in_ts, so SQLite streams the
+    rows without sorting the table first.
+    """
+    cursor.execute('''
+        SELECT u.username, u.employee_id, a.work_date, a.check_in, a.check_out,
+               CASE WHEN a.check_out_ts IS NOT NULL THEN (a.check_out_ts - a.check_in_ts) / 60 END AS gross_minutes,
+               a.billable_minutes,
+               (SELECT COALESCE(SUM(b.duration_minutes), 0) FROM breaks b WHERE b.attendance_id = a.id) AS break_minutes,
+               a.has_auto_breaks
+        FROM attendance a
+        JOIN users u ON u.id = a.user_id
+        ORDER BY a.user_id, a.check_in_ts
+    ''')
+
+
+def format_all_attendance_row(row):
+    return [
+        row['username'], row['employee_id'] or '', row['work_date'] or '', row['check_in'] or '',
+        row['check_out'] or '', _blank_if_none(row['gross_minutes']), _blank_if_none(row['billable_minutes']),
+        row['break_minutes'], _yes_no(row['has_auto_breaks'])
+    ]
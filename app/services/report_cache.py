@@ -0,0 +1,78 @@
+# Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
+# Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
+
+"""
+In-process cache for report results.
+
+Entries are keyed by (user_id, period type, period key, variant) and carry
+the report version they were built from (version_service.get_report_version).
+A lookup with a different version is a miss, so every write to the user's
+attendance or breaks in the period's months invalidates exactly the entries
+it affects, also when another worker process made the change.
+
+Periods that ended before the current month are closed. Their entries live
+in their own pool and are never pushed out by reports of the running month;
+both pools evict their least recently used entry when full.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class ReportCache:
+    """Version-checked LRU cache for report results."""
+
+    def __init__(self, max_open_entries=256, max_closed_entries=4096):
+        self._pools = {False: OrderedDict(), True: OrderedDict()}
+        self._limits = {False: max_open_entries, True: max_closed_entries}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidated': 0, 'evicted': 0}
+
+    def get(self, key, version):
+        """Return the cached value for key if it was built from version, else None."""
+        with self._lock:
+            for pool in self._pools.values():
+                entry = pool.get(key)
+                if entry is None:
+                    continue
+                if entry[0] == version:
+                    pool.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry[1]
+                del pool[key]
+                self._stats['invalidated'] += 1
+                break
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, key, version, value, closed=False):
+        with self._lock:
+            pool = self._pools[closed]
+            pool[key] = (version, value)
+            pool.move_to_end(key)
+            while len(pool) > self._limits[closed]:
+                pool.popitem(last=False)
+                self._stats['evicted'] += 1
+
+    def get_or_build(self, key, version, build, closed=False):
+        """Return the cached value or build, store and return it."""
+        value = self.get(key, version)
+        if value is None:
+            value = build()
+            self.put(key, version, value, closed)
+        return value
+
+    def clear(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.clear()
+
+    def stats(self):
+        """Return a snapshot of the cache statistics."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['open_entries'] = len(self._pools[False])
+            stats['closed_entries'] = len(self._pools[True])
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        return stats
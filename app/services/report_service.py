@@ -0,0 +1,141 @@
+# Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
+# Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
+
+"""
+Attendance reports.
+
+Rows and totals are computed by SQLite from the epoch columns: gross
+minutes are check_out_ts - check_in_ts, billable minutes are the stored
+billable_minutes. Both come back as integers; formatting them as "H:MM" is
+left to the templates (format_minutes).
+
+Rows are yielded in batches and paged with a keyset cursor on
+(check_in_ts, id), so a report over every user and the entire period never
+sits in memory as a whole.
+
+report_version() is the validity stamp for cached report results (see
+report_cache).
+"""
+
+from app.services.attendance_service import from_epoch, month_bounds, today_local
+from app.services.version_service import get_report_version
+
+_GROSS_MINUTES = 'CASE WHEN a.check_out_ts IS NOT NULL THEN (a.check_out_ts - a.check_in_ts) / 60 END'
+
+
+REPORT_PAGE_SIZE = 500
+# Single-user reports up to this many rows are cached with their rows
+REPORT_CACHE_MAX_ROWS = 2000
+
+
+def _report_filter(user_id, bounds, after=None):
+    conditions, params = [], []
+    if user_id is not None:
+        conditions.append('a.user_id = ?')
+        params.append(user_id)
+    if bounds is not None:
+        conditions.append('a.check_in_ts >= ? AND a.check_in_ts < ?')
+        params.extend(bounds)
+    if after is not None:
+        conditions.append('(a.check_in_ts, a.id) < (?, ?)')
+        params.extend(after)
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    return where, params
+
+
+def encode_cursor(row):
+    """Return the keyset cursor ('check_in_ts.id') that continues after a row."""
+    return f"{row['check_in_ts']}.{row['id']}"
+
+
+def decode_cursor(value):
+    """Parse a cursor from encode_cursor; raises ValueError if malformed."""
+    check_in_ts, _, attendance_id = value.partition('.')
+    return int(check_in_ts), int(attendance_id)
+
+
+def report_rows_query(user_id=None, bounds=None, after=None, limit=None):
+    """Return (sql, params) of the report_rows query."""
+    where, params = _report_filter(user_id, bounds, after)
+    if limit is not None:
+        params.append(limit)
+    sql = f'''
+        SELECT a.id, u.username, a.check_in, a.check_out, a.check_in_ts, a.work_date,
+               a.has_auto_breaks, {_GROSS_MINUTES} AS gross_minutes, a.billable_minutes
+        FROM attendance a
+        JOIN users u ON a.user_id = u.id
+        {where}
+        ORDER BY a.check_in_ts DESC, a.id DESC
+        {'LIMIT ?' if limit is not None else ''}
+    '''
+    return sql, params
+
+
+def report_rows(cursor, user_id=None, bounds=None, after=None, limit=None, batch_size=500):
+    """Yield the report rows, newest first.
+
+    user_id None means all users; bounds are half-open epoch bounds
+    (start, end) on the check-in time or None for the entire period. after
+    is a decoded cursor to continue from and limit caps the number of rows.
+    Rows are fetched batch_size at a time. Each row has id, username,
+    check_in, check_out, check_in_ts, work_date, has_auto_breaks,
+    gross_minutes (None while checked in) and billable_minutes.
+    """
+    cursor.execute(*report_rows_query(user_id, bounds, after, limit))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def report_totals(cursor, user_id=None, bounds=None):
+    """Return {'records', 'gross_minutes', 'billable_minutes'} for a report."""
+    where, params = _report_filter(user_id, bounds)
+    cursor.execute(f'''
+        SELECT COUNT(*), COALESCE(SUM({_GROSS_MINUTES}), 0), COALESCE(SUM(a.billable_minutes), 0)
+        FROM attendance a
+        JOIN users u ON a.user_id = u.id
+        {where}
+    ''', params)
+    records, gross_minutes, billable_minutes = cursor.fetchone()
+    return {'records': records, 'gross_minutes': gross_minutes, 'billable_minutes': billable_minutes}
+
+
+def report_totals_by_user(cursor, bounds=None):
+    """Return per-user totals for an all-users report, ordered by username.
+
+    Each row has user_id, username, records, gross_minutes and
+    billable_minutes; users without records in the period are left out.
+    """
+    where, params = _report_filter(None, bounds)
+    cursor.execute(f'''
+        SELECT a.user_id, u.username, COUNT(*) AS records,
+               COALESCE(SUM({_GROSS_MINUTES}), 0) AS gross_minutes,
+               COALESCE(SUM(a.billable_minutes), 0) AS billable_minutes
+        FROM attendance a
+        JOIN users u ON a.user_id = u.id
+        {where}
+        GROUP BY a.user_id
+        ORDER BY u.username COLLATE NOCASE
+    ''', params)
+    return cursor.fetchall()
+
+
+def _month_of(epoch):
+    return from_epoch(epoch).strftime('%Y-%m')
+
+
+def report_version(cursor, user_id=None, bounds=None):
+    """Return the report version of a user (None: all users) for bounds."""
+    if bounds is None:
+        return get_report_version(cursor, user_id)
+    return get_report_version(cursor, user_id, _month_of(bounds[0]), _month_of(bounds[1] - 1))
+
+
+def period_is_closed(bounds):
+    """Return True if bounds end before the current local month began."""
+    if bounds is None:
+        return False
+    year, month = today_local()[:7].split('-')
+    return bounds[1] <= month_bounds(year, month)[0]
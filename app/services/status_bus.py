@@ -0,0 +1,80 @@
+# Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
+# Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
+
+"""
+In-process publish/subscribe bus for attendance status changes.
+
+Every open dashboard tab subscribes for one user through the server-sent
+events stream. Write paths publish the user's new status after their commit;
+users nobody is watching cost a dictionary lookup. The bus only lives in
+this process, so with several worker processes a tab only hears directly
+about changes made through its own worker. For the rest, the stream compares
+the user's change version (user_versions) on every keepalive and re-sends
+the status when it has moved.
+"""
+
+import queue
+import threading
+
+
+class StatusBus:
+    """Fan out status payloads to the subscribers of a user."""
+
+    def __init__(self, max_subscribers=500, queue_size=16):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._stats = {'published': 0, 'delivered': 0, 'dropped': 0, 'rejected': 0}
+
+    def subscribe(self, user_id):
+        """Register a subscriber queue, or return None when the bus is full."""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            if sum(len(queues) for queues in self._subscribers.values()) >= self.max_subscribers:
+                self._stats['rejected'] += 1
+                return None
+            self._subscribers.setdefault(str(user_id), set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, user_id, subscriber):
+        with self._lock:
+            queues = self._subscribers.get(str(user_id))
+            if queues:
+                queues.discard(subscriber)
+                if not queues:
+                    del self._subscribers[str(user_id)]
+
+    def has_subscribers(self, user_id):
+        with self._lock:
+            return str(user_id) in self._subscribers
+
+    def publish(self, user_id, payload):
+        """Deliver a payload to every subscriber of a user without blocking.
+
+        A subscriber whose queue is full (a stalled client) misses the update;
+        it gets the current status again when it reconnects.
+        """
+        with self._lock:
+            queues = list(self._subscribers.get(str(user_id), ()))
+            self._stats['published'] += 1
+        delivered = dropped = 0
+        for subscriber in queues:
+            try:
+                subscriber.put_nowait(payload)
+                delivered += 1
+            except queue.Full:
+                dropped += 1
+        if queues:
+            with self._lock:
+                self._stats['delivered'] += delivered
+                self._stats['dropped'] += dropped
+
+    def stats(self):
+        """Return a snapshot of the bus statistics."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['subscribers'] = sum(len(queues) for queues in self._subscribers.values())
+            stats['watched_users'] = len(self._subscribers)
+        stats['max_subscribers'] = self.max_subscribers
+        return stats
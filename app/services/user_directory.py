@@ -0,0 +1,142 @@
+# Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
+# Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
+
+"""
+In-process user directory.
+
+Most pages need the same few facts about users: the id and username for
+dropdowns and links, the display name, role, status and department. The
+directory keeps them for every user in memory, sorted by username, and
+reloads them when the directory version (version_service) has changed.
+A case-insensitive sorted username index answers the prefix searches of
+the user pickers with a binary search.
+
+Every write to users that the directory shows calls
+bump_directory_version(cursor) inside its own transaction, so the new
+version commits together with the change and reaches every worker process
+with its next lookup. refresh_user_cache() in app.py only bumps it for
+changes made outside the app. A lookup costs one primary key read of the
+version.
+"""
+
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import islice, takewhile
+
+from app.services.version_service import get_directory_version
+
+
+class UserEntry(namedtuple('UserEntry', 'id username display_name first_name last_name '
+                                        'user_role account_status department is_admin')):
+    """A directory entry; also readable as entry['username'] like a database row."""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return super().__getitem__(key)
+
+
+class _Snapshot:
+    """The users of one directory version: entries in username order, by id and by username."""
+
+    def __init__(self, version, entries):
+        self.version = version
+        self.entries = entries
+        self.by_id = {entry.id: entry for entry in entries}
+        self.by_username = {entry.username: entry for entry in entries}
+        # Prefix index: casefolded usernames in sorted order, entries alongside
+        ordered = sorted(entries, key=lambda entry: (entry.username.casefold(), entry.username))
+        self.search_keys = [entry.username.casefold() for entry in ordered]
+        self.search_entries = ordered
+
+
+_EMPTY = _Snapshot(None, [])
+
+
+class UserDirectory:
+    """Version-checked in-memory copy of the user directory."""
+
+    def __init__(self):
+        self._snapshot = _EMPTY
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'loads': 0}
+
+    def snapshot(self, cursor):
+        """Return the current snapshot, reloading it if the version changed."""
+        version = get_directory_version(cursor)
+        snapshot = self._snapshot
+        if snapshot.version == version:
+            with self._lock:
+                self._stats['hits'] += 1
+            return snapshot
+        with self._lock:
+            # Another thread may have loaded it while this one waited
+            if self._snapshot.version == version:
+                self._stats['hits'] += 1
+                return self._snapshot
+            # The version was read before the rows: a change in between only
+            # causes one more reload, never a stale snapshot under a new version
+            self._snapshot = _Snapshot(version, self._load(cursor))
+            self._stats['loads'] += 1
+            return self._snapshot
+
+    @staticmethod
+    def _load(cursor):
+        cursor.execute('''
+            SELECT id, username, first_name, last_name,
+                   COALESCE(user_role, 'employee') AS user_role,
+                   COALESCE(account_status, 'active') AS account_status,
+                   department, COALESCE(is_admin, 0) AS is_admin
+            FROM users
+            ORDER BY username
+        ''')
+        entries = []
+        for row in cursor.fetchall():
+            if row['first_name'] and row['last_name']:
+                display_name = f"{row['first_name']} {row['last_name']}"
+            else:
+                display_name = row['username']
+            entries.append(UserEntry(row['id'], row['username'], display_name, row['first_name'],
+                                     row['last_name'], row['user_role'], row['account_status'],
+                                     row['department'], bool(row['is_admin'])))
+        return entries
+
+    def users(self, cursor):
+        """Return all users in username order."""
+        return self.snapshot(cursor).entries
+
+    def get(self, cursor, user_id):
+        """Return the entry of a user or None."""
+        return self.snapshot(cursor).by_id.get(user_id)
+
+    def find(self, cursor, username):
+        """Return the entry with this username or None."""
+        return self.snapshot(cursor).by_username.get(username)
+
+    def search(self, cursor, prefix, limit=20):
+        """Return up to limit users whose username starts with prefix, ignoring case."""
+        snapshot = self.snapshot(cursor)
+        key = prefix.casefold()
+        start = bisect_left(snapshot.search_keys, key)
+        matches = takewhile(lambda index: snapshot.search_keys[index].startswith(key),
+                            range(start, len(snapshot.search_keys)))
+        return [snapshot.search_entries[index] for index in islice(matches, limit)]
+
+    def username(self, cursor, user_id, default=None):
+        entry = self.get(cursor, user_id)
+        return entry.username if entry else default
+
+    def invalidate(self):
+        """Drop the local copy; the next lookup reloads it."""
+        with self._lock:
+            self._snapshot = _EMPTY
+
+    def stats(self):
+        """Return a snapshot of the directory statistics."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['users'] = len(self._snapshot.entries)
+            stats['version'] = self._snapshot.version
+        return stats
@@ -0,0 +1,330 @@
+# Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
+# Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
+
+"""
+User search and listing.
+
+users_fts is an FTS5 index over username, first and last name, employee id
+and department. It is an external-content table on users, kept in sync by
+triggers, so a search is an index lookup instead of five LIKE '%term%'
+scans over every user. Every word of the search term is a prefix query
+("mül" finds "Müller", diacritics are ignored); results are ranked with
+bm25, username matches weighing most. A purely numeric term also matches
+the user id exactly.
+
+list_users() is the one listing query behind the admin user searches: a page
+of users in a stable (sort key, id) order, continued with a keyset cursor,
+together with the total number of matches from the same statement.
+"""
+
+import re
+
+_FTS_COLUMNS = ('username', 'first_name', 'last_name', 'employee_id', 'department')
+# bm25 weights, in _FTS_COLUMNS order
+_FTS_WEIGHTS = '10.0, 5.0, 5.0, 3.0, 1.0'
+# Exact id matches rank before every text match
+_ID_MATCH_RANK = -1e9
+
+# Uniqueness check when an employee id is assigned
+EMPLOYEE_ID_SQL = 'SELECT id FROM users WHERE employee_id = ?'
+
+USER_PAGE_SIZE = 100
+USER_PAGE_MAX = 500
+
+# sort name -> (sort key expression, direction); ties are broken by u.id
+USER_SORTS = {
+    'username-asc': ('u.username', 'ASC'),
+    'username-desc': ('u.username', 'DESC'),
+    'id-asc': ('u.id', 'ASC'),
+    'id-desc': ('u.id', 'DESC'),
+    'relevance': ('m.rank', 'ASC'),
+}
+
+# Labels for the admin user lists
+USER_ROLE_DISPLAY = {
+    'employee': 'Mitarbeiter',
+    'supervisor': 'Vorgesetzter',
+    'hr': 'Personalwesen',
+    'admin': 'Administrator'
+}
+ACCOUNT_STATUS_DISPLAY = {
+    'active': 'Aktiv',
+    'inactive': 'Inaktiv',
+    'suspended': 'Gesperrt'
+}
+CONSENT_DISPLAY = {
+    'granted': 'Erteilt',
+    'declined': 'Verweigert',
+    'pending': 'Ausstehend',
+    'Unknown': 'Unbekannt'
+}
+
+
+def create_user_search_index(cursor):
+    """Create users_fts with its sync triggers and fill it from users.
+
+    Used by the benchmark at the end of this module on a bare users table;
+    migration 11 keeps its own frozen copy of the same DDL.
+    """
+    columns = ', '.join(_FTS_COLUMNS)
+    new_values = ', '.join(f'new.{column}' for column in _FTS_COLUMNS)
+    old_values = ', '.join(f'old.{column}' for column in _FTS_COLUMNS)
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            {columns},
+            content='users', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+            INSERT INTO users_fts (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+        END
+    ''')
+    # Only the indexed columns; last_login and password changes leave the index alone
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF {columns} ON users BEGIN
+            INSERT INTO users_fts (users_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO users_fts (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    ''')
+    cursor.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+
+
+def fts_match_query(term):
+    """Turn free text into an FTS5 query: every word as a quoted prefix, all required.
+
+    Returns None when the term has no searchable characters.
+    """
+    words = re.findall(r'\w+', term or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def user_matches(term):
+    """Return (sql, params) for a derived table (id, rank) of the users matching term.
+
+    Lower rank is a better match. Returns (None, []) if the term cannot match
+    anything; callers then return an empty result.
+    """
+    query = fts_match_query(term)
+    if query is None:
+        return None, []
+    sql = f'SELECT rowid AS id, bm25(users_fts, {_FTS_WEIGHTS}) AS rank FROM users_fts WHERE users_fts MATCH ?'
+    params = [query]
+    if term.strip().isdigit():
+        sql = f'''
+            SELECT id, MIN(rank) AS rank FROM (
+                {sql}
+                UNION ALL
+                SELECT id, {_ID_MATCH_RANK} FROM users WHERE id = ?
+            ) GROUP BY id
+        '''
+        params.append(int(term.strip()))
+    return sql, params
+
+
+def encode_user_cursor(row):
+    """Return the keyset cursor ('id:sort key') that continues after a list_users row."""
+    key = row['sort_key']
+    return f"{row['id']}:{key!r}" if isinstance(key, float) else f"{row['id']}:{key}"
+
+
+def _decode_user_cursor(sort, value):
+    """Parse a cursor from encode_user_cursor for sort; raises ValueError if malformed."""
+    user_id, separator, key = value.partition(':')
+    if not separator:
+        raise ValueError(f'Ungültiger Cursor: {value}')
+    column = USER_SORTS[sort][0]
+    if column == 'u.id':
+        key = int(key)
+    elif column == 'm.rank':
+        key = float(key)
+    return key, int(user_id)
+
+
+def normalize_user_sort(sort, term):
+    """Return a valid sort name; relevance only applies to searches."""
+    if not sort:
+        return 'relevance' if term else 'username-asc'
+    if sort not in USER_SORTS or (sort == 'relevance' and not term):
+        return 'username-asc'
+    return sort
+
+
+def _user_filters(term, role, status, department, consent):
+    """Return (source, conditions, params) of the users list_users selects.
+
+    Returns None when the search term cannot match anything.
+    """
+    if term:
+        match_sql, params = user_matches(term)
+        if match_sql is None:
+            return None
+        source = f'({match_sql}) m JOIN users u ON u.id = m.id'
+    else:
+        source, params = 'users u', []
+
+    conditions = []
+    if role:
+        conditions.append('u.user_role = ?')
+        params.append(role)
+    if status:
+        conditions.append('u.account_status = ?')
+        params.append(status)
+    if department:
+        conditions.append('u.department LIKE ?')
+        params.append(f'%{department}%')
+    if consent:
+        conditions.append("COALESCE(uc.consent_status, 'Unknown') = ?")
+        params.append(consent)
+    return source, conditions, params
+
+
+def user_page_query(term='', role='', status='', department='', consent='',
+                    sort='username-asc', after=None, limit=USER_PAGE_SIZE):
+    """Return (sql, params) of a list_users page, or (None, []) if nothing can match.
+
+    The inner query selects the filtered users with their total count; the
+    keyset condition and the LIMIT apply in the outer query, so the total
+    still counts the rows before the cursor. Raises ValueError for a
+    malformed cursor.
+    """
+    filters = _user_filters(term, role, status, department, consent)
+    if filters is None:
+        return None, []
+    source, conditions, params = filters
+    key, direction = USER_SORTS[sort]
+    keyset = ''
+    if after:
+        keyset = f"WHERE (sort_key, id) {'>' if direction == 'ASC' else '<'} (?, ?)"
+        params.extend(_decode_user_cursor(sort, after))
+    params.append(limit)
+    return f'''
+        SELECT * FROM (
+            SELECT u.id, u.username, u.first_name, u.last_name, u.employee_id,
+                   u.user_role, u.department, u.account_status, u.last_login,
+                   COALESCE(uc.consent_status, 'Unknown') AS consent_status,
+                   COALESCE(uc.consent_date, '') AS consent_date,
+                   {key} AS sort_key,
+                   COUNT(*) OVER () AS total
+            FROM {source}
+            LEFT JOIN current_consents uc ON u.id = uc.user_id
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        )
+        {keyset}
+        ORDER BY sort_key {direction}, id {direction}
+        LIMIT ?
+    ''', params
+
+
+def list_users(cursor, term='', role='', status='', department='', consent='',
+               sort='username-asc', after=None, limit=USER_PAGE_SIZE):
+    """Return (rows, total, next_cursor) for one page of the user list.
+
+    term is a search term for users_fts, the other filters match exactly
+    (department as a substring). sort is a USER_SORTS name (see
+    normalize_user_sort), after the next_cursor of the previous page and
+    limit the page size, capped at USER_PAGE_MAX. Rows have the user
+    columns, consent_status, consent_date and sort_key; total counts every
+    match, not only the rows after the cursor. next_cursor is None on the
+    last page. Raises ValueError for a malformed cursor and for a stale one
+    that no row follows any more.
+    """
+    limit = min(max(int(limit), 1), USER_PAGE_MAX)
+    sort = normalize_user_sort(sort, term)
+    # One row more than the page tells whether another page follows
+    sql, params = user_page_query(term, role, status, department, consent, sort, after, limit + 1)
+    if sql is None:
+        return [], 0, None
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    if not rows:
+        # next_cursor is only handed out when a row follows it
+        if after:
+            raise ValueError(f'Veralteter Cursor: {after}')
+        return [], 0, None
+    next_cursor = encode_user_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], rows[0]['total'], next_cursor
+
+
+def user_display(row):
+    """Return a list_users row as a dict with display_name and the display labels."""
+    user = dict(row)
+    user.pop('sort_key', None)
+    user.pop('total', None)
+    user['user_role'] = user['user_role'] or 'employee'
+    user['account_status'] = user['account_status'] or 'active'
+    if user['first_name'] and user['last_name']:
+        user['display_name'] = f"{user['first_name']} {user['last_name']}"
+    else:
+        user['display_name'] = user['username']
+    user['role_display'] = USER_ROLE_DISPLAY.get(user['user_role'], user['user_role'])
+    user['status_display'] = ACCOUNT_STATUS_DISPLAY.get(user['account_status'], user['account_status'])
+    user['consent_display'] = CONSENT_DISPLAY.get(user['consent_status'], user['consent_status'])
+    return user
+
+
+if __name__ == '__main__':
+    # Benchmark of LIKE '%term%' against the FTS index:
+    # python -m app.services.user_service [users ...]
+    import random
+    import sqlite3
+    import sys
+    import time
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000]
+    first_names = ['Anna', 'Ben', 'Clara', 'David', 'Elif', 'Finn', 'Greta', 'Hamza', 'Ida', 'Jonas', 'Jürgen', 'Lea']
+    last_names = ['Müller', 'Schmidt', 'Schneider', 'Fischer', 'Weber', 'Meyer', 'Wagner', 'Becker', 'Schulz',
+                  'Hoffmann', 'Koch', 'Richter', 'Yılmaz', 'Nowak', 'Kowalski', 'Popescu']
+    departments = ['Verwaltung', 'Holzwerkstatt', 'Metall', 'Küche', 'IT-Support', 'Lager', 'Garten']
+    like_sql = ('SELECT id FROM users WHERE username LIKE ? OR first_name LIKE ? OR last_name LIKE ? '
+                'OR employee_id LIKE ? OR department LIKE ?')
+
+    def timed(conn, sql, params, repeat=20):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            rows = conn.execute(sql, params).fetchall()
+        return (time.perf_counter() - started) / repeat * 1000, len(rows)
+
+    for size in sizes:
+        rng = random.Random(size)
+        conn = sqlite3.connect(':memory:')
+        conn.execute('''
+            CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT UNIQUE, first_name TEXT,
+                                last_name TEXT, employee_id TEXT, department TEXT)
+        ''')
+        create_user_search_index(conn.cursor())
+        rows = []
+        for number in range(1, size + 1):
+            first, last = rng.choice(first_names), rng.choice(last_names)
+            rows.append((f'{first}.{last}{number}'.lower(), first, last, f'BTZ-{number:06d}', rng.choice(departments)))
+        started = time.perf_counter()
+        conn.executemany('INSERT INTO users (username, first_name, last_name, employee_id, department) '
+                         'VALUES (?, ?, ?, ?, ?)', rows)
+        conn.commit()
+        insert_ms = (time.perf_counter() - started) * 1000
+
+        # Sync check: an update and a delete are visible to the index
+        conn.execute("UPDATE users SET last_name = 'Zzyzx' WHERE id = 1")
+        conn.execute('DELETE FROM users WHERE id = 2')
+        match_sql, match_params = user_matches('zzyzx')
+        assert [row[0] for row in conn.execute(match_sql, match_params)] == [1]
+        match_sql, match_params = user_matches(rows[1][0])
+        assert 2 not in [row[0] for row in conn.execute(match_sql, match_params)]
+
+        print(f'{size} users (insert with triggers: {insert_ms:.0f} ms)')
+        for term in ('mül', 'schmidt', 'anna weber', 'btz-0042', 'küche', '4711'):
+            like_ms, like_rows = timed(conn, like_sql, [f'%{term}%'] * 5)
+            match_sql, match_params = user_matches(term)
+            ranked_sql = f'SELECT u.id FROM ({match_sql}) m JOIN users u ON u.id = m.id ORDER BY m.rank LIMIT 50'
+            fts_ms, fts_rows = timed(conn, ranked_sql, match_params)
+            print(f'  {term!r:14} LIKE {like_ms:8.2f} ms ({like_rows:6} rows)   '
+                  f'FTS top 50 {fts_ms:7.2f} ms')
+        conn.close()
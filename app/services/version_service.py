@@ -0,0 +1,104 @@
+# Copyright © 2025 Michal Kopecki - BTZ Zeiterfassung
+# Alle Rechte vorbehalten. Unerlaubte Nutzung, Vervielfältigung oder Verbreitung ist untersagt.
+
+"""
+Per-user change versions for conditional GETs.
+
+user_versions holds a counter per user that every write to the user's
+attendance, breaks or settings increments inside its own transaction. The
+JSON endpoints derive their ETag from it, so an unchanged answer is detected
+with one primary key lookup instead of re-running the attendance queries.
+user_id 0 is the system settings row that applies to every user without
+own settings; user_id -1 counts changes to the user directory itself
+(users added, deleted, renamed or with a new role or status).
+
+report_versions counts changes per user and month ('YYYY-MM' of the
+work_date). Its rows are never deleted, so the sum over a user and a range
+of months grows with every change to a report over that range.
+"""
+
+SYSTEM_USER_ID = 0
+DIRECTORY_USER_ID = -1
+
+_BUMP = '''
+    INSERT INTO user_versions (user_id, version) VALUES (?, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1
+'''
+
+
+def bump_user_versions(cursor, user_ids):
+    """Mark the data of several users as changed; does not commit."""
+    cursor.executemany(_BUMP, [(user_id,) for user_id in set(user_ids)])
+
+
+def bump_user_version(cursor, user_id):
+    """Mark the data of a user as changed; does not commit."""
+    cursor.execute(_BUMP, (user_id,))
+
+
+def get_user_version(cursor, user_id):
+    """Return (user version, system version); 0 for never changed."""
+    cursor.execute('''
+        SELECT COALESCE(MAX(CASE WHEN user_id = ? THEN version END), 0),
+               COALESCE(MAX(CASE WHEN user_id = ? THEN version END), 0)
+        FROM user_versions WHERE user_id IN (?, ?)
+    ''', (user_id, SYSTEM_USER_ID, user_id, SYSTEM_USER_ID))
+    return tuple(cursor.fetchone())
+
+
+def forget_user_version(cursor, user_id):
+    """Drop the counter of a deleted user (user ids are never reused)."""
+    cursor.execute('DELETE FROM user_versions WHERE user_id = ?', (user_id,))
+
+
+def bump_directory_version(cursor):
+    """Mark the user directory as changed; does not commit."""
+    cursor.execute(_BUMP, (DIRECTORY_USER_ID,))
+
+
+def get_directory_version(cursor):
+    """Return the user directory version; 0 for never changed."""
+    cursor.execute('SELECT version FROM user_versions WHERE user_id = ?', (DIRECTORY_USER_ID,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+_BUMP_MONTH = '''
+    INSERT INTO report_versions (user_id, month, version) VALUES (?, ?, 1)
+    ON CONFLICT(user_id, month) DO UPDATE SET version = version + 1
+'''
+
+
+def bump_report_months(cursor, keys):
+    """Mark the months of (user_id, work_date) keys as changed; does not commit."""
+    cursor.executemany(_BUMP_MONTH, {(user_id, work_date[:7]) for user_id, work_date in keys if work_date})
+
+
+def bump_all_report_months(cursor, user_id):
+    """Mark every month of a user as changed (all attendance deleted)."""
+    cursor.execute('UPDATE report_versions SET version = version + 1 WHERE user_id = ?', (user_id,))
+
+
+def report_version_query(user_id=None, first_month=None, last_month=None):
+    """Return (sql, params) of the get_report_version query."""
+    conditions, params = [], []
+    if user_id is not None:
+        conditions.append('user_id = ?')
+        params.append(user_id)
+    if first_month is not None:
+        conditions.append('month >= ?')
+        params.append(first_month)
+    if last_month is not None:
+        conditions.append('month <= ?')
+        params.append(last_month)
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    return f'SELECT COALESCE(SUM(version), 0) FROM report_versions{where}', params
+
+
+def get_report_version(cursor, user_id=None, first_month=None, last_month=None):
+    """Return the change sum of a user (None: all users) over a month range.
+
+    Months are 'YYYY-MM'; None leaves that end of the range open.
+    """
+    cursor.execute(*report_version_query(user_id, first_month, last_month))
+    return cursor.fetchone()[0]
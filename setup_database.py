@@ -13,6 +13,11 @@ from datetime import datetime
 import pytz
 import bcrypt
 
+from app.migrations import run_migrations, get_schema_version
+from app.services.consent_service import sync_current_consents
+from app.services.attendance_service import rebuild_daily_summaries
+from app.services.break_service import recompute_breaks
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -162,6 +167,9 @@ def create_fresh_database():
                       VALUES (0, 1, 30, 1, 1)''')
         
         conn.commit()
+        
+        # Stamp the schema version and apply everything newer than the base tables
+        run_migrations(conn)
         print("✓ Fresh database created successfully")
         
     except Exception as e:
@@ -255,6 +263,15 @@ def update_existing_database():
         ensure_user_records(cursor)
         
         conn.commit()
+        
+        applied = run_migrations(conn)
+        if applied:
+            print(f"✓ Applied schema migrations: {', '.join(str(version) for version in applied)}")
+        
+        # Consent rows added above must also show up in the current status table
+        synced = sync_current_consents(conn.cursor())
+        conn.commit()
+        print(f"✓ Current consent status synced for {synced} users")
         print("✓ Database schema updated successfully")
         
     except Exception as e:
@@ -372,7 +389,8 @@ def verify_database():
         # Check all required tables exist
         required_tables = [
             'users', 'attendance', 'breaks', 'user_settings', 
-            'user_consents', 'data_deletion_log', 'deletion_requests', 'temp_passwords'
+            'user_consents', 'current_consents', 'daily_summaries', 'user_versions', 'report_versions', 'export_jobs', 'users_fts', 'data_deletion_log',
+            'deletion_requests', 'temp_passwords'
         ]
         
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
@@ -412,6 +430,7 @@ def verify_database():
         cursor.execute("SELECT COUNT(*) FROM user_consents")
         consents_count = cursor.fetchone()[0]
         
+        print(f"✓ Schema version: {get_schema_version(conn)}")
         print(f"✓ Database statistics:")
         print(f"  - Users: {user_count}")
         print(f"  - User settings: {settings_count}")
@@ -434,6 +453,65 @@ def verify_database():
     finally:
         conn.close()
 
+def rebuild_summaries():
+    """Rebuild the daily_summaries rollup from the attendance records"""
+    print("Rebuilding daily summaries...")
+    
+    if not database_exists():
+        print("✗ Database does not exist")
+        return False
+    
+    conn = sqlite3.connect(DATABASE)
+    
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row_count = rebuild_daily_summaries(conn.cursor())
+        conn.commit()
+        print(f"✓ Rebuilt {row_count} daily summaries")
+        return True
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"✗ Error rebuilding daily summaries: {e}")
+        return False
+    finally:
+        conn.close()
+
+def recompute_arbzg_breaks(user_ids=None, first_day=None, last_day=None, dry_run=False):
+    """Recompute ArbZG auto breaks and billable minutes in bounded chunks"""
+    print("Dry run: computing changes without writing..." if dry_run else "Recomputing ArbZG breaks...")
+    
+    if not database_exists():
+        print("✗ Database does not exist")
+        return False
+    
+    conn = sqlite3.connect(DATABASE)
+    conn.execute('PRAGMA busy_timeout = 5000')
+    
+    def report(totals):
+        print(f"  {totals['processed']}/{totals['total']} records, {totals['changed']} changed")
+    
+    try:
+        result = recompute_breaks(conn, user_ids=user_ids, first_day=first_day, last_day=last_day,
+                                  dry_run=dry_run, progress=report)
+        for change in result['diff']:
+            print(f"  #{change['attendance_id']} user {change['user_id']} {change['work_date']}: "
+                  f"billable {change['billable_minutes'][0]} -> {change['billable_minutes'][1]}, "
+                  f"auto break {change['auto_break_minutes'][0]} -> {change['auto_break_minutes'][1]} min, "
+                  f"start {change['auto_break_start'][0] or '-'} -> {change['auto_break_start'][1] or '-'}")
+        if result['changed'] > len(result['diff']):
+            print(f"  ... {result['changed'] - len(result['diff'])} more")
+        print(f"✓ {result['processed']} records checked, {result['changed']} "
+              f"{'would change' if dry_run else 'updated'} "
+              f"({result['breaks_added']} breaks added, {result['breaks_removed']} removed)")
+        return True
+        
+    except Exception as e:
+        print(f"✗ Error recomputing breaks: {e}")
+        return False
+    finally:
+        conn.close()
+
 def show_database_info():
     """Show detailed database information"""
     if not database_exists():
@@ -485,6 +563,13 @@ def main():
     parser.add_argument('--verify', action='store_true', help='Verify database structure')
     parser.add_argument('--info', action='store_true', help='Show database information')
     parser.add_argument('--backup', action='store_true', help='Create database backup')
+    parser.add_argument('--rebuild-summaries', action='store_true', help='Rebuild the daily_summaries rollup')
+    parser.add_argument('--recompute-breaks', action='store_true',
+                        help='Recompute ArbZG auto breaks and billable minutes')
+    parser.add_argument('--users', help='Comma separated user IDs for --recompute-breaks')
+    parser.add_argument('--from', dest='first_day', help='First work date (YYYY-MM-DD) for --recompute-breaks')
+    parser.add_argument('--to', dest='last_day', help='Last work date (YYYY-MM-DD) for --recompute-breaks')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what --recompute-breaks would change')
     
     args = parser.parse_args()
     
@@ -508,6 +593,15 @@ def main():
         success = verify_database()
         return 0 if success else 1
     
+    elif args.rebuild_summaries:
+        success = rebuild_summaries()
+        return 0 if success else 1
+    
+    elif args.recompute_breaks:
+        user_ids = [int(user_id) for user_id in args.users.split(',')] if args.users else None
+        success = recompute_arbzg_breaks(user_ids, args.first_day, args.last_day, args.dry_run)
+        return 0 if success else 1
+    
     elif args.info:
         show_database_info()
         return 0
@@ -1,74 +1,100 @@
 /**
  * Improved Check-in/Check-out functionality for BTZ Zeiterfassung
  */
-document.addEventListener('DOMContentLoaded', function() {
-    const userSelector = document.getElementById('user-selector');
-    const checkinUserIdField = document.getElementById('checkin-user-id');
-    const checkoutUserIdField = document.getElementById('checkout-user-id');
-    const checkinBtn = document.getElementById('checkin-btn');
-    const checkoutBtn = document.getElementById('checkout-btn');
-    const checkinCard = document.querySelector('.attendance-button-card.checkin');
-    const checkoutCard = document.querySelector('.attendance-button-card.checkout');
-    const checkinStatus = document.getElementById('checkin-status');
-    const checkoutStatus = document.getElementById('checkout-status');
-    
-    // Initialize user ID for forms
-    function updateUserIds() {
-        const selectedUserId = userSelector.value;
-        if (selectedUserId) {
-            checkinUserIdField.value = selectedUserId;
-            checkoutUserIdField.value = selectedUserId;
-            checkinBtn.disabled = false;
-            checkoutBtn.disabled = false;
-            
-            // Check attendance status for the selected user
-            checkAttendanceStatus(selectedUserId);
-        } else {
-            checkinBtn.disabled = true;
-            checkoutBtn.disabled = true;
-            updateStatusDisplay(false, false);
-        }
-    }
+
+/**
+ * Live attendance status of one user.
+ *
+ * Uses the server-sent events stream /stream/attendance_status, so an idle tab
+ * keeps one open connection instead of polling. If the browser has no
+ * EventSource or the server refuses the stream, it falls back to polling
+ * /get_attendance_status. The page has one connection and one listener:
+ * watch() replaces the listener, unwatch() drops it.
+ */
+window.AttendanceStatus = (function() {
+    const POLL_INTERVAL_MS = 30000;
+    let userId = null;
+    let source = null;
+    let pollTimer = null;
+    let listener = null;
     
-    // Update visual status indicators
-    function updateStatusDisplay(isCheckedIn, isCheckedOut) {
-        if (isCheckedIn) {
-            checkinCard.classList.add('active');
-            checkinStatus.innerHTML = '<i class="fas fa-check-circle"></i> Eingestempelt';
-            checkinStatus.classList.add('status-active');
-        } else {
-            checkinCard.classList.remove('active');
-            checkinStatus.innerHTML = 'Nicht eingestempelt';
-            checkinStatus.classList.remove('status-active');
-        }
-        
-        if (isCheckedOut) {
-            checkoutCard.classList.add('active');
-            checkoutStatus.innerHTML = '<i class="fas fa-check-circle"></i> Ausgestempelt';
-            checkoutStatus.classList.add('status-active');
-        } else {
-            checkoutCard.classList.remove('active');
-            checkoutStatus.innerHTML = 'Nicht ausgestempelt';
-            checkoutStatus.classList.remove('status-active');
-        }
+    function notify(data) {
+        if (listener) listener(data);
     }
     
-    // Check the user's attendance status
-    function checkAttendanceStatus(userId) {
-        // Simple fetch to an API endpoint that returns attendance status
-        fetch('/get_attendance_status?user_id=' + userId)
+    function poll() {
+        const requestedUserId = userId;
+        fetch('/get_attendance_status?user_id=' + requestedUserId)
             .then(response => response.json())
             .then(data => {
-                updateStatusDisplay(data.is_checked_in, data.is_checked_out);
+                if (requestedUserId === userId) notify(data);
             })
             .catch(error => {
                 console.error('Error checking attendance status:', error);
-                // Default to both inactive if we can't get the status
-                updateStatusDisplay(false, false);
+                if (requestedUserId === userId) notify({error: error.message});
             });
     }
     
-    // Add button press effect
+    function startPolling() {
+        poll();
+        pollTimer = setInterval(poll, POLL_INTERVAL_MS);
+    }
+    
+    function stop() {
+        if (source) {
+            source.close();
+            source = null;
+        }
+        if (pollTimer) {
+            clearInterval(pollTimer);
+            pollTimer = null;
+        }
+    }
+    
+    function connect() {
+        stop();
+        if (!userId) return;
+        
+        if (!window.EventSource) {
+            startPolling();
+            return;
+        }
+        
+        source = new EventSource('/stream/attendance_status?user_id=' + encodeURIComponent(userId));
+        source.onmessage = event => notify(JSON.parse(event.data));
+        source.onerror = () => {
+            // The browser reconnects by itself unless the server refused the stream
+            if (source && source.readyState === EventSource.CLOSED) {
+                source = null;
+                startPolling();
+            }
+        };
+    }
+    
+    return {
+        // Follow a user; newListener receives the status payloads
+        watch(newUserId, newListener) {
+            listener = newListener || null;
+            if (String(newUserId || '') !== String(userId || '')) {
+                userId = newUserId || null;
+                connect();
+            }
+        },
+        unwatch() {
+            userId = null;
+            listener = null;
+            stop();
+        },
+        // One-off refresh, e.g. after the tab was hidden for a long time
+        refresh() {
+            if (userId) poll();
+        }
+    };
+})();
+
+// The status display and the check-in/check-out forms are wired up by the
+// page itself (templates/index.html); this only adds the press effect.
+document.addEventListener('DOMContentLoaded', function() {
     function addButtonPressEffect(button) {
         button.addEventListener('mousedown', function() {
             this.style.transform = 'scale(0.97)';
@@ -83,35 +109,8 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
-    // For admin dropdown, listen for changes
-    if (userSelector.tagName === 'SELECT') {
-        userSelector.addEventListener('change', updateUserIds);
-    }
-    
-    // Add press effect to buttons
+    const checkinBtn = document.getElementById('checkin-btn');
+    const checkoutBtn = document.getElementById('checkout-btn');
     if (checkinBtn) addButtonPressEffect(checkinBtn);
     if (checkoutBtn) addButtonPressEffect(checkoutBtn);
-    
-    // Initial setup
-    updateUserIds();
-    
-    // Handle form submission
-    const checkinForm = checkinBtn.closest('form');
-    const checkoutForm = checkoutBtn.closest('form');
-    
-    if (checkinForm) {
-        checkinForm.addEventListener('submit', function(event) {
-            // You could add validation here if needed
-            checkinBtn.classList.add('submitting');
-            // Let the form submit normally
-        });
-    }
-    
-    if (checkoutForm) {
-        checkoutForm.addEventListener('submit', function(event) {
-            // You could add validation here if needed
-            checkoutBtn.classList.add('submitting');
-            // Let the form submit normally
-        });
-    }
 });
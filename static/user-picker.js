@@ -0,0 +1,166 @@
+// Typeahead user picker
+//
+// Replaces the <select> lists of all users. Markup:
+//
+//   <div class="user-picker" data-value="id|username" [data-required]>
+//       <input type="text" class="form-input user-picker-input" placeholder="..." autocomplete="off">
+//       <input type="hidden" id="..." name="..." value="">
+//       <ul class="user-picker-results" role="listbox" hidden></ul>
+//   </div>
+//
+// Suggestions come from /api/users/lookup (username prefix). Picking a user
+// stores its id or username in the hidden input, keeps the username in
+// data-username and fires 'change' on the hidden input, so existing
+// listeners keep working. Editing the text clears the selection again.
+(function() {
+    const LOOKUP_URL = '/api/users/lookup';
+    const DEBOUNCE_MS = 150;
+    const REQUIRED_MESSAGE = 'Bitte wählen Sie einen Benutzer aus der Liste.';
+
+    function setup(picker) {
+        const input = picker.querySelector('.user-picker-input');
+        const hidden = picker.querySelector('input[type="hidden"]');
+        const results = picker.querySelector('.user-picker-results');
+        const valueField = picker.dataset.value || 'id';
+        const required = picker.hasAttribute('data-required');
+        let users = [];
+        let active = -1;
+        let timer = null;
+        let requestNumber = 0;
+
+        function updateValidity() {
+            if (required) {
+                input.setCustomValidity(hidden.value ? '' : REQUIRED_MESSAGE);
+            }
+        }
+
+        function setValue(user) {
+            const value = user ? String(user[valueField]) : '';
+            input.value = user ? user.username : input.value;
+            hidden.dataset.username = user ? user.username : '';
+            updateValidity();
+            if (hidden.value !== value) {
+                hidden.value = value;
+                hidden.dispatchEvent(new Event('change', { bubbles: true }));
+            }
+        }
+
+        function close() {
+            results.hidden = true;
+            active = -1;
+        }
+
+        function highlight(index) {
+            const items = results.querySelectorAll('li[data-index]');
+            items.forEach(item => item.classList.toggle('active', Number(item.dataset.index) === index));
+            active = index;
+            if (items[index]) items[index].scrollIntoView({ block: 'nearest' });
+        }
+
+        function render() {
+            results.innerHTML = '';
+            if (!users.length) {
+                const empty = document.createElement('li');
+                empty.className = 'user-picker-empty';
+                empty.textContent = 'Keine Treffer';
+                results.appendChild(empty);
+            }
+            users.forEach((user, index) => {
+                const item = document.createElement('li');
+                item.dataset.index = index;
+                item.setAttribute('role', 'option');
+                const name = document.createElement('span');
+                name.textContent = user.username;
+                item.appendChild(name);
+                const details = [];
+                if (user.display_name !== user.username) details.push(user.display_name);
+                if (user.account_status !== 'active') details.push('inaktiv');
+                if (details.length) {
+                    const meta = document.createElement('span');
+                    meta.className = 'user-picker-meta';
+                    meta.textContent = details.join(' · ');
+                    item.appendChild(meta);
+                }
+                results.appendChild(item);
+            });
+            results.hidden = false;
+            active = -1;
+        }
+
+        function lookup() {
+            // Answers to superseded lookups are dropped
+            const number = ++requestNumber;
+            const params = new URLSearchParams({ q: input.value.trim() });
+            fetch(LOOKUP_URL + '?' + params.toString(), { credentials: 'same-origin' })
+                .then(response => response.json())
+                .then(data => {
+                    if (number !== requestNumber || document.activeElement !== input) return;
+                    users = data.success ? data.users : [];
+                    render();
+                })
+                .catch(error => console.error('Error looking up users:', error));
+        }
+
+        input.addEventListener('input', function() {
+            // Typing replaces the previous selection
+            if (hidden.value && input.value !== hidden.dataset.username) {
+                setValue(null);
+            }
+            clearTimeout(timer);
+            timer = setTimeout(lookup, DEBOUNCE_MS);
+        });
+
+        input.addEventListener('focus', lookup);
+        input.addEventListener('blur', close);
+
+        input.addEventListener('keydown', function(event) {
+            if (results.hidden) return;
+            if (event.key === 'ArrowDown') {
+                event.preventDefault();
+                highlight(Math.min(active + 1, users.length - 1));
+            } else if (event.key === 'ArrowUp') {
+                event.preventDefault();
+                highlight(Math.max(active - 1, 0));
+            } else if (event.key === 'Enter') {
+                const index = active >= 0 ? active : (users.length === 1 ? 0 : -1);
+                if (index >= 0) {
+                    event.preventDefault();
+                    setValue(users[index]);
+                    close();
+                }
+            } else if (event.key === 'Escape') {
+                close();
+            }
+        });
+
+        // mousedown keeps the focus in the input until the click selected a user
+        results.addEventListener('mousedown', event => event.preventDefault());
+        results.addEventListener('click', function(event) {
+            const item = event.target.closest('li[data-index]');
+            if (item) {
+                setValue(users[Number(item.dataset.index)]);
+                close();
+            }
+        });
+
+        picker.userPicker = {
+            reset: function() {
+                input.value = '';
+                setValue(null);
+            }
+        };
+        updateValidity();
+    }
+
+    window.UserPicker = {
+        // Clear the picker that owns the given hidden input
+        reset: function(hiddenInput) {
+            const picker = hiddenInput.closest('.user-picker');
+            if (picker && picker.userPicker) picker.userPicker.reset();
+        }
+    };
+
+    document.addEventListener('DOMContentLoaded', function() {
+        document.querySelectorAll('.user-picker').forEach(setup);
+    });
+})();
@@ -21,9 +21,6 @@ document.addEventListener('DOMContentLoaded', function() {
                     // Skip if no date is selected
                     if (!date) return;
                     
-                    // Get the year
-                    const year = date.getFullYear();
-                    
                     // Calculate the week number properly (ISO 8601 standard)
                     // Get the day of the week (0-6, where 0 is Sunday)
                     const dayOfWeek = date.getDay();
@@ -35,7 +32,10 @@ document.addEventListener('DOMContentLoaded', function() {
                       firstThursday.setMonth(0, 1 + ((4 - firstThursday.getDay()) + 7) % 7);
                     }
                     // Calculate week number: Number of weeks between target Thursday and first Thursday
-                    const weekNum = 1 + Math.ceil((thursday - firstThursday) / (7 * 86400000));
+                    const weekNum = 1 + Math.round((thursday - firstThursday) / (7 * 86400000));
+                    
+                    // The ISO year is the year of that Thursday (differs around New Year)
+                    const year = thursday.getFullYear();
                     
                     // Format ISO week string
                     const weekString = year + '-W' + (weekNum < 10 ? '0' + weekNum : weekNum);
@@ -81,12 +81,9 @@ document.addEventListener('DOMContentLoaded', function() {
                         const year = parseInt(yearStr);
                         const week = parseInt(weekStr);
                         
-                        // Calculate the ISO week number of this date
-                        const dateYear = date.getFullYear();
-                        const firstDayOfYear = new Date(dateYear, 0, 1);
-                        const firstThursday = new Date(dateYear, 0, 1 + ((11 - firstDayOfYear.getDay()) % 7));
-                        const dayDiff = (date - firstThursday) / 86400000;
-                        const dateWeek = Math.floor(dayDiff / 7) + 1;
+                        // ISO week and ISO year (year of the week's Thursday) of this date
+                        const dateWeek = $.datepicker.iso8601Week(date);
+                        const dateYear = new Date(date.getFullYear(), date.getMonth(), date.getDate() + 3 - (date.getDay() + 6) % 7).getFullYear();
                         
                         // If this date is in the selected week/year, highlight it
                         if (dateYear === year && dateWeek === week) {
@@ -0,0 +1,94 @@
+"""Shared fixtures: app.py on a fresh, fully migrated database per test."""
+
+import importlib.util
+import os
+import shutil
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from app.database import ConnectionPool  # noqa: E402
+from app.services.report_cache import ReportCache  # noqa: E402
+from app.services.user_directory import UserDirectory  # noqa: E402
+
+
+def _use_database(module, path):
+    module.DATABASE = path
+    module.db_pool = ConnectionPool(path)
+    # Process-wide caches must not outlive the database they were filled from
+    module.report_cache = ReportCache()
+    module.user_directory = UserDirectory()
+
+
+@pytest.fixture(scope='session')
+def _app_template(tmp_path_factory):
+    """Load app.py once and migrate a template database for the tests to copy."""
+    workdir = tmp_path_factory.mktemp('app')
+    cwd = os.getcwd()
+    # app.py logs to app.log in the working directory
+    os.chdir(workdir)
+    try:
+        # The app/ package shadows app.py, so load the file directly
+        spec = importlib.util.spec_from_file_location('btz_app', os.path.join(ROOT, 'app.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['btz_app'] = module
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    module.app.config['TESTING'] = True
+
+    template = str(workdir / 'template.db')
+    _use_database(module, template)
+    module.init_db()
+    module.db_pool.close_all()
+    with sqlite3.connect(template) as conn:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return module, template
+
+
+@pytest.fixture
+def app_module(_app_template, tmp_path):
+    """The app module, switched to a copy of the migrated template database."""
+    module, template = _app_template
+    path = str(tmp_path / 'attendance.db')
+    shutil.copyfile(template, path)
+    _use_database(module, path)
+    yield module
+    module.db_pool.close_all()
+
+
+@pytest.fixture
+def db(app_module):
+    """A separate connection to the test database."""
+    conn = sqlite3.connect(app_module.DATABASE)
+    conn.row_factory = sqlite3.Row
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def client(app_module):
+    """A test client logged in as the default admin."""
+    client = app_module.app.test_client()
+    response = client.post('/login', data={'username': 'admin', 'password': 'admin'})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def add_user(db):
+    """Insert a user and return its id; keyword arguments set further columns."""
+    def add(username, **columns):
+        columns = {'username': username, 'password': 'x', 'account_status': 'active', **columns}
+        cursor = db.execute(
+            f"INSERT INTO users ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            list(columns.values()),
+        )
+        db.commit()
+        return cursor.lastrowid
+    return add
@@ -0,0 +1,185 @@
+"""ArbZG break planning (app.services.break_service)."""
+
+import random
+
+import pytest
+
+from app.services.attendance_service import day_bounds, normalize_timestamp
+from app.services.break_service import (
+    ARBZG_POLICY, NO_BREAK_POLICY, Session, _lunch_window, load_policies, plan_break, plan_breaks,
+    policy_for_user, recompute_breaks,
+)
+
+
+def _session(work_date, check_in, check_out, break_minutes=0, excluded_minutes=0):
+    return Session(normalize_timestamp(f'{work_date} {check_in}')[0],
+                   normalize_timestamp(f'{work_date} {check_out}')[0],
+                   work_date, break_minutes, excluded_minutes)
+
+
+def _random_sessions(count):
+    rng = random.Random(4)
+    days = [f'2025-{month:02d}-{day:02d}' for month in range(1, 13) for day in (3, 14, 27)]
+    days += ['2025-03-30', '2025-10-26']  # DST changes
+    sessions = []
+    for _ in range(count):
+        work_date = rng.choice(days)
+        check_in_ts = day_bounds(work_date)[0] + rng.randrange(0, 16 * 3600)
+        check_out_ts = check_in_ts + rng.randrange(0, 13 * 3600)
+        break_minutes = rng.choice((0, 0, 0, 10, 15, 30, 50))
+        sessions.append(Session(check_in_ts, check_out_ts, work_date, break_minutes,
+                                rng.choice((0, break_minutes))))
+    return sessions
+
+
+@pytest.mark.parametrize('check_out, required', [
+    ('14:00', 0), ('14:01', 30), ('17:00', 30), ('17:01', 45), ('20:00', 45),
+])
+def test_required_break_follows_the_thresholds(check_out, required):
+    plan = plan_break(_session('2025-05-06', '08:00', check_out))
+    assert plan.break_minutes == required
+
+
+def test_recorded_breaks_count_towards_the_requirement():
+    plan = plan_break(_session('2025-05-06', '08:00', '17:30', break_minutes=30, excluded_minutes=30))
+    assert plan.break_minutes == 15
+    assert plan.billable_minutes == 9 * 60 + 30 - 30 - 15
+
+
+def test_enough_recorded_breaks_need_no_auto_break():
+    plan = plan_break(_session('2025-05-06', '08:00', '16:00', break_minutes=30))
+    assert plan == (8 * 60, 0, None, None, None)
+
+
+def test_break_starts_at_lunch_when_the_session_overlaps_it():
+    plan = plan_break(_session('2025-05-06', '08:00', '16:00'))
+    assert plan.start_ts == _lunch_window('2025-05-06', 11, 30, 14, 0)[0]
+    assert plan.end_ts - plan.start_ts == 30 * 60
+
+
+def test_break_outside_lunch_ends_at_check_out():
+    session = _session('2025-05-06', '14:30', '22:00')
+    plan = plan_break(session)
+    assert (plan.start_ts, plan.end_ts) == (session.check_out_ts - 30 * 60, session.check_out_ts)
+
+
+def test_break_overlapping_the_end_of_lunch_stays_inside_the_session():
+    session = _session('2025-05-06', '05:00', '11:40')
+    plan = plan_break(session)
+    assert (plan.start_ts, plan.end_ts) == (session.check_out_ts - 30 * 60, session.check_out_ts)
+
+
+def test_break_follows_the_lunch_window_of_the_policy():
+    policy = ARBZG_POLICY._replace(lunch_start_hour=12, lunch_start_minute=45)
+    plan = plan_break(_session('2025-05-06', '08:00', '16:00'), policy)
+    assert plan.start_ts == normalize_timestamp('2025-05-06 12:45')[0]
+
+
+def test_no_break_policy_only_computes_billable_minutes():
+    plan = plan_break(_session('2025-05-06', '08:00', '18:00', break_minutes=20, excluded_minutes=20),
+                      NO_BREAK_POLICY)
+    assert plan == (10 * 60 - 20, 0, None, None, None)
+
+
+def test_invariants_hold_for_random_sessions():
+    sessions = _random_sessions(20000)
+    for session, plan in zip(sessions, plan_breaks(sessions, ARBZG_POLICY)):
+        gross = (session.check_out_ts - session.check_in_ts) // 60
+        required = 45 if gross > 540 else 30 if gross > 360 else 0
+        assert plan.break_minutes == max(0, required - session.break_minutes), session
+        assert plan.billable_minutes == gross - session.excluded_break_minutes - plan.break_minutes
+        if plan.break_minutes:
+            assert session.check_in_ts <= plan.start_ts < plan.end_ts <= session.check_out_ts
+            assert plan.end_ts - plan.start_ts == plan.break_minutes * 60
+            lunch_start, _ = _lunch_window(session.work_date, 11, 30, 14, 0)
+            if session.check_in_ts <= lunch_start and lunch_start + plan.break_minutes * 60 <= session.check_out_ts:
+                assert plan.start_ts == lunch_start, session
+        else:
+            assert plan.start_ts is None
+
+
+def _insert_record(db, user_id, work_date, check_in, check_out, billable_minutes):
+    check_in_ts = normalize_timestamp(f'{work_date} {check_in}')[0]
+    check_out_ts = normalize_timestamp(f'{work_date} {check_out}')[0]
+    return db.execute('''
+        INSERT INTO attendance (user_id, check_in, check_out, check_in_ts, check_out_ts, work_date, billable_minutes)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, f'{work_date} {check_in}', f'{work_date} {check_out}', check_in_ts, check_out_ts,
+          work_date, billable_minutes)).lastrowid
+
+
+def test_recompute_dry_run_reports_without_writing(db, add_user):
+    user_id = add_user('recompute')
+    attendance_id = _insert_record(db, user_id, '2025-05-06', '08:00', '16:00', 480)
+    db.commit()
+
+    result = recompute_breaks(db, dry_run=True)
+
+    assert (result['processed'], result['changed'], result['breaks_added']) == (1, 1, 1)
+    assert result['diff'] == [{'attendance_id': attendance_id, 'user_id': user_id, 'work_date': '2025-05-06',
+                               'billable_minutes': [480, 450], 'auto_break_minutes': [0, 30],
+                               'auto_break_start': [None, '11:30']}]
+    assert db.execute('SELECT COUNT(*) FROM breaks').fetchone()[0] == 0
+
+
+def test_recompute_writes_auto_breaks_and_summaries(db, add_user):
+    user_id = add_user('recompute')
+    attendance_id = _insert_record(db, user_id, '2025-05-06', '08:00', '16:00', 480)
+    db.commit()
+
+    recompute_breaks(db)
+
+    assert tuple(db.execute('SELECT billable_minutes, has_auto_breaks FROM attendance WHERE id = ?',
+                            (attendance_id,)).fetchone()) == (450, 1)
+    assert tuple(db.execute('SELECT duration_minutes, is_auto_detected FROM breaks WHERE attendance_id = ?',
+                            (attendance_id,)).fetchone()) == (30, 1)
+    assert tuple(db.execute('SELECT billable_minutes, break_minutes FROM daily_summaries WHERE user_id = ?',
+                            (user_id,)).fetchone()) == (450, 30)
+    # A second run finds nothing left to change
+    assert recompute_breaks(db)['changed'] == 0
+
+
+def test_policy_reads_the_lunch_window_from_user_settings(db, add_user):
+    user_id = add_user('lunch')
+    db.execute('''
+        INSERT INTO user_settings (user_id, arbzg_breaks_enabled, lunch_period_start_hour, lunch_period_start_minute,
+                                   lunch_period_end_hour, lunch_period_end_minute)
+        VALUES (?, 1, 12, 15, 13, 45)
+    ''', (user_id,))
+    other_id = add_user('no-settings')
+    db.commit()
+
+    policy = policy_for_user(db.cursor(), user_id)
+    assert policy.tiers == ARBZG_POLICY.tiers
+    assert policy[1:] == (12, 15, 13, 45)
+    # Users without a settings row get the system row (column defaults 11:30-14:00)
+    assert policy_for_user(db.cursor(), other_id) == ARBZG_POLICY
+
+    policies, default_policy = load_policies(db.cursor())
+    assert policies[user_id] == policy
+    assert default_policy == ARBZG_POLICY
+
+
+def test_switched_off_breaks_keep_no_break_policy(db, add_user):
+    user_id = add_user('off')
+    db.execute('INSERT INTO user_settings (user_id, arbzg_breaks_enabled) VALUES (?, 0)', (user_id,))
+    db.commit()
+
+    assert policy_for_user(db.cursor(), user_id).tiers == ()
+
+
+def test_recompute_moves_auto_breaks_into_the_configured_lunch_window(db, add_user):
+    user_id = add_user('moved')
+    attendance_id = _insert_record(db, user_id, '2025-05-06', '08:00', '16:00', 450)
+    start_ts, end_ts = normalize_timestamp('2025-05-06 12:00')[0], normalize_timestamp('2025-05-06 12:30')[0]
+    db.execute('''
+        INSERT INTO breaks (attendance_id, start_time, end_time, start_ts, end_ts, duration_minutes,
+                            is_excluded_from_billing, is_auto_detected)
+        VALUES (?, '2025-05-06 12:00:00', '2025-05-06 12:30:00', ?, ?, 30, 1, 1)
+    ''', (attendance_id, start_ts, end_ts))
+    db.commit()
+
+    result = recompute_breaks(db, dry_run=True)
+
+    assert result['diff'][0]['billable_minutes'] == [450, 450]
+    assert result['diff'][0]['auto_break_start'] == ['12:00', '11:30']
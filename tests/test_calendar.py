@@ -0,0 +1,66 @@
+"""Period bounds around year boundaries and DST changes (Europe/Berlin)."""
+
+from datetime import date, timedelta
+
+import pytest
+
+from app.services.attendance_service import day_bounds, from_epoch, period_bounds, to_epoch
+
+
+def local(epoch):
+    return from_epoch(epoch).strftime('%Y-%m-%d %H:%M')
+
+
+@pytest.mark.parametrize('week, monday, next_monday', [
+    ('2020-W53', '2020-12-28', '2021-01-04'),
+    ('2021-W01', '2021-01-04', '2021-01-11'),
+    ('2025-W01', '2024-12-30', '2025-01-06'),
+    ('2026-W53', '2026-12-28', '2027-01-04'),
+    ('2027-W52', '2027-12-27', '2028-01-03'),
+])
+def test_iso_weeks_across_new_year(week, monday, next_monday):
+    start, end = period_bounds(week=week)
+    assert (local(start), local(end)) == (monday + ' 00:00', next_monday + ' 00:00')
+
+
+@pytest.mark.parametrize('week', ['2025-W53', '2025-W00', '2025-W1x'])
+def test_invalid_weeks_are_rejected(week):
+    with pytest.raises(ValueError):
+        period_bounds(week=week)
+
+
+def test_every_day_lies_in_its_iso_week():
+    day = date(2019, 12, 1)
+    while day < date(2031, 2, 1):
+        iso_year, iso_week, _ = day.isocalendar()
+        start, end = period_bounds(week=f'{iso_year}-W{iso_week:02d}')
+        day_start, day_end = day_bounds(day)
+        assert start <= day_start < day_end <= end, day
+        day += timedelta(days=1)
+
+
+def test_dst_changes_shorten_and_lengthen_days_and_weeks():
+    assert day_bounds('2025-03-30')[1] - day_bounds('2025-03-30')[0] == 23 * 3600
+    assert day_bounds('2025-10-26')[1] - day_bounds('2025-10-26')[0] == 25 * 3600
+    start, end = period_bounds(week='2025-W13')
+    assert end - start == 7 * 86400 - 3600
+    start, end = period_bounds(week='2025-W43')
+    assert end - start == 7 * 86400 + 3600
+    start, end = period_bounds(month='2025-03')
+    assert (local(start), local(end)) == ('2025-03-01 00:00', '2025-04-01 00:00')
+    assert end - start == 31 * 86400 - 3600
+
+
+def test_months_and_ranges_at_the_turn_of_the_year():
+    start, end = period_bounds(month='2024-12')
+    assert (local(start), local(end)) == ('2024-12-01 00:00', '2025-01-01 00:00')
+    assert period_bounds(first_day='2024-12-30', last_day='2025-01-05') == period_bounds(week='2025-W01')
+    assert period_bounds(first_day='2025-02-03') == day_bounds('2025-02-03')
+    assert period_bounds() is None
+
+
+def test_check_in_before_midnight_on_new_years_eve_belongs_to_the_old_year():
+    late = to_epoch('2024-12-31 23:59:59')
+    start, end = period_bounds(month='2024-12')
+    assert start <= late < end
+    assert not period_bounds(month='2025-01')[0] <= late
@@ -0,0 +1,51 @@
+"""Check-out: closing the open session and planning its ArbZG break."""
+
+import time
+
+import pytest
+
+from app.services.attendance_service import today_local
+
+
+@pytest.fixture
+def open_session(db, add_user):
+    """A user whose session of today began seven hours ago; returns (user_id, attendance_id)."""
+    user_id = add_user('spaet')
+    check_in_ts = int(time.time()) - 7 * 3600
+    attendance_id = db.execute('''
+        INSERT INTO attendance (user_id, check_in, check_in_ts, work_date) VALUES (?, 'x', ?, ?)
+    ''', (user_id, check_in_ts, today_local())).lastrowid
+    db.commit()
+    return user_id, attendance_id
+
+
+def test_checkout_adds_the_missing_break(client, db, open_session):
+    user_id, attendance_id = open_session
+
+    response = client.post('/checkout', data={'user_id': user_id})
+
+    assert response.status_code == 302
+    record = db.execute('SELECT check_out_ts, billable_minutes, has_auto_breaks FROM attendance WHERE id = ?',
+                        (attendance_id,)).fetchone()
+    assert record['check_out_ts'] is not None
+    assert record['has_auto_breaks'] == 1
+    assert record['billable_minutes'] in (7 * 60 - 30, 7 * 60 - 30 + 1)
+    assert db.execute('SELECT duration_minutes FROM breaks WHERE attendance_id = ?',
+                      (attendance_id,)).fetchone()[0] == 30
+
+
+def test_checkout_counts_recorded_breaks_and_honours_the_setting(client, db, open_session):
+    user_id, attendance_id = open_session
+    db.execute('INSERT INTO user_settings (user_id, arbzg_breaks_enabled) VALUES (?, 0)', (user_id,))
+    db.execute('''
+        INSERT INTO breaks (attendance_id, duration_minutes, is_excluded_from_billing) VALUES (?, 20, 1)
+    ''', (attendance_id,))
+    db.commit()
+
+    client.post('/checkout', data={'user_id': user_id})
+
+    record = db.execute('SELECT billable_minutes, has_auto_breaks FROM attendance WHERE id = ?',
+                        (attendance_id,)).fetchone()
+    assert record['has_auto_breaks'] == 0
+    assert record['billable_minutes'] in (7 * 60 - 20, 7 * 60 - 20 + 1)
+    assert db.execute('SELECT COUNT(*) FROM breaks WHERE attendance_id = ?', (attendance_id,)).fetchone()[0] == 1
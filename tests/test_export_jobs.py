@@ -0,0 +1,101 @@
+"""Background export jobs: queueing, the job states and the download."""
+
+import csv
+import io
+import os
+
+import pytest
+
+from app.services.export_jobs import ExportJobQueue
+from app.services.export_service import USER_EXPORT_HEADER, format_user_row, select_users_for_export
+
+
+@pytest.fixture
+def jobs(app_module, tmp_path, monkeypatch):
+    """The app's job queue without worker threads; tests run the jobs themselves."""
+    queue = ExportJobQueue(lambda: app_module.db_pool.connection(), str(tmp_path / 'spool'), workers=0,
+                           max_pending=2)
+    monkeypatch.setattr(app_module, 'export_jobs', queue)
+    return queue
+
+
+def run_next(queue):
+    job = queue._claim()
+    assert job is not None and job['status'] == 'running'
+    queue._run(job)
+    return job['id']
+
+
+def test_job_runs_through_its_states_and_downloads(client, db, add_user, jobs):
+    add_user('k.mueller', last_name='Müller, jun.')
+    cursor = db.cursor()
+    select_users_for_export(cursor)
+    output = io.StringIO()
+    csv.writer(output).writerows([USER_EXPORT_HEADER, *map(format_user_row, cursor.fetchall())])
+
+    response = client.post('/api/admin/exports', json={'kind': 'users_csv'})
+    assert response.status_code == 202
+    job_id = response.get_json()['job']['id']
+    assert client.get(f'/api/admin/exports/{job_id}').get_json()['status'] == 'queued'
+    assert client.get(f'/api/admin/exports/{job_id}/download').status_code == 404
+
+    job = jobs._claim()
+    assert client.get(f'/api/admin/exports/{job_id}').get_json()['status'] == 'running'
+    jobs._run(job)
+
+    finished = client.get(f'/api/admin/exports/{job_id}').get_json()
+    assert finished['status'] == 'finished'
+    assert finished['progress_done'] == finished['progress_total'] == 2
+    assert finished['file_name'].endswith('.csv') and finished['expires_ts'] > finished['finished_ts']
+    download = client.get(f'/api/admin/exports/{job_id}/download')
+    assert download.status_code == 200
+    assert download.headers['Content-Disposition'].startswith('attachment')
+    assert download.get_data(as_text=True) == output.getvalue()
+    assert [job['id'] for job in client.get('/api/admin/exports').get_json()['jobs']] == [job_id]
+    download.close()
+
+
+def test_user_data_job_writes_the_requested_format(client, add_user, jobs):
+    user_id = add_user('h.weber')
+    job_id = client.post('/api/admin/exports', json={'kind': 'user_data', 'user_id': user_id,
+                                                     'format': 'json'}).get_json()['job']['id']
+    run_next(jobs)
+
+    assert jobs.get(job_id)['file_name'].endswith('.json')
+    download = client.get(f'/api/admin/exports/{job_id}/download')
+    data = download.get_json(force=True)
+    assert (data['user']['username'], data['attendance']) == ('h.weber', [])
+    download.close()
+
+
+def test_failed_job_keeps_its_error_and_leaves_no_file(client, jobs):
+    job_id = client.post('/api/admin/exports', json={'kind': 'user_data', 'user_id': 999}).get_json()['job']['id']
+    run_next(jobs)
+
+    job = client.get(f'/api/admin/exports/{job_id}').get_json()
+    assert job['status'] == 'failed'
+    assert '999' in job['error']
+    assert client.get(f'/api/admin/exports/{job_id}/download').status_code == 404
+    assert os.listdir(jobs.spool_dir) == []
+
+
+def test_expired_job_file_is_removed(client, db, jobs):
+    job_id = client.post('/api/admin/exports', json={'kind': 'users_csv'}).get_json()['job']['id']
+    run_next(jobs)
+    path = jobs.file_path(jobs.get(job_id))
+    assert os.path.exists(path)
+
+    db.execute('UPDATE export_jobs SET expires_ts = 0 WHERE id = ?', (job_id,))
+    db.commit()
+
+    assert jobs.sweep() == 1
+    assert jobs.get(job_id)['status'] == 'expired'
+    assert not os.path.exists(path)
+    assert client.get(f'/api/admin/exports/{job_id}/download').status_code == 404
+
+
+def test_queue_rejects_unknown_kinds_and_overflow(client, jobs):
+    assert client.post('/api/admin/exports', json={'kind': 'nonsense'}).status_code == 400
+    for _ in range(2):
+        assert client.post('/api/admin/exports', json={'kind': 'users_csv'}).status_code == 202
+    assert client.post('/api/admin/exports', json={'kind': 'users_csv'}).status_code == 429
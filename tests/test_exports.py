@@ -0,0 +1,131 @@
+"""Streamed CSV and JSON exports against their non-streamed content."""
+
+import csv
+import io
+
+import pytest
+
+from app.services.export_service import (
+    USER_EXPORT_HEADER, csv_stream, format_user_row, iter_batches, select_user_attendance_for_export,
+    select_user_for_export, select_users_for_export, user_export_csv, user_export_json,
+)
+
+
+def csv_text(rows):
+    """The CSV of rows written in one go, as the exports did before streaming."""
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue()
+
+
+@pytest.fixture
+def awkward_users(add_user):
+    """Users whose values need CSV quoting."""
+    return [
+        add_user('k.mueller', first_name='Jürgen', last_name='Müller, jun.', department='Küche "Süd"'),
+        add_user('z.nowak', first_name='Zofia', last_name='Nowak', department='Lager\nNord'),
+    ]
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 500])
+def test_csv_stream_matches_the_csv_module(db, awkward_users, batch_size):
+    rows = db.execute('SELECT username, first_name, last_name, department FROM users ORDER BY id').fetchall()
+    cursor = db.execute('SELECT username, first_name, last_name, department FROM users ORDER BY id')
+
+    chunks = list(csv_stream(['a', 'b', 'c', 'd'], iter_batches(cursor, batch_size)))
+
+    assert chunks[0] == 'a,b,c,d\r\n'
+    assert ''.join(chunks) == csv_text([['a', 'b', 'c', 'd'], *map(tuple, rows)])
+    assert len(chunks) == 1 + -(-len(rows) // batch_size)
+
+
+def test_export_users_streams_the_full_csv(client, db, awkward_users):
+    cursor = db.cursor()
+    select_users_for_export(cursor)
+    expected = csv_text([USER_EXPORT_HEADER, *map(format_user_row, cursor.fetchall())])
+
+    response = client.get('/export_users')
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+    assert response.headers['Content-Disposition'].startswith('attachment; filename=benutzer_export_')
+    body = response.get_data(as_text=True)
+    assert body == expected
+    parsed = list(csv.reader(io.StringIO(body)))
+    assert ['Müller, jun.', 'Küche "Süd"'] == [parsed[2][3], parsed[2][6]]
+    assert parsed[3][6] == 'Lager\nNord'
+
+
+@pytest.fixture
+def history(db, add_user):
+    """A user with a record holding two breaks (one automatic) and a record without breaks."""
+    user_id = add_user('h.weber', first_name='Hanna', last_name='Weber', employee_id='BTZ-7')
+    first = db.execute('''
+        INSERT INTO attendance (user_id, check_in, check_out, check_in_ts, check_out_ts, work_date,
+                                billable_minutes, has_auto_breaks)
+        VALUES (?, '2025-01-02 08:00:00', '2025-01-02 16:00:00', 1735801200, 1735830000, '2025-01-02', 435, 1)
+    ''', (user_id,)).lastrowid
+    db.executemany('''
+        INSERT INTO breaks (attendance_id, start_time, end_time, start_ts, end_ts, duration_minutes,
+                            is_auto_detected, is_excluded_from_billing, description)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)
+    ''', [
+        (first, '2025-01-02 12:00:00', '2025-01-02 12:30:00', 1735815600, 1735817400, 30, 1, 'ArbZG, "auto"'),
+        (first, '2025-01-02 10:00:00', '2025-01-02 10:15:00', 1735808400, 1735809300, 15, 0, None),
+    ])
+    second = db.execute('''
+        INSERT INTO attendance (user_id, check_in, check_in_ts, work_date, has_auto_breaks)
+        VALUES (?, '2025-01-03 09:00:00', 1735891200, '2025-01-03', 0)
+    ''', (user_id,)).lastrowid
+    db.commit()
+    return user_id, first, second
+
+
+def test_user_data_csv_lists_records_and_breaks(client, history):
+    user_id, _, _ = history
+
+    response = client.get(f'/export_user_data/{user_id}')
+
+    assert response.status_code == 200
+    assert response.is_streamed
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == ['=== BENUTZERDATEN ===']
+    assert ['Benutzername', 'h.weber'] in rows and ['Letzter Login', 'Nie'] in rows
+    attendance = rows[rows.index(['=== ANWESENHEITSDATEN ===']) + 1:]
+    assert attendance == [
+        ['Typ', 'Datum', 'Beginn', 'Ende', 'Dauer (Min)', 'Abrechenbar (Min)',
+         'Automatisch', 'Von Abrechnung ausgenommen', 'Beschreibung'],
+        ['Anwesenheit', '2025-01-03', '2025-01-03 09:00:00', '', '', '', 'Nein', '', ''],
+        ['Anwesenheit', '2025-01-02', '2025-01-02 08:00:00', '2025-01-02 16:00:00', '480', '435', 'Ja', '', ''],
+        ['Pause', '2025-01-02', '2025-01-02 10:00:00', '2025-01-02 10:15:00', '15', '', 'Nein', 'Ja', ''],
+        ['Pause', '2025-01-02', '2025-01-02 12:00:00', '2025-01-02 12:30:00', '30', '', 'Ja', 'Ja', 'ArbZG, "auto"'],
+    ]
+
+
+def test_user_data_json_nests_the_breaks(client, history):
+    user_id, first, second = history
+
+    data = client.get(f'/export_user_data/{user_id}?format=json').get_json(force=True)
+
+    assert data['user']['username'] == 'h.weber' and data['user']['is_admin'] is False
+    assert [record['id'] for record in data['attendance']] == [second, first]
+    assert data['attendance'][0]['breaks'] == []
+    assert data['attendance'][0]['gross_minutes'] is None
+    breaks = data['attendance'][1]['breaks']
+    assert [(b['start_time'][11:16], b['duration_minutes'], b['is_auto_detected']) for b in breaks] == [
+        ('10:00', 15, False), ('12:00', 30, True)]
+
+
+@pytest.mark.parametrize('export', [user_export_csv, user_export_json])
+def test_user_data_does_not_depend_on_the_batch_size(db, history, export):
+    user_id, _, _ = history
+    user = select_user_for_export(db.cursor(), user_id)
+
+    def streamed(batch_size):
+        cursor = db.cursor()
+        select_user_attendance_for_export(cursor, user_id)
+        return ''.join(export(user, iter_batches(cursor, batch_size)))
+
+    # With one joined row per batch a record spans several batches
+    assert streamed(1) == streamed(2) == streamed(500)
@@ -0,0 +1,154 @@
+"""JSON endpoints: single-statement answers and ETag revalidation."""
+
+import json
+
+import pytest
+
+from app.services.attendance_service import today_local
+
+
+@pytest.fixture
+def statements(app_module, monkeypatch):
+    """The SQL the app runs on connections opened from now on."""
+    executed = []
+    connect = app_module.db_pool._connect
+
+    def traced_connect():
+        conn = connect()
+        conn.set_trace_callback(executed.append)
+        return conn
+
+    monkeypatch.setattr(app_module.db_pool, '_connect', traced_connect)
+    # Connections opened before the patch (e.g. by the login) are not traced
+    app_module.db_pool.close_all()
+    return executed
+
+
+@pytest.fixture
+def workday(db, add_user):
+    """A user with two records of today and one break; returns (user_id, attendance_ids)."""
+    user_id = add_user('frueh')
+    day = today_local()
+    ids = [
+        db.execute('''
+            INSERT INTO attendance (user_id, check_in, check_in_ts, work_date) VALUES (?, 'x', ?, ?)
+        ''', (user_id, check_in_ts, day)).lastrowid
+        for check_in_ts in (1000, 2000)
+    ]
+    db.execute('INSERT INTO breaks (attendance_id, duration_minutes) VALUES (?, 15)', (ids[0],))
+    db.commit()
+    return user_id, ids
+
+
+def _data_statements(executed):
+    # Everything except the ETag lookup of versioned_json and connection setup
+    return [sql for sql in executed if 'attendance' in sql and 'user_versions' not in sql]
+
+
+def test_today_attendance_is_one_statement(client, statements, workday):
+    user_id, ids = workday
+    statements.clear()
+
+    response = client.get(f'/get_today_attendance/{user_id}')
+
+    assert response.status_code == 200
+    assert len(_data_statements(statements)) == 1
+    assert [record['id'] for record in response.get_json()] == ids
+
+
+@pytest.mark.parametrize('query', ['ids={0},{1}', 'start_date={day}&end_date={day}'])
+def test_breaks_batch_is_one_statement(client, statements, workday, query):
+    user_id, ids = workday
+    statements.clear()
+
+    response = client.get('/get_breaks_batch?' + query.format(*ids, day=today_local()))
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert len(_data_statements(statements)) == 1
+    data = json.loads(response.data)
+    assert data['success'] is True
+    assert data['truncated'] is False
+    assert sorted(data['records']) == sorted(str(attendance_id) for attendance_id in ids)
+    assert data['records'][str(ids[0])]['total_count'] == 1
+    assert data['records'][str(ids[1])]['breaks'] == []
+
+
+def test_breaks_batch_reports_truncation(app_module, client, workday, monkeypatch):
+    user_id, ids = workday
+    monkeypatch.setattr(app_module, 'BREAKS_BATCH_LIMIT', 1)
+    day = today_local()
+
+    data = client.get(f'/get_breaks_batch?start_date={day}&end_date={day}&user_id={user_id}').get_json()
+
+    assert data['truncated'] is True
+    assert list(data['records']) == [str(ids[0])]
+
+
+def test_breaks_batch_at_the_limit_is_not_truncated(app_module, client, workday, monkeypatch):
+    user_id, ids = workday
+    monkeypatch.setattr(app_module, 'BREAKS_BATCH_LIMIT', 2)
+
+    data = client.get(f'/get_breaks_batch?ids={ids[0]},{ids[1]}').get_json()
+
+    assert data['truncated'] is False
+    assert sorted(data['records']) == sorted(str(attendance_id) for attendance_id in ids)
+
+
+def test_breaks_batch_filters_by_user(client, workday, add_user):
+    day = today_local()
+    other = add_user('spaet')
+
+    data = client.get(f'/get_breaks_batch?start_date={day}&end_date={day}&user_id={other}').get_json()
+
+    assert data == {'success': True, 'truncated': False, 'records': {}}
+
+
+def test_breaks_batch_needs_ids_or_a_period(client):
+    assert client.get('/get_breaks_batch').status_code == 400
+    assert client.get('/get_breaks_batch?ids=1,x').status_code == 400
+
+
+@pytest.fixture
+def admin_record(db):
+    """A closed record of the admin (user 1); returns its id."""
+    attendance_id = db.execute('''
+        INSERT INTO attendance (user_id, check_in, check_out, check_in_ts, check_out_ts, work_date)
+        VALUES (1, '2025-01-02 08:00:00', '2025-01-02 12:00:00', 1735801200, 1735815600, '2025-01-02')
+    ''').lastrowid
+    db.commit()
+    return attendance_id
+
+
+def _check_in(client):
+    assert client.post('/checkin', data={'user_id': 1}).status_code == 302
+
+
+def _update_settings(client):
+    response = client.post('/update_user_settings', data={'auto_break_threshold': '45', 'exclude_breaks': 'on'})
+    assert response.status_code == 302
+
+
+@pytest.mark.parametrize('url, write', [
+    ('/get_attendance_status?user_id=1', _check_in),
+    ('/get_today_attendance/1', _check_in),
+    ('/get_user_settings', _update_settings),
+    ('/get_breaks/{attendance_id}', _check_in),
+])
+def test_etag_answers_304_until_a_write(client, admin_record, url, write):
+    url = url.format(attendance_id=admin_record)
+    first = client.get(url)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    unchanged = client.get(url, headers={'If-None-Match': etag})
+    assert unchanged.status_code == 304
+    assert unchanged.data == b''
+    assert unchanged.headers['ETag'] == etag
+
+    write(client)
+
+    changed = client.get(url, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.data
+    assert changed.headers['ETag'] != etag
@@ -0,0 +1,36 @@
+"""Every hot query runs on an index after all migrations."""
+
+import pytest
+
+from app.query_plans import HOT_QUERIES, check_query_plans
+
+
+def test_hot_queries_use_an_index(db):
+    assert check_query_plans(db) == {}
+
+
+@pytest.mark.parametrize('name', sorted(HOT_QUERIES))
+def test_hot_query_runs_with_its_sample_parameters(db, name):
+    sql, params = HOT_QUERIES[name]
+    db.execute(sql, params).fetchall()
+
+
+def test_table_scan_is_reported(db):
+    queries = {'scan': ('SELECT * FROM attendance WHERE billable_minutes > ?', (0,))}
+    assert list(check_query_plans(db, queries)) == ['scan']
+
+
+def test_scan_of_a_subquery_result_is_not_a_table_scan(db):
+    queries = {
+        'indexed': ('SELECT * FROM (SELECT * FROM attendance WHERE user_id = ? ORDER BY check_in_ts LIMIT 5) a', (1,)),
+        'unindexed': ('SELECT * FROM (SELECT * FROM attendance ORDER BY billable_minutes LIMIT 5) a', ()),
+    }
+    assert list(check_query_plans(db, queries)) == ['unindexed']
+
+
+def test_fts_match_is_not_a_table_scan(db):
+    queries = {
+        'match': ("SELECT rowid FROM users_fts WHERE users_fts MATCH ?", ('"adm"*',)),
+        'scan': ('SELECT rowid FROM users_fts', ()),
+    }
+    assert list(check_query_plans(db, queries)) == ['scan']
@@ -0,0 +1,54 @@
+"""Server-sent events stream of the attendance status."""
+
+import json
+import time
+
+from app.services.attendance_service import today_local
+from app.services.status_bus import StatusBus
+from app.services.version_service import bump_user_version
+
+
+def test_stream_requires_a_numeric_user_id(client):
+    assert client.get('/stream/attendance_status').status_code == 400
+    assert client.get('/stream/attendance_status?user_id=abc').status_code == 400
+
+
+def test_stream_sends_the_current_status_and_unsubscribes_on_close(app_module, client):
+    response = client.get('/stream/attendance_status?user_id=1')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+
+    chunks = iter(response.response)
+    assert next(chunks) == b'retry: 5000\n'
+    status = json.loads(next(chunks).decode()[len('data: '):])
+    assert status['is_checked_in'] is False
+    assert app_module.status_bus.stats()['subscribers'] == 1
+
+    response.close()
+    assert app_module.status_bus.stats()['subscribers'] == 0
+
+
+def test_streams_beyond_the_cap_are_refused(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'status_bus', StatusBus(max_subscribers=0))
+    assert client.get('/stream/attendance_status?user_id=1').status_code == 503
+
+
+def test_keepalive_resends_the_status_after_a_write_elsewhere(app_module, client, db, monkeypatch):
+    monkeypatch.setattr(app_module, 'STATUS_STREAM_KEEPALIVE_SECONDS', 0.01)
+    response = client.get('/stream/attendance_status?user_id=1')
+    chunks = iter(response.response)
+    next(chunks)
+    assert json.loads(next(chunks).decode()[len('data: '):])['is_checked_in'] is False
+    assert next(chunks) == b': keepalive\n\n'
+
+    # A check-in through another worker: the database changes, this bus hears nothing
+    db.execute('''
+        INSERT INTO attendance (user_id, check_in, check_in_ts, work_date) VALUES (1, 'x', ?, ?)
+    ''', (int(time.time()), today_local()))
+    bump_user_version(db.cursor(), 1)
+    db.commit()
+
+    status = json.loads(next(chunks).decode()[len('data: '):])
+    assert status['is_checked_in'] is True
+    assert next(chunks) == b': keepalive\n\n'
+    response.close()
@@ -0,0 +1,44 @@
+"""The printable user datasheet."""
+
+from app.services.attendance_service import normalize_timestamp, rebuild_daily_summaries
+
+
+def test_datasheet_renders_credentials_and_statistics(client, db, add_user):
+    user_id = add_user('mmueller')
+    db.execute('INSERT INTO temp_passwords (user_id, temp_password) VALUES (?, ?)', (user_id, 'Xy12ab34'))
+    for check_in, check_out, billable in (('2025-03-03 08:00:00', '2025-03-03 16:30:00', 480),
+                                          ('2025-03-04 09:15:00', '2025-03-04 12:15:00', 180)):
+        check_in_ts, work_date = normalize_timestamp(check_in)
+        check_out_ts, _ = normalize_timestamp(check_out)
+        db.execute('''
+            INSERT INTO attendance (user_id, check_in, check_out, check_in_ts, check_out_ts, work_date, billable_minutes)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, check_in, check_out, check_in_ts, check_out_ts, work_date, billable))
+    attendance_id = db.execute('SELECT MIN(id) FROM attendance').fetchone()[0]
+    db.execute('INSERT INTO breaks (attendance_id, duration_minutes) VALUES (?, 30)', (attendance_id,))
+    rebuild_daily_summaries(db.cursor())
+    db.commit()
+
+    response = client.get(f'/user_datasheet/{user_id}')
+
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert 'mmueller' in page
+    assert 'Xy12ab34' in page
+    assert 'http://localhost' in page
+    assert '<td>11:30 Std.</td>' in page    # worked
+    assert '<td>11:00 Std.</td>' in page    # billable
+    assert '<td>0:30 Std.</td>' in page     # breaks
+    assert '<td>03.03.2025 08:00</td>' in page
+    assert '<td>04.03.2025 12:15</td>' in page
+
+
+def test_datasheet_of_user_without_records(client, add_user):
+    user_id = add_user('neu')
+
+    response = client.get(f'/user_datasheet/{user_id}')
+
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert 'Nicht mehr verfügbar' in page
+    assert '<td>0:00 Std.</td>' in page
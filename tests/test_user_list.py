@@ -0,0 +1,58 @@
+"""list_users: keyset pages and their totals."""
+
+import pytest
+
+from app.services.user_service import list_users
+
+
+@pytest.fixture
+def staff(add_user):
+    """25 users besides the admin; every fifth one is inactive."""
+    return [add_user(f'user{number:02d}', account_status='inactive' if number % 5 == 0 else 'active')
+            for number in range(25)]
+
+
+def pages(db, **filters):
+    after, seen, totals = None, [], set()
+    while True:
+        rows, total, after = list_users(db.cursor(), after=after, limit=10, **filters)
+        seen.extend(row['username'] for row in rows)
+        totals.add(total)
+        if after is None:
+            return seen, totals
+
+
+@pytest.mark.parametrize('sort', ['username-asc', 'username-desc', 'id-asc', 'id-desc'])
+def test_pages_return_every_user_once(db, staff, sort):
+    seen, totals = pages(db, sort=sort)
+
+    assert sorted(seen) == sorted(['admin'] + [f'user{number:02d}' for number in range(25)])
+    assert len(seen) == len(set(seen))
+    assert totals == {26}
+
+
+def test_totals_count_the_filtered_users(db, staff):
+    seen, totals = pages(db, status='inactive')
+
+    assert seen == ['user00', 'user05', 'user10', 'user15', 'user20']
+    assert totals == {5}
+
+
+def test_search_pages_in_relevance_order(db, staff):
+    seen, totals = pages(db, term='user1', sort='relevance')
+
+    assert sorted(seen) == [f'user{number}' for number in range(10, 20)]
+    assert totals == {10}
+
+
+def test_stale_cursor_is_rejected(db, staff):
+    with pytest.raises(ValueError):
+        list_users(db.cursor(), after=f'{staff[-1]}:zzz')
+
+
+def test_api_rejects_malformed_and_stale_cursors(client, staff):
+    assert client.get('/api/user_management/users?after=kaputt').status_code == 400
+    assert client.get(f'/api/user_management/users?after={staff[-1]}:zzz').status_code == 400
+
+    data = client.get('/api/user_management/users?status=inactive').get_json()
+    assert (data['count'], data['total'], data['next_cursor']) == (5, 5, None)
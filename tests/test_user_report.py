@@ -0,0 +1,50 @@
+"""The report page: period selection and the period it renders for."""
+
+import pytest
+
+from app.services.attendance_service import to_epoch
+from app.services.version_service import bump_report_months
+
+AJAX = {'X-Requested-With': 'XMLHttpRequest'}
+
+
+@pytest.fixture
+def two_months(db, add_user):
+    """A user with one record in January and one in February 2025."""
+    user_id = add_user('berta')
+    for day in ('2025-01-15', '2025-02-15'):
+        check_in_ts = to_epoch(f'{day} 08:00:00')
+        db.execute('''
+            INSERT INTO attendance (user_id, check_in, check_out, check_in_ts, check_out_ts, work_date)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, f'{day} 08:00:00', f'{day} 12:00:00', check_in_ts, check_in_ts + 4 * 3600, day))
+        bump_report_months(db.cursor(), [(user_id, day)])
+    db.commit()
+    return user_id
+
+
+def test_month_report_renders_its_period(client, two_months):
+    page = client.get('/user_report/berta?month=2025-01', headers=AJAX).get_data(as_text=True)
+
+    assert 'data-period="month" data-period-value="2025-01"' in page
+    assert '<td>2025-01-15</td>' in page
+    assert '<td>2025-02-15</td>' not in page
+
+
+def test_entire_period_overrides_a_leftover_month(client, two_months):
+    page = client.get('/user_report/berta?month=2025-01&entire_period=1', headers=AJAX).get_data(as_text=True)
+
+    assert 'data-period="all" data-period-value=""' in page
+    assert '<td>2025-01-15</td>' in page and '<td>2025-02-15</td>' in page
+
+
+def test_renaming_a_user_refreshes_cached_reports(client, two_months):
+    user_id = two_months
+    assert '<strong>berta</strong>' in client.get('/user_report/?month=2025-01', headers=AJAX).get_data(as_text=True)
+
+    response = client.post(f'/edit_user/{user_id}', json={'username': 'berta.neu'}, headers=AJAX)
+    assert response.get_json()['success'] is True
+
+    page = client.get('/user_report/?month=2025-01', headers=AJAX).get_data(as_text=True)
+    assert '<strong>berta.neu</strong>' in page
+    assert '<strong>berta</strong>' not in page
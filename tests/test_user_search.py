@@ -0,0 +1,95 @@
+"""users_fts: trigger sync and the matching rules of user_matches."""
+
+import random
+
+import pytest
+
+from app.services.user_service import fts_match_query, user_matches
+
+
+def matches(db, term):
+    sql, params = user_matches(term)
+    return {row[0] for row in db.execute(sql, params)}
+
+
+@pytest.fixture
+def staff(add_user):
+    return {
+        'mueller': add_user('j.mueller', first_name='Jürgen', last_name='Müller', employee_id='BTZ-000042',
+                            department='Küche'),
+        'weber': add_user('anna.weber', first_name='Anna', last_name='Weber', employee_id='BTZ-004711',
+                          department='Verwaltung'),
+        'yilmaz': add_user('e.yilmaz', first_name='Elif', last_name='Yılmaz', department='Holzwerkstatt'),
+    }
+
+
+def test_index_follows_inserts_updates_and_deletes(db, staff):
+    assert matches(db, 'weber') == {staff['weber']}
+
+    db.execute("UPDATE users SET last_name = 'Zzyzx' WHERE id = ?", (staff['weber'],))
+    db.execute('DELETE FROM users WHERE id = ?', (staff['mueller'],))
+    db.commit()
+
+    assert matches(db, 'zzyzx') == {staff['weber']}
+    assert matches(db, 'weber') == {staff['weber']}  # still in the username
+    assert matches(db, 'müller') == set()
+
+
+def test_words_are_prefixes_and_diacritics_are_ignored(db, staff):
+    assert matches(db, 'mül') == {staff['mueller']}
+    assert matches(db, 'jurgen') == {staff['mueller']}
+    assert matches(db, 'kuche') == {staff['mueller']}
+    assert matches(db, 'yilm') == {staff['yilmaz']}
+    assert matches(db, 'anna ver') == {staff['weber']}
+    assert matches(db, 'anna küche') == set()
+
+
+def test_numeric_terms_also_match_the_user_id(db, staff):
+    assert matches(db, str(staff['yilmaz'])) == {staff['yilmaz']}
+    # Neither an id nor the prefix of a word ('004711')
+    assert matches(db, '4711') == set()
+    assert matches(db, 'btz 000042') == {staff['mueller']}
+
+    sql, params = user_matches(str(staff['yilmaz']))
+    best = db.execute(f'SELECT id FROM ({sql}) ORDER BY rank LIMIT 1', params).fetchone()[0]
+    assert best == staff['yilmaz']
+
+
+def test_terms_without_words_match_nothing():
+    assert fts_match_query(' -*" ') is None
+    assert user_matches('"') == (None, [])
+
+
+def test_username_matches_rank_first(db, add_user):
+    by_department = add_user('k.koch', department='Garten')
+    by_username = add_user('garten.ben')
+
+    sql, params = user_matches('garten')
+    ranked = [row[0] for row in db.execute(f'SELECT id FROM ({sql}) ORDER BY rank', params)]
+
+    assert ranked == [by_username, by_department]
+
+
+def test_search_agrees_with_a_prefix_scan_of_many_users(db):
+    # The former __main__ benchmark data: every word of every indexed
+    # column is found by its prefixes and nothing else is
+    rng = random.Random(2000)
+    first_names = ['Anna', 'Ben', 'Clara', 'Elif', 'Greta', 'Jürgen', 'Lea']
+    last_names = ['Müller', 'Schmidt', 'Schneider', 'Weber', 'Yılmaz', 'Nowak', 'Popescu']
+    departments = ['Verwaltung', 'Holzwerkstatt', 'Metall', 'Küche', 'Lager']
+    users = {}
+    for number in range(1, 2001):
+        first, last = rng.choice(first_names), rng.choice(last_names)
+        department = rng.choice(departments)
+        user_id = db.execute('''
+            INSERT INTO users (username, password, first_name, last_name, employee_id, department)
+            VALUES (?, 'x', ?, ?, ?, ?)
+        ''', (f'{first}.{last}{number}'.lower(), first, last, f'BTZ-{number:06d}', department)).lastrowid
+        users[user_id] = (first, last, department)
+    db.commit()
+
+    for term, column in (('schm', 1), ('müll', 1), ('jurg', 0), ('kü', 2), ('holzw', 2)):
+        folded = term.replace('ü', 'u')
+        expected = {user_id for user_id, values in users.items()
+                    if values[column].lower().replace('ü', 'u').replace('ı', 'i').startswith(folded)}
+        assert expected and matches(db, term) & set(users) == expected, term